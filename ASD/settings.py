@@ -43,11 +43,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'libcloud.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'libcloud.quota.StorageQuotaMiddleware',
+    'libcloud.uploads.UploadLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,7 +59,8 @@ ROOT_URLCONF = 'ASD.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing renders for the request metrics.
+        'BACKEND': 'libcloud.metrics.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -66,7 +70,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'libcloud.views.get_lib'
+                'libcloud.context_processors.sidebar'
             ],
         },
     },
@@ -85,6 +89,30 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The default in-process cache suits a single worker; point CACHE_BACKEND at
+# django.core.cache.backends.filebased.FileBasedCache (or a shared cache) when
+# several processes serve the site.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'libcloud'),
+    }
+}
+
+LIBCLOUD_SIDEBAR_CACHE_TIMEOUT = 300
+# Cached fragments of the content and library pages are keyed on version
+# stamps that change with the data (libcloud/fragments.py); the timeout only
+# lets fragments of old versions expire.
+LIBCLOUD_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Rows per page of the keyset-paginated listings (?page_size= may ask for up
+# to LIBCLOUD_MAX_PAGE_SIZE).
+LIBCLOUD_PAGE_SIZE = 50
+LIBCLOUD_MAX_PAGE_SIZE = 200
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -124,6 +152,65 @@ STATIC_URL = 'static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = 'media/'
 
+# Downloads are streamed in blocks of this size. Set LIBCLOUD_DOWNLOAD_OFFLOAD to
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) to let the
+# front-end server send the file body instead of a Django worker.
+LIBCLOUD_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+LIBCLOUD_DOWNLOAD_OFFLOAD = os.environ.get('LIBCLOUD_DOWNLOAD_OFFLOAD')
+LIBCLOUD_DOWNLOAD_OFFLOAD_PREFIX = '/protected-media/'
+
+# Contents get a thumbnail and a preview image (Pillow; pdftoppm for PDFs and
+# ffmpeg for videos when installed) stored under user_<name>/derivatives/.
+# Their names change with the file, so browsers may keep them this long.
+LIBCLOUD_DERIVATIVE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Store uploads once per distinct content, under MEDIA_ROOT/.blobs.
+if os.environ.get('LIBCLOUD_DEDUP_STORAGE'):
+    DEFAULT_FILE_STORAGE = 'libcloud.storage.DeduplicatingStorage'
+
+# Form uploads are hashed and counted while they arrive and written next to
+# MEDIA_ROOT, so storing them is a rename. The files of one request stay in
+# memory while they add up to FILE_UPLOAD_MAX_MEMORY_SIZE. Bigger files should
+# use the chunked upload API (/uploads/), which these limits do not apply to.
+FILE_UPLOAD_HANDLERS = ['libcloud.uploads.StreamingUploadHandler']
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+DATA_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+LIBCLOUD_UPLOAD_MAX_FILE_SIZE = int(os.environ.get('LIBCLOUD_UPLOAD_MAX_FILE_SIZE', 1024 ** 3))
+LIBCLOUD_UPLOAD_MAX_REQUEST_SIZE = int(os.environ.get('LIBCLOUD_UPLOAD_MAX_REQUEST_SIZE', 2 * 1024 ** 3))
+
+# Bytes of uploads each user may store, unless their StorageUsage row (in the
+# admin) says otherwise. Unlimited when not set.
+LIBCLOUD_STORAGE_QUOTA = int(os.environ['LIBCLOUD_STORAGE_QUOTA']) if os.environ.get('LIBCLOUD_STORAGE_QUOTA') \
+    else None
+# Chunked upload sessions without a chunk for this long (seconds) stop
+# reserving quota, and `manage.py collect_garbage` deletes them.
+LIBCLOUD_UPLOAD_SESSION_EXPIRY = 7 * 24 * 60 * 60
+
+# `manage.py collect_garbage` leaves files younger than this (seconds) alone,
+# since uploads write their file before the row naming it is committed.
+LIBCLOUD_GC_GRACE_PERIOD = 24 * 60 * 60
+
+# Post-upload processing runs in `manage.py run_worker` processes. With
+# LIBCLOUD_TASKS_EAGER the jobs run in the web process after the commit.
+LIBCLOUD_TASKS_EAGER = os.environ.get('LIBCLOUD_TASKS_EAGER') == '1'
+# Running jobs whose worker went silent for this many seconds are queued again
+# (or failed, when that was their last attempt). Workers refresh the lock of the
+# job they run every third of it.
+LIBCLOUD_TASK_TIMEOUT = 600
+# Done jobs are deleted after this many seconds, failed ones after the second.
+LIBCLOUD_TASK_RETENTION = 7 * 24 * 60 * 60
+LIBCLOUD_TASK_FAILED_RETENTION = 30 * 24 * 60 * 60
+
+# Per-route latency, SQL and template time and body bytes, served in the
+# Prometheus format at /metrics/ (to staff users, or to requests carrying
+# "Authorization: Bearer <LIBCLOUD_METRICS_TOKEN>"). Several server processes
+# add up their numbers through files in LIBCLOUD_METRICS_DIR.
+LIBCLOUD_METRICS = os.environ.get('LIBCLOUD_METRICS', '1') == '1'
+LIBCLOUD_METRICS_DIR = os.environ.get('LIBCLOUD_METRICS_DIR')
+LIBCLOUD_METRICS_TOKEN = os.environ.get('LIBCLOUD_METRICS_TOKEN')
+# Report the timings of each response in a Server-Timing header.
+LIBCLOUD_SERVER_TIMING = os.environ.get('LIBCLOUD_SERVER_TIMING', '1') == '1'
+
 LOGIN_URL = '/login/'
 
 # Default primary key field type
@@ -132,6 +219,28 @@ LOGIN_URL = '/login/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 django_heroku.settings(locals(), test_runner=False)
+# django_heroku adds WhiteNoise, which is sync only: under ASGI every view
+# would then run through sync_to_async on a single thread per process.
+MIDDLEWARE = ['libcloud.staticfiles.StaticFilesMiddleware' if path == 'whitenoise.middleware.WhiteNoiseMiddleware'
+              else path for path in MIDDLEWARE]
+
+# django_heroku requires SSL from DATABASE_URL; a local Postgres (see
+# docker-compose.yml) may not offer it.
+if os.environ.get('DATABASE_SSLMODE'):
+    DATABASES['default'].setdefault('OPTIONS', {})['sslmode'] = os.environ['DATABASE_SSLMODE']
+
+# With DATABASE_POOL set, Postgres connections are pooled per process
+# (libcloud/db/postgresql_pool) and returned to the pool after every request.
+if os.environ.get('DATABASE_POOL') and DATABASES['default']['ENGINE'] in (
+        'django.db.backends.postgresql', 'django.db.backends.postgresql_psycopg2'):
+    DATABASES['default']['ENGINE'] = 'libcloud.db.postgresql_pool'
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+        'TIMEOUT': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        'MAX_LIFETIME': int(os.environ.get('DATABASE_POOL_MAX_LIFETIME', 1800)),
+        'HEALTH_CHECK': os.environ.get('DATABASE_POOL_HEALTH_CHECK', '1') == '1',
+    }
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 0))
 
 CSRF_TRUSTED_ORIGINS = [
     'https://libcloud.herokuapp.com'
@@ -0,0 +1,65 @@
+"""
+Production settings for ASD project.
+
+Select with DJANGO_SETTINGS_MODULE=ASD.settings_production; gunicorn.conf.py
+does so. Static files are collected into STATIC_ROOT (``staticfiles/``) and
+served compressed with hashed names by WhiteNoise, through its async-capable
+subclass in libcloud/staticfiles.py so that the ASGI profile stays async.
+"""
+import os
+
+from ASD.settings import *  # noqa: F401,F403
+from ASD.settings import BASE_DIR, DATABASES, MIDDLEWARE
+
+DEBUG = False
+
+SECRET_KEY = os.environ['SECRET_KEY']
+
+ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'libcloud.herokuapp.com,localhost,127.0.0.1').split(',')
+
+# 'wsgi' (threaded sync workers) or 'asgi' (uvicorn workers), see gunicorn.conf.py.
+LIBCLOUD_SERVER = os.environ.get('LIBCLOUD_SERVER', 'wsgi')
+
+# Keep database connections open between requests. Under ASGI every request
+# runs its sync code in a fresh thread, so a kept connection would never be
+# reused; there, and with a connection pool, the default is to give it back
+# after each request.
+for database in DATABASES.values():
+    reuse = LIBCLOUD_SERVER == 'wsgi' and 'POOL' not in database
+    database['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 600 if reuse else 0))
+
+MIDDLEWARE = list(MIDDLEWARE)
+if 'libcloud.staticfiles.StaticFilesMiddleware' not in MIDDLEWARE:
+    MIDDLEWARE.insert(1, 'libcloud.staticfiles.StaticFilesMiddleware')
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Hashed names never change content, so browsers may keep them for a year.
+WHITENOISE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Every process has its own memory, so the cache has to live somewhere all of
+# them see its invalidations, those of the job worker (run_worker) included.
+# REDIS_URL, as set by the Heroku Redis add-on and docker-compose, selects
+# Redis; the file cache is only shared by processes on the same filesystem,
+# not by the dynos or containers of the web and worker processes.
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.redis.RedisCache' if REDIS_URL
+                                  else 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', REDIS_URL or '/tmp/libcloud-cache'),
+    }
+}
+
+# Timings tell a visitor more about the server than they need to know.
+LIBCLOUD_SERVER_TIMING = os.environ.get('LIBCLOUD_SERVER_TIMING') == '1'
+
+# Behind the Heroku router (or another TLS terminating proxy).
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+SESSION_COOKIE_SECURE = CSRF_COOKIE_SECURE = os.environ.get('LIBCLOUD_HTTPS', '1') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'root': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO')},
+}
@@ -0,0 +1,42 @@
+"""
+gunicorn configuration of the production profile.
+
+LIBCLOUD_SERVER=wsgi (default) runs threaded sync workers on ASD.wsgi;
+LIBCLOUD_SERVER=asgi runs uvicorn workers on ASD.asgi, where the async
+download view holds slow clients without tying up a thread each (sync views
+still run in threads there). WEB_CONCURRENCY and GUNICORN_THREADS override the
+worker and thread counts.
+"""
+import multiprocessing
+import os
+import tempfile
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ASD.settings_production')
+
+server = os.environ.get('LIBCLOUD_SERVER', 'wsgi')
+
+# Workers share their request metrics through this directory (set before the
+# application is loaded), so /metrics/ covers all of them.
+os.environ.setdefault('LIBCLOUD_METRICS_DIR', tempfile.mkdtemp(prefix='libcloud-metrics-'))
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+# One process per core plus one; each worker is single threaded in Python
+# code anyway, the threads only cover time spent waiting on I/O.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+if server == 'asgi':
+    wsgi_app = 'ASD.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'ASD.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Load the application once in the master and fork it into the workers.
+preload_app = True
+# Recycle workers now and then so a slow leak can't grow without bound.
+max_requests = 2000
+max_requests_jitter = 200
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
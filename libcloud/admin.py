@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from libcloud.models import Library, Content, ContentFeature, Attachment, AttachmentType, ContentTypeFeature, ContentType
+from libcloud.models import Library, Content, ContentFeature, Attachment, AttachmentType, ContentTypeFeature, ContentType, \
+    Job, StorageUsage
 
 admin.site.register(Content)
 admin.site.register(ContentFeature)
@@ -9,3 +10,5 @@ admin.site.register(Library)
 admin.site.register(ContentType)
 admin.site.register(AttachmentType)
 admin.site.register(ContentTypeFeature)
+admin.site.register(Job)
+admin.site.register(StorageUsage)
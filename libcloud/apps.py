@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LibcloudConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'libcloud'
+
+    def ready(self):
+        from libcloud import signals  # noqa: F401
@@ -0,0 +1,38 @@
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler as DjangoASGIHandler
+
+
+class ASGIHandler(DjangoASGIHandler):
+    """
+    ASGI handler that keeps file reads off the event loop.
+
+    Django iterates streaming responses synchronously inside the event loop,
+    so every block of a FileResponse is read from disk while all other
+    connections of the process wait. Here each block is read in a worker
+    thread and the loop only awaits the client, so a slow download costs a
+    coroutine rather than a thread or a worker process.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [(str(header).encode('ascii'), str(value).encode('latin1')) for header, value in response.items()]
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=False)
+        while True:
+            part = await next_part(parts, None)
+            if part is None:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,136 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import override_settings
+
+from libcloud.asgi import ASGIHandler
+
+
+class Streams:
+    """Counts the downloads in flight and the threads of the process while they run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = self.peak = self.completed = self.bytes = 0
+        self.peak_threads = threading.active_count()
+
+    def started(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def received(self, size):
+        with self.lock:
+            self.bytes += size
+
+    def finished(self):
+        with self.lock:
+            self.active -= 1
+            self.completed += 1
+
+
+async def asgi_download(application, path, delay, streams):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            await asyncio.Event().wait()
+        request_sent = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            streams.started()
+        elif message.get('more_body'):
+            streams.received(len(message['body']))
+            # A slow client: every block takes ``delay`` seconds to go out.
+            await asyncio.sleep(delay)
+        else:
+            streams.finished()
+
+    await application(scope, receive, send)
+
+
+def wsgi_download(application, path, delay, streams):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+    }
+    body = application(environ, lambda status, headers: None)
+    streams.started()
+    try:
+        for chunk in body:
+            streams.received(len(chunk))
+            time.sleep(delay)
+    finally:
+        body.close()
+        streams.finished()
+
+
+def run_asgi(path, clients, delay):
+    application = ASGIHandler()
+    streams = Streams()
+
+    async def main():
+        await asyncio.gather(*(asgi_download(application, path, delay, streams) for _ in range(clients)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return streams, time.perf_counter() - started
+
+
+def run_wsgi(path, clients, delay, workers):
+    application = WSGIHandler()
+    streams = Streams()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(wsgi_download, application, path, delay, streams) for _ in range(clients)]:
+            future.result()
+    return streams, time.perf_counter() - started
+
+
+def compare(clients=100, size=1024 * 1024, delay=0.02, workers=4):
+    """
+    Serve ``clients`` concurrent downloads of a ``size`` byte file to clients
+    that take ``delay`` seconds per 64 KiB block, once through the async
+    download view under the ASGI handler and once through the WSGI handler
+    with ``workers`` sync workers (threads standing in for worker processes).
+    """
+    name = default_storage.save('bench/download.bin', ContentFile(os.urandom(size)))
+    path = '/' + settings.MEDIA_URL.strip('/') + '/' + name
+    results = []
+    try:
+        with override_settings(LIBCLOUD_DOWNLOAD_OFFLOAD=None, LIBCLOUD_DOWNLOAD_CHUNK_SIZE=64 * 1024):
+            runs = [('asgi', None, lambda: run_asgi(path, clients, delay)),
+                    ('wsgi', workers, lambda: run_wsgi(path, clients, delay, workers))]
+            for mode, pool_size, run in runs:
+                streams, seconds = run()
+                results.append({
+                    'mode': mode,
+                    'workers': pool_size,
+                    'clients': clients,
+                    'completed': streams.completed,
+                    'megabytes': round(streams.bytes / 1024 / 1024, 1),
+                    'seconds': round(seconds, 3),
+                    'peak_concurrent_downloads': streams.peak,
+                    'peak_threads': streams.peak_threads,
+                })
+    finally:
+        default_storage.delete(name)
+    return results
@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.db import connection
+
+from libcloud.models import Content, ContentFeature, Library
+
+# The composite indexes added for the hot queries, by model.
+INDEXES = [
+    (Content, 'content_creator_id_idx'),
+    (Library, 'library_user_type_idx'),
+    (ContentFeature, 'feature_content_type_idx'),
+]
+
+
+def hot_queries(user):
+    """The queries the indexes were designed for, as (name, queryset) pairs."""
+    library = Library.objects.filter(user=user).order_by('id').first()
+    content = Content.objects.filter(creator=user).order_by('id').first()
+    feature = ContentFeature.objects.filter(content=content).order_by('id').first()
+    return [
+        ('recent contents (home page)', Content.objects.filter(creator=user).order_by('-id')[:5]),
+        ('my contents page', Content.objects.filter(creator=user).order_by('-id')[:100]),
+        ('libraries of a content type', Library.objects.filter(user=user, content_type=library.content_type_id)),
+        ('libraries by size', Library.objects.filter(user=user).order_by('-content_count')),
+        ('feature of a content', ContentFeature.objects.filter(content=content, feature_type=feature.feature_type_id)),
+    ]
+
+
+def time_queryset(queryset, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(queryset.all())
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def measure(user, repeat):
+    return [{'query': name, 'plan': queryset.explain(), 'median_ms': time_queryset(queryset, repeat)}
+            for name, queryset in hot_queries(user)]
+
+
+def set_indexes(enabled):
+    """
+    Drop or create the composite indexes, skipping those already in that
+    state, so that a run killed while they were dropped is repaired by the
+    next one (or by ``set_indexes(True)``).
+    """
+    with connection.cursor() as cursor:
+        existing = {model: set(connection.introspection.get_constraints(cursor, model._meta.db_table))
+                    for model, _ in INDEXES}
+    with connection.schema_editor() as editor:
+        for model, name in INDEXES:
+            if (name in existing[model]) == enabled:
+                continue
+            index = next(index for index in model._meta.indexes if index.name == name)
+            if enabled:
+                editor.add_index(model, index)
+            else:
+                editor.remove_index(model, index)
+
+
+def analyze():
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def compare(user, repeat=20):
+    """Measure the hot queries without and then with the composite indexes."""
+    set_indexes(True)
+    set_indexes(False)
+    try:
+        analyze()
+        before = measure(user, repeat)
+    finally:
+        set_indexes(True)
+    analyze()
+    after = measure(user, repeat)
+    return [dict(query=b['query'], before_ms=b['median_ms'], after_ms=a['median_ms'],
+                 plan_before=b['plan'], plan_after=a['plan']) for b, a in zip(before, after)]
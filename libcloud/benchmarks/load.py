@@ -0,0 +1,184 @@
+import http.client
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+
+from libcloud.models import Content, ContentType
+
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+# How each serving profile is started; {port} is filled in.
+PROFILES = {
+    'dev': {
+        'command': [sys.executable, 'manage.py', 'runserver', '--noreload', '127.0.0.1:{port}'],
+        'env': {'DJANGO_SETTINGS_MODULE': 'ASD.settings'},
+    },
+    'production': {
+        'command': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:{port}'],
+        'env': {'DJANGO_SETTINGS_MODULE': 'ASD.settings_production', 'LIBCLOUD_HTTPS': '0'},
+    },
+    'production-asgi': {
+        'command': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:{port}'],
+        'env': {'DJANGO_SETTINGS_MODULE': 'ASD.settings_production', 'LIBCLOUD_HTTPS': '0',
+                'LIBCLOUD_SERVER': 'asgi'},
+    },
+}
+
+
+class Client:
+    """A keep-alive HTTP client that carries the session and CSRF cookies."""
+
+    def __init__(self, host, port):
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+        self.cookies = SimpleCookie()
+
+    def send(self, method, path, body=None, headers=None):
+        """Send a request and return the response, whose body the caller reads."""
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % (key, morsel.value) for key, morsel in self.cookies.items())
+        if method not in ('GET', 'HEAD') and 'csrftoken' in self.cookies:
+            headers.setdefault('X-CSRFToken', self.cookies['csrftoken'].value)
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(cookie)
+        return response
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.send(method, path, body, headers)
+        return response.status, response.read()
+
+    def login(self, username, password):
+        status, page = self.request('GET', '/login/')
+        token = CSRF_RE.search(page.decode()).group(1)
+        body = urlencode({'csrfmiddlewaretoken': token, 'username': username, 'password': password})
+        status, _ = self.request('POST', '/login/', body=body,
+                                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        if status != 302:
+            raise RuntimeError("login as %s failed with status %s" % (username, status))
+
+    def close(self):
+        self.connection.close()
+
+
+def load_data(username='loadtest', password='loadtest-password'):
+    """The user the load test logs in as and one of its contents, created on first use."""
+    user, created = User.objects.get_or_create(username=username)
+    if created:
+        user.set_password(password)
+        user.save()
+    content = Content.objects.filter(creator=user).first()
+    if content is None:
+        content_type = ContentType.objects.create(user=user, name='loadtest')
+        content = Content.objects.create(creator=user, type=content_type, file=ContentFile(b"load", 'load.txt'))
+    return username, password, ['/', content.get_absolute_url()]
+
+
+def hammer(host, port, path, username, password, concurrency, duration):
+    """Request ``path`` from ``concurrency`` logged-in clients for ``duration`` seconds."""
+    timings, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        client = Client(host, port)
+        try:
+            client.login(username, password)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                status, _ = client.request('GET', path)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    (timings if status == 200 else errors).append(elapsed)
+        except (OSError, http.client.HTTPException, RuntimeError, AttributeError) as e:
+            with lock:
+                errors.append(e)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    timings.sort()
+    return {
+        'path': path,
+        'requests': len(timings),
+        'errors': len(errors),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings) * 1000, 2) if timings else None,
+        'p95_ms': round(timings[int(len(timings) * 0.95)] * 1000, 2) if timings else None,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited with status %s" % process.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start listening on port %d" % port)
+
+
+def start_profile(name, static_root, workers=None, env=None):
+    profile = PROFILES[name]
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), STATIC_ROOT=static_root, **profile['env'], **(env or {}))
+    env.setdefault('SECRET_KEY', settings.SECRET_KEY)
+    if workers:
+        env['WEB_CONCURRENCY'] = str(workers)
+    if profile['env']['DJANGO_SETTINGS_MODULE'] == 'ASD.settings_production':
+        subprocess.run([sys.executable, 'manage.py', 'collectstatic', '--noinput', '-v', '0'],
+                       env=env, cwd=settings.BASE_DIR, check=True)
+    command = [part.format(port=port) for part in profile['command']]
+    process = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port, process)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process, port
+
+
+def run(profiles, concurrency=8, duration=10, workers=None):
+    """Start every profile in turn and measure req/s of the home page and a content page."""
+    username, password, paths = load_data()
+    results = []
+    with tempfile.TemporaryDirectory() as static_root:
+        for name in profiles:
+            process, port = start_profile(name, static_root, workers)
+            try:
+                for path in paths:
+                    result = hammer('127.0.0.1', port, path, username, password, concurrency, duration)
+                    results.append(dict(result, profile=name))
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+    return results
@@ -0,0 +1,80 @@
+import statistics
+import threading
+import time
+
+from django.db import connection
+from django.db.utils import load_backend
+
+from libcloud.models import Content
+
+POOL_ENGINE = 'libcloud.db.postgresql_pool'
+
+# How the database connection is handled between requests, per mode.
+MODES = {
+    'new connection per request': {'CONN_MAX_AGE': 0},
+    'persistent (CONN_MAX_AGE)': {'CONN_MAX_AGE': 600},
+    'pooled': {'CONN_MAX_AGE': 0, 'ENGINE': POOL_ENGINE},
+}
+
+
+def wrapper(mode, alias, threads):
+    # Whatever the configured engine, only the pooled mode may use the pool.
+    settings_dict = dict(connection.settings_dict, ENGINE='django.db.backends.postgresql')
+    settings_dict.update(MODES[mode])
+    if settings_dict['ENGINE'] == POOL_ENGINE:
+        settings_dict['POOL'] = dict(settings_dict.get('POOL') or {}, MAX_SIZE=threads)
+    else:
+        settings_dict.pop('POOL', None)
+    return load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, alias)
+
+
+def simulate(mode, sql, params, requests, threads):
+    """
+    Run ``requests`` simulated requests per thread: connect if needed, run the
+    query of the home page, then do what Django does when a request finishes.
+    Returns the per-request latencies in milliseconds.
+    """
+    timings = []
+    lock = threading.Lock()
+
+    def worker(index):
+        db = wrapper(mode, 'bench_%d' % index, threads)
+        local = []
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                with db.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                db.close_if_unusable_or_obsolete()
+                local.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.close()
+        with lock:
+            timings.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return timings
+
+
+def compare(requests=500, threads=4):
+    """Per-request latency of a typical query with each connection handling mode."""
+    if connection.vendor != 'postgresql':
+        raise ValueError("the pooling benchmark needs a PostgreSQL database, not %s" % connection.vendor)
+    user_id = Content.objects.values_list('creator_id', flat=True).first() or 0
+    sql, params = Content.objects.filter(creator=user_id).order_by('-id')[:5].query.sql_with_params()
+    results = []
+    for mode in MODES:
+        timings = sorted(simulate(mode, sql, params, requests, threads))
+        results.append({
+            'mode': mode,
+            'requests': len(timings),
+            'threads': threads,
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[int(len(timings) * 0.95)], 3),
+        })
+    return results
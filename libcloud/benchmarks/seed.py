@@ -0,0 +1,116 @@
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from libcloud.models import Attachment, AttachmentType, Content, ContentFeature, ContentType, ContentTypeFeature, \
+    Library
+from libcloud.search import index_contents
+from libcloud.sidebar import invalidate_library_summary
+
+FEATURE_TYPES = [ContentTypeFeature.FeatureType.Number, ContentTypeFeature.FeatureType.String,
+                 ContentTypeFeature.FeatureType.Boolean]
+
+
+def feature_value(feature_type, i):
+    if feature_type == ContentTypeFeature.FeatureType.Number:
+        return str(float(i % 1000))
+    if feature_type == ContentTypeFeature.FeatureType.Boolean:
+        return "1" if i % 2 else "2"
+    return "value %d" % (i % 997)
+
+
+def describe_database():
+    """The configured database, for the confirmation the seeding commands ask for."""
+    return '%s database %s' % (connection.vendor, connection.settings_dict['NAME'])
+
+
+class Seeder:
+    """
+    Bulk-insert synthetic users, libraries, contents, features and attachments.
+
+    Rows are written with bulk_create in batches, bypassing model validation and
+    signals, and point at file names that do not exist on disk. Seeded users
+    are named ``<prefix>_<n>`` so a run can be found and reused later.
+    """
+
+    def __init__(self, users=1, libraries=10, contents=1000, features=3, attachments=0,
+                 content_types=2, batch_size=5000, prefix='bench'):
+        self.users = users
+        self.libraries = libraries
+        self.contents = contents
+        self.features = features
+        self.attachments = attachments
+        self.content_types = content_types
+        self.batch_size = batch_size
+        self.prefix = prefix
+
+    def seeded_users(self):
+        return User.objects.filter(username__startswith='%s_' % self.prefix)
+
+    def is_seeded(self):
+        users = list(self.seeded_users())
+        return len(users) >= self.users and all(
+            Content.objects.filter(creator=user).count() >= self.contents for user in users[:self.users])
+
+    def run(self):
+        users = []
+        for n in range(self.users):
+            user, _ = User.objects.get_or_create(username='%s_%d' % (self.prefix, n))
+            self.seed_user(user)
+            invalidate_library_summary(user.pk)
+            users.append(user)
+        self.count_contents()
+        return users
+
+    def seed_user(self, user):
+        attachment_type, _ = AttachmentType.objects.get_or_create(user=user, name='attachment')
+        content_types = []
+        for n in range(self.content_types):
+            content_type, created = ContentType.objects.get_or_create(user=user, name='type %d' % n)
+            if created:
+                content_type.attachment_types.add(attachment_type)
+                ContentTypeFeature.objects.bulk_create(
+                    ContentTypeFeature(content_type=content_type, name='feature %d' % f,
+                                       type=FEATURE_TYPES[f % len(FEATURE_TYPES)])
+                    for f in range(self.features))
+            content_types.append((content_type, list(content_type.contenttypefeature_set.order_by('id'))))
+
+        libraries = list(Library.objects.filter(user=user).order_by('id'))
+        for n in range(len(libraries), self.libraries):
+            libraries.append(Library.objects.create(user=user, name='library %d' % n,
+                                                    content_type=content_types[n % len(content_types)][0]))
+
+        existing = Content.objects.filter(creator=user).count()
+        for start in range(existing, self.contents, self.batch_size):
+            with transaction.atomic():
+                self.seed_batch(user, content_types, libraries, attachment_type,
+                                range(start, min(start + self.batch_size, self.contents)))
+
+    def seed_batch(self, user, content_types, libraries, attachment_type, numbers):
+        contents = []
+        for i in numbers:
+            library = libraries[i % len(libraries)] if libraries else None
+            content_type = library.content_type if library else content_types[i % len(content_types)][0]
+            contents.append(Content(creator=user, type=content_type, library=library,
+                                    file='user_%s/file_%d.txt' % (user.username, i)))
+        contents = Content.objects.bulk_create(contents)
+        feature_types = dict((content_type.pk, features) for content_type, features in content_types)
+
+        features = [ContentFeature(content=content, feature_type=feature_type,
+                                   value=feature_value(feature_type.type, i))
+                    for i, content in zip(numbers, contents)
+                    for feature_type in feature_types[content.type_id]]
+        for feature in features:
+            feature.fill_typed_value()
+        ContentFeature.objects.bulk_create(features)
+        Attachment.objects.bulk_create(
+            Attachment(content=content, type=attachment_type,
+                       file='user_%s/file_%d_attachment_%d.txt' % (user.username, i, a))
+            for i, content in zip(numbers, contents)
+            for a in range(self.attachments))
+        index_contents(content.pk for content in contents)
+
+    def count_contents(self):
+        counts = Content.objects.filter(library=OuterRef('pk')).values('library').annotate(n=Count('pk')).values('n')
+        Library.objects.filter(user__in=self.seeded_users()).update(content_count=Coalesce(Subquery(counts), 0))
@@ -0,0 +1,345 @@
+import json
+import os
+import re
+import subprocess
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client as TestClient
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from django.utils import timezone
+
+from libcloud.benchmarks import load
+from libcloud.benchmarks.seed import Seeder, feature_value
+from libcloud.models import Content, Library
+from libcloud.storage import DeduplicatingStorage
+
+PASSWORD = 'benchmark-password'
+PAGE_SCENARIOS = ('home_page', 'library_detail', 'content_detail', 'create_content')
+FILE_SCENARIOS = ('upload', 'download')
+SCENARIOS = PAGE_SCENARIOS + FILE_SCENARIOS
+
+SERVER_TIMING_RE = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+SIZE_RE = re.compile(r'^(\d+)([KMG]?)$')
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# Metrics compared against a baseline run; a limit on the last one is a minimum.
+COMPARED = ('p50_ms', 'p95_ms', 'queries', 'megabytes_per_second')
+HIGHER_IS_BETTER = ('megabytes_per_second',)
+
+Response = namedtuple('Response', 'status body size queries')
+
+
+def parse_size(value):
+    """``'10M'`` as a number of bytes."""
+    match = SIZE_RE.match(value.strip().upper())
+    if match is None:
+        raise ValueError("invalid size %r, expected a number with an optional K, M or G suffix" % value)
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def parse_queries(server_timing):
+    match = SERVER_TIMING_RE.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+class ClientTarget:
+    """Requests through Django's test client, in this process."""
+    name = 'client'
+
+    def __init__(self, user):
+        self.client = TestClient()
+        self.client.force_login(user)
+
+    def request(self, method, path, body=b'', headers=None, discard=False):
+        headers = dict(headers or {})
+        content_type = headers.pop('Content-Type', 'application/octet-stream')
+        extra = {'HTTP_' + key.upper().replace('-', '_'): value for key, value in headers.items()}
+        response = self.client.generic(method, path, body, content_type=content_type, **extra)
+        if response.streaming:
+            body = b''
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            body = response.content
+            size = len(body)
+        # The test client closes the response itself; closing it again would
+        # send request_finished and close the database connection.
+        return Response(response.status_code, b'' if discard else body, size,
+                        parse_queries(response.get('Server-Timing')))
+
+    def close(self):
+        pass
+
+
+class ServerTarget:
+    """Requests over HTTP to the app started under one of the load test profiles."""
+
+    def __init__(self, profile, username, static_root, workers=None):
+        self.name = 'server:%s' % profile
+        self.process, port = load.start_profile(profile, static_root, workers, env={'LIBCLOUD_SERVER_TIMING': '1'})
+        self.client = load.Client('127.0.0.1', port)
+        try:
+            self.client.login(username, PASSWORD)
+        except Exception:
+            self.close()
+            raise
+
+    def request(self, method, path, body=b'', headers=None, discard=False):
+        response = self.client.send(method, path, body, headers)
+        chunks, size = [], 0
+        while True:
+            block = response.read(1024 * 1024)
+            if not block:
+                break
+            size += len(block)
+            if not discard:
+                chunks.append(block)
+        return Response(response.status, b''.join(chunks), size, parse_queries(response.getheader('Server-Timing')))
+
+    def close(self):
+        self.client.close()
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+class Data:
+    """The seeded rows the scenarios request, and the files they upload."""
+
+    def __init__(self, user):
+        self.user = user
+        self.library = Library.objects.filter(user=user, content_count__gt=0).select_related('content_type') \
+            .order_by('id').first()
+        if self.library is None:
+            raise ValueError("%s has no library with contents; seed some first" % user.username)
+        self.content_type = self.library.content_type
+        self.features = list(self.content_type.contenttypefeature_set.order_by('id'))
+        self.content = Content.objects.filter(library=self.library).order_by('id').first()
+        self.last_pk = Content.objects.order_by('-pk').values_list('pk', flat=True).first()
+        self.files = {}
+
+    def feature_values(self):
+        return {feature.name: feature_value(feature.type, n) for n, feature in enumerate(self.features)}
+
+    def discard_created(self):
+        """Delete the contents the scenarios created, files included."""
+        for content in Content.objects.filter(creator=self.user, pk__gt=self.last_pk):
+            name, storage = content.file.name, content.file.storage
+            content.delete()
+            if not isinstance(storage, DeduplicatingStorage):
+                storage.delete(name)
+
+
+def seed(**scale):
+    """Seed ``scale`` rows (see Seeder) and return the user the scenarios log in as."""
+    user = Seeder(**scale).run()[0]
+    user.set_password(PASSWORD)
+    user.save()
+    return user
+
+
+def get_page(path):
+    def scenario(target, data):
+        response = target.request('GET', path)
+        return response.status == 200, [response]
+    return scenario
+
+
+def create_content(target, data):
+    fields = {
+        'content-type': data.content_type.pk,
+        'content-library': data.library.pk,
+        'content-file': SimpleUploadedFile('benchmark.txt', b"benchmark"),
+        'feature-TOTAL_FORMS': len(data.features),
+        'feature-INITIAL_FORMS': len(data.features),
+        'attachment-TOTAL_FORMS': 0,
+        'attachment-INITIAL_FORMS': 0,
+    }
+    values = data.feature_values()
+    for n, feature in enumerate(data.features):
+        fields.update({
+            'feature-%d-id' % n: feature.pk,
+            'feature-%d-name' % n: feature.name,
+            'feature-%d-type' % n: feature.get_type_display(),
+            'feature-%d-required' % n: 'Required',
+            'feature-%d-value' % n: values[feature.name],
+        })
+    path = reverse('libcloud:create_content_with_pk', kwargs={'content_type_pk': data.content_type.pk})
+    response = target.request('POST', path, encode_multipart(BOUNDARY, fields), {'Content-Type': MULTIPART_CONTENT})
+    # The view answers 200 either way; only the message tells success apart.
+    return response.status == 200 and b"content has been created." in response.body, [response]
+
+
+def upload(size):
+    def scenario(target, data):
+        body = {'filename': 'benchmark-%d.bin' % size, 'size': size, 'content_type': data.content_type.pk,
+                'library': data.library.pk}
+        response = target.request('POST', reverse('libcloud:upload_init'), json.dumps(body),
+                                  {'Content-Type': 'application/json'})
+        if response.status != 201:
+            return False, [response]
+        session = json.loads(response.body)
+        responses = [response]
+        block = os.urandom(min(session['chunk_size'], size))
+        for offset in range(0, size, len(block)):
+            chunk = block[:size - offset]
+            responses.append(target.request('PUT', session['chunk_url'], chunk, {
+                'Content-Type': 'application/octet-stream',
+                'Content-Range': 'bytes %d-%d/%d' % (offset, offset + len(chunk) - 1, size),
+            }))
+        finalize = json.dumps({'features': data.feature_values()})
+        responses.append(target.request('POST', session['finalize_url'], finalize, {'Content-Type': 'application/json'}))
+        ok = all(response.status in (200, 201) for response in responses)
+        if ok:
+            data.files[size] = json.loads(responses[-1].body)['file']
+        return ok, responses
+    return scenario
+
+
+def download(size):
+    def scenario(target, data):
+        response = target.request('GET', data.files[size], discard=True)
+        return response.status == 200 and response.size == size, [response]
+    return scenario
+
+
+def summarize(target, scenario, timings, errors, queries, size):
+    timings = sorted(timings)
+    result = {
+        'target': target,
+        'scenario': scenario,
+        'iterations': len(timings),
+        'errors': errors,
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 2) if timings else None,
+        'p95_ms': round(timings[int(len(timings) * 0.95)] * 1000, 2) if timings else None,
+        'max_ms': round(timings[-1] * 1000, 2) if timings else None,
+        # Taken from Server-Timing, so None where the app does not send it.
+        'queries': max(queries) if queries and None not in queries else None,
+    }
+    if size:
+        result['bytes'] = size
+        result['megabytes_per_second'] = round(size * len(timings) / sum(timings) / 1024 ** 2, 1) if timings else None
+    return result
+
+
+def measure(target, name, scenario, data, repeat, size=0, warmup=0):
+    for _ in range(warmup):
+        scenario(target, data)
+    timings, queries, errors = [], [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ok, responses = scenario(target, data)
+        elapsed = time.perf_counter() - start
+        if not ok:
+            errors += 1
+            continue
+        timings.append(elapsed)
+        counts = [response.queries for response in responses]
+        queries.append(None if None in counts else sum(counts))
+    return summarize(target.name, name, timings, errors, queries, size)
+
+
+def run_scenarios(target, data, scenarios=SCENARIOS, repeat=20, file_repeat=1, sizes=()):
+    """Time each of ``scenarios`` ``repeat`` times (files: ``file_repeat`` times per size) against ``target``."""
+    pages = {
+        'home_page': get_page(reverse('libcloud:homepage')),
+        'library_detail': get_page(reverse('libcloud:each_library', kwargs={'pk': data.library.pk})),
+        'content_detail': get_page(data.content.get_absolute_url()),
+        'create_content': create_content,
+    }
+    results = []
+    for name in PAGE_SCENARIOS:
+        if name in scenarios:
+            # One unmeasured request first, so that caches are as warm as they are in use.
+            results.append(measure(target, name, pages[name], data, repeat, warmup=1))
+    for size in sizes:
+        if 'upload' in scenarios or 'download' in scenarios:
+            result = measure(target, 'upload_%s' % format_size(size), upload(size), data, file_repeat, size)
+            if 'upload' in scenarios:
+                results.append(result)
+        if 'download' in scenarios and size in data.files:
+            results.append(measure(target, 'download_%s' % format_size(size), download(size), data, file_repeat,
+                                   size))
+    return results
+
+
+def format_size(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return '%d%s' % (size // UNITS[unit], unit)
+    return str(size)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(scale, results):
+    return {
+        'commit': git_commit(),
+        'created': timezone.now().isoformat(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'scale': scale,
+        'results': results,
+    }
+
+
+def check(report, thresholds=None, baseline=None, tolerance=0.25):
+    """
+    The ways the results in ``report`` fail ``thresholds`` or regress from the
+    ``baseline`` report, as messages.
+
+    Thresholds map a scenario name, or ``<target>/<scenario>``, to limits on
+    its metrics, e.g. ``{"content_detail": {"p95_ms": 150, "queries": 12}}``.
+    Against a baseline, timings may be ``tolerance`` worse; query counts may
+    not grow at all.
+    """
+    failures = []
+    previous = {(result['target'], result['scenario']): result for result in (baseline or {}).get('results', [])}
+    for result in report['results']:
+        label = '%s/%s' % (result['target'], result['scenario'])
+        if result['errors']:
+            failures.append("%s: %d of %d iterations failed" % (
+                label, result['errors'], result['errors'] + result['iterations']))
+        limits = dict((thresholds or {}).get(result['scenario'], {}), **(thresholds or {}).get(label, {}))
+        for metric, limit in limits.items():
+            failure = compare_metric(label, metric, result.get(metric), limit)
+            if failure:
+                failures.append(failure)
+        before = previous.get((result['target'], result['scenario']))
+        if before is None:
+            continue
+        for metric in COMPARED:
+            if before.get(metric) is None:
+                continue
+            if metric == 'queries':
+                limit = before[metric]
+            elif metric in HIGHER_IS_BETTER:
+                limit = before[metric] * (1 - tolerance)
+            else:
+                limit = before[metric] * (1 + tolerance)
+            failure = compare_metric(label, metric, result.get(metric), limit, before[metric])
+            if failure:
+                failures.append(failure)
+    return failures
+
+
+def compare_metric(label, metric, value, limit, baseline=None):
+    if value is None:
+        return None
+    if metric in HIGHER_IS_BETTER:
+        failed, sign = value < limit, '<'
+    else:
+        failed, sign = value > limit, '>'
+    if not failed:
+        return None
+    message = "%s: %s %s %s %s" % (label, metric, value, sign, round(limit, 2))
+    if baseline is not None:
+        message += " (baseline %s)" % baseline
+    return message
@@ -0,0 +1,352 @@
+import csv
+import io
+import json
+import os
+import tarfile
+import zipfile
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+
+from libcloud.fragments import bump_versions
+from libcloud.models import Attachment, Content, ContentFeature, Library, adjust_content_count, adjust_storage_usage
+from libcloud.processing import schedule_processing
+from libcloud.quota import check_quota
+from libcloud.search import index_contents
+from libcloud.sidebar import invalidate_library_summary
+from libcloud.uploads import clean_feature_value
+from libcloud.validation import BatchValidator
+
+MANIFEST_NAMES = ('manifest.jsonl', 'manifest.csv')
+
+
+class DirectorySource:
+    def __init__(self, path):
+        self.root = os.path.abspath(path)
+
+    def path(self, name):
+        path = os.path.abspath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            raise KeyError(name)
+        return path
+
+    def exists(self, name):
+        try:
+            return os.path.isfile(self.path(name))
+        except KeyError:
+            return False
+
+    def open(self, name):
+        if not self.exists(name):
+            raise KeyError(name)
+        return open(self.path(name), 'rb')
+
+    def size(self, name):
+        return os.path.getsize(self.path(name))
+
+    def close(self):
+        pass
+
+
+class ZipSource:
+    def __init__(self, file):
+        self.archive = zipfile.ZipFile(file)
+        self.names = {info.filename for info in self.archive.infolist() if not info.is_dir()}
+
+    def exists(self, name):
+        return name in self.names
+
+    def open(self, name):
+        return self.archive.open(name)
+
+    def size(self, name):
+        return self.archive.getinfo(name).file_size
+
+    def close(self):
+        self.archive.close()
+
+
+class TarSource:
+    def __init__(self, file):
+        if isinstance(file, str):
+            self.archive = tarfile.open(file)
+        else:
+            self.archive = tarfile.open(fileobj=file)
+        self.names = {member.name for member in self.archive.getmembers() if member.isfile()}
+
+    def exists(self, name):
+        return name in self.names
+
+    def open(self, name):
+        member = self.archive.getmember(name)
+        if not member.isfile():
+            raise KeyError(name)
+        return self.archive.extractfile(member)
+
+    def size(self, name):
+        return self.archive.getmember(name).size
+
+    def close(self):
+        self.archive.close()
+
+
+def open_source(source):
+    """The directory, zip or tar archive (a path or a binary file) the manifest refers to."""
+    if isinstance(source, str) and os.path.isdir(source):
+        return DirectorySource(source)
+    if zipfile.is_zipfile(source):
+        return ZipSource(source)
+    if not isinstance(source, str):
+        source.seek(0)
+    if tarfile.is_tarfile(source):
+        if not isinstance(source, str):
+            source.seek(0)
+        return TarSource(source)
+    raise ValidationError("the source is neither a directory nor a zip or tar archive")
+
+
+def parse_attachments(value):
+    attachments = []
+    for item in filter(None, (part.strip() for part in value.split(';'))):
+        type, _, file = item.partition('=')
+        attachments.append({'type': type.strip(), 'file': file.strip()})
+    return attachments
+
+
+def read_manifest(fileobj, name):
+    """
+    Yield manifest rows as dicts with file, content_type, library, features and attachments.
+
+    JSONL rows carry ``features`` as an object and ``attachments`` as a list of
+    ``{"type", "file"}`` objects; they are yielded as the raw line and decoded
+    by BulkImporter.parse, so that a bad line only rejects its row. CSV rows use
+    ``feature:<name>`` columns and an ``attachments`` column of ``type=path``
+    pairs separated by ``;``.
+    """
+    if not name.endswith('.csv'):
+        for line in fileobj:
+            if line.strip():
+                yield line
+        return
+    reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding='utf-8', newline=''))
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except UnicodeDecodeError:
+            raise ValidationError("the manifest is not UTF-8 encoded (near line %d)" % (reader.line_num + 1))
+        yield {
+            'file': row.get('file', ''),
+            'content_type': row.get('content_type', ''),
+            'library': row.get('library') or None,
+            'features': {key[len('feature:'):]: value for key, value in row.items()
+                         if key and key.startswith('feature:')},
+            'attachments': parse_attachments(row.get('attachments') or ''),
+        }
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+class ImportRow:
+    def __init__(self, line, content):
+        self.line = line
+        self.content = content
+        self.features = []
+        self.attachments = []
+
+    def instances(self):
+        return [self.content] + self.features + self.attachments
+
+
+class BulkImporter:
+    """
+    Create contents, their features and attachments from manifest rows.
+
+    Names in the rows are resolved against the user's content types,
+    libraries and attachment types, which are loaded once; the resulting
+    instances are checked per batch by the BatchValidator. Valid rows of a
+    batch are written with bulk_create in one transaction after their files
+    were streamed into storage; invalid rows are reported and skipped, or
+    abort the import before anything is written when ``strict`` is set. A
+    strict import writes all its batches in a single transaction.
+    """
+
+    def __init__(self, user, source, batch_size=500, strict=False):
+        self.user = user
+        self.source = source
+        self.batch_size = batch_size
+        self.strict = strict
+        self.content_types = {}
+        for content_type in user.contenttype_set.prefetch_related('contenttypefeature_set'):
+            content_type.features = {feature.name: feature for feature in content_type.contenttypefeature_set.all()}
+            self.content_types[content_type.name] = self.content_types[str(content_type.pk)] = content_type
+        self.libraries = {library.name: library for library in user.library_set.all()}
+        self.attachment_types = {attachment_type.name: attachment_type
+                                 for attachment_type in user.attachmenttype_set.all()}
+
+    def parse(self, line, row):
+        if isinstance(row, bytes):
+            try:
+                row = json.loads(row)
+            except UnicodeDecodeError:
+                raise ValidationError("the line is not UTF-8 encoded")
+            except ValueError as e:
+                raise ValidationError("invalid JSON: %s" % e)
+        content_type = self.content_types.get(str(row.get('content_type', '')))
+        if content_type is None:
+            raise ValidationError("unknown content type %s" % row.get('content_type'))
+        library = None
+        if row.get('library'):
+            library = self.libraries.get(row['library'])
+            if library is None:
+                raise ValidationError("unknown library %s" % row['library'])
+        # The source path stands in for the stored name until the file is written.
+        parsed = ImportRow(line, Content(creator=self.user, type=content_type, library=library, file=row.get('file')))
+        values = row.get('features') or {}
+        unknown = set(values) - set(content_type.features)
+        if unknown:
+            raise ValidationError("unknown features %s" % ", ".join(sorted(unknown)))
+        for name, value in values.items():
+            if value is None or str(value).strip() == "":
+                # Missing required features are reported by the BatchValidator.
+                continue
+            parsed.features.append(ContentFeature(content=parsed.content, feature_type=content_type.features[name],
+                                                  value=clean_feature_value(content_type.features[name], value)))
+        for attachment in row.get('attachments') or []:
+            attachment_type = self.attachment_types.get(attachment.get('type'))
+            if attachment_type is None:
+                raise ValidationError("unknown attachment type %s" % attachment.get('type'))
+            parsed.attachments.append(Attachment(content=parsed.content, type=attachment_type,
+                                                 file=attachment.get('file')))
+        for instance in [parsed.content] + parsed.attachments:
+            if not instance.file.name or not self.source.exists(instance.file.name):
+                raise ValidationError("file %s not found in the source" % instance.file.name)
+        return parsed
+
+    def check(self, batch, report):
+        if not batch:
+            return []
+        validator = BatchValidator(
+            contents=[row.content for row in batch],
+            features=[feature for row in batch for feature in row.features],
+            attachments=[attachment for row in batch for attachment in row.attachments])
+        if validator.is_valid():
+            return batch
+        valid = []
+        for row in batch:
+            messages = [message for instance in row.instances() for message in validator.messages(instance)]
+            if messages:
+                report.error(row.line, "; ".join(messages))
+            else:
+                valid.append(row)
+        return valid
+
+    def store(self, instance):
+        field = instance._meta.get_field('file')
+        path = instance.file.name
+        filename = os.path.basename(path)
+        with self.source.open(path) as f:
+            name = field.storage.save(field.generate_filename(instance, filename), File(f, name=filename),
+                                      max_length=field.max_length)
+        instance.file = name
+        instance.size = self.source.size(path)
+        return name
+
+    def save(self, batch):
+        contents = [row.content for row in batch]
+        features = [feature for row in batch for feature in row.features]
+        attachments = [attachment for row in batch for attachment in row.attachments]
+        Content.objects.bulk_create(contents)
+        for instance in features + attachments:
+            instance.content_id = instance.content.pk
+        ContentFeature.objects.bulk_create(features)
+        Attachment.objects.bulk_create(attachments)
+        schedule_processing(contents + attachments)
+        libraries = Counter(content.library_id for content in contents)
+        for library_id, count in libraries.items():
+            adjust_content_count(library_id, count)
+        bump_versions(Library, libraries)
+        adjust_storage_usage(self.user.pk, sum(instance.size for instance in contents + attachments))
+        index_contents(content.pk for content in contents)
+
+    def write(self, batches):
+        """
+        Stream the files of ``batches`` into storage, create their rows in one
+        transaction and return the number of contents created. A strict import
+        passes all its batches at once, so that nothing is kept when one fails.
+        """
+        files = [instance for batch in batches for row in batch for instance in [row.content] + row.attachments]
+        # Checked from the sizes the source lists, before any file is copied.
+        check_quota(self.user, sum(self.source.size(instance.file.name) for instance in files))
+        stored = []
+        try:
+            for instance in files:
+                stored.append((instance, self.store(instance)))
+            with transaction.atomic():
+                for batch in batches:
+                    self.save(batch)
+        except Exception:
+            for instance, name in stored:
+                instance.file.storage.delete(name)
+            raise
+        return sum(len(batch) for batch in batches)
+
+    def run(self, rows):
+        report = ImportReport()
+        pending, valid = [], []
+        for line, row in enumerate(rows, start=1):
+            try:
+                pending.append(self.parse(line, row))
+            except ValidationError as e:
+                report.error(line, "; ".join(e.messages))
+            except (KeyError, TypeError, AttributeError):
+                report.error(line, "malformed row")
+            if len(pending) == self.batch_size:
+                valid.extend(self.check(pending, report))
+                pending = []
+                if not self.strict:
+                    report.created += self.write([valid])
+                    valid = []
+        valid.extend(self.check(pending, report))
+        report.errors.sort()
+        if self.strict and report.errors:
+            return report
+        batches = [valid[start:start + self.batch_size] for start in range(0, len(valid), self.batch_size)]
+        if self.strict:
+            report.created += self.write(batches)
+        else:
+            for batch in batches:
+                report.created += self.write([batch])
+        if report.created:
+            invalidate_library_summary(self.user.pk)
+        return report
+
+
+def import_contents(user, source, manifest=None, manifest_name=None, **kwargs):
+    """
+    Import the manifest rows of ``source`` for ``user`` and return an ImportReport.
+
+    Without an explicit ``manifest`` file, the source must contain one of
+    MANIFEST_NAMES at its top level.
+    """
+    source = open_source(source)
+    try:
+        if manifest is None:
+            manifest_name = next((name for name in MANIFEST_NAMES if source.exists(name)), None)
+            if manifest_name is None:
+                raise ValidationError("the source has no %s" % " or ".join(MANIFEST_NAMES))
+            manifest = source.open(manifest_name)
+        with manifest:
+            return BulkImporter(user, source, **kwargs).run(read_manifest(manifest, manifest_name or ''))
+    finally:
+        source.close()
@@ -0,0 +1,71 @@
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.db.models import Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from libcloud.models import Content, ContentType, Library
+from libcloud.sidebar import get_library_summary
+
+
+def page_etag(request, timestamps):
+    """
+    ETag of a page showing rows last modified at ``timestamps`` to
+    ``request.user``, or None when the page has to be rendered anyway.
+
+    Besides the rows, pages show who is logged in and their libraries in the
+    navigation bar (from the sidebar cache, so this costs no query).
+    """
+    if timestamps is None or len(get_messages(request)):
+        return None
+    libraries = get_library_summary(request.user) if request.user.is_authenticated else []
+    parts = [request.user.pk, [str(timestamp) for timestamp in timestamps],
+             [(library.pk, library.name) for library in libraries]]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def conditional_page(timestamps):
+    """
+    Like ``condition``, for HTML pages: ``timestamps(request, *args, **kwargs)``
+    returns the modification times of the rows a view shows (None if there
+    are none), and GET requests whose If-None-Match still matches get a 304
+    without the view running. Pages are per user, so shared caches must not
+    keep them and browsers have to revalidate.
+    """
+    def etag(request, *args, **kwargs):
+        # Kept for fragment_context(), which keys the page's cached fragments on them too.
+        request.page_timestamps = timestamps(request, *args, **kwargs)
+        return page_etag(request, request.page_timestamps)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if len(get_messages(request)):
+                # The view added a message (say, a bad filter) to this rendering only.
+                response.headers.pop('ETag')
+            if request.method in ('GET', 'HEAD'):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def content_timestamps(request, pk):
+    return Content.objects.filter(pk=pk).values_list('updated_at', 'library__updated_at', 'type__updated_at').first()
+
+
+def library_timestamps(request, pk):
+    if not request.user.is_authenticated:
+        return None
+    # Contents leaving the library change its counter rather than a timestamp.
+    return Library.objects.filter(pk=pk, user=request.user).annotate(latest=Max('content__updated_at')) \
+        .values_list('updated_at', 'content_count', 'latest', 'content_type__updated_at').first()
+
+
+def content_type_timestamps(request, pk):
+    return ContentType.objects.filter(pk=pk).values_list('updated_at').first()
@@ -0,0 +1,13 @@
+from django.utils.functional import SimpleLazyObject
+
+from libcloud.sidebar import get_library_summary
+
+
+def sidebar(request):
+    # Evaluated only by templates that actually render the library list.
+    def libraries():
+        if request.user.is_authenticated:
+            return get_library_summary(request.user)
+        return []
+
+    return {'libraries': SimpleLazyObject(libraries)}
@@ -0,0 +1,178 @@
+"""
+PostgreSQL backend that keeps a pool of open connections per process.
+
+Use it with ``'ENGINE': 'libcloud.db.postgresql_pool'`` and an optional
+``'POOL'`` dict in the database settings:
+
+MAX_SIZE      connections the process may hold open at once (default 10)
+TIMEOUT       seconds to wait for a free connection before failing (10)
+MAX_LIFETIME  seconds after which a connection is closed instead of reused (1800)
+HEALTH_CHECK  run ``SELECT 1`` on an idle connection before handing it out (True)
+
+Django "closes" the connection at the end of each request (CONN_MAX_AGE = 0)
+or when it grows older than CONN_MAX_AGE; here that returns it to the pool,
+so a request costs no TCP and authentication handshake, whatever thread or
+async context it runs in.
+"""
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extras
+from psycopg2 import extensions
+from django.db.backends.postgresql import base, creation
+from django.utils.asyncio import async_unsafe
+
+DEFAULTS = {'MAX_SIZE': 10, 'TIMEOUT': 10, 'MAX_LIFETIME': 1800, 'HEALTH_CHECK': True}
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Pools inherited over fork(): their sockets belong to the parent, and closing
+# them here would end the parent's sessions, so they are only kept referenced.
+_inherited = []
+
+
+class PooledConnection(extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created = time.monotonic()
+        self.reused = False
+
+
+class ConnectionPool:
+    def __init__(self, conn_params, options):
+        self.conn_params = conn_params
+        self.options = dict(DEFAULTS, **(options or {}))
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.options['MAX_SIZE'])
+        self.pid = os.getpid()
+
+    def expired(self, connection):
+        return connection.closed or time.monotonic() - connection.created > self.options['MAX_LIFETIME']
+
+    def healthy(self, connection):
+        if self.expired(connection):
+            return False
+        if not self.options['HEALTH_CHECK']:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except psycopg2.Error:
+            return False
+        return True
+
+    def get(self):
+        if not self.slots.acquire(timeout=self.options['TIMEOUT']):
+            raise psycopg2.OperationalError("no free database connection after %s seconds (POOL MAX_SIZE is %d)"
+                                            % (self.options['TIMEOUT'], self.options['MAX_SIZE']))
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return psycopg2.connect(connection_factory=PooledConnection, **self.conn_params)
+                if self.healthy(connection):
+                    connection.reused = True
+                    return connection
+                connection.close()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def reset(self, connection):
+        # Roll back what the last user left open, and keep idle connections in
+        # autocommit mode: otherwise the health check would open a transaction.
+        if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        connection.autocommit = True
+
+    def put(self, connection):
+        try:
+            if not connection.closed:
+                try:
+                    self.reset(connection)
+                except psycopg2.Error:
+                    connection.close()
+            if self.expired(connection):
+                connection.close()
+            else:
+                with self.lock:
+                    self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        finally:
+            self.slots.release()
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+def get_pool(conn_params, options):
+    key = repr((sorted(conn_params.items()), sorted((options or {}).items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.pid != os.getpid():
+            _inherited.append(pool)
+            pool = None
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(conn_params, options)
+        return pool
+
+
+def close_idle_connections():
+    with _pools_lock:
+        pools = [pool for pool in _pools.values() if pool.pid == os.getpid()]
+    for pool in pools:
+        pool.close_idle()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    # Idle pooled sessions would keep the test database from being recreated or dropped.
+
+    def _create_test_db(self, *args, **kwargs):
+        close_idle_connections()
+        return super()._create_test_db(*args, **kwargs)
+
+    def _destroy_test_db(self, *args, **kwargs):
+        close_idle_connections()
+        return super()._destroy_test_db(*args, **kwargs)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        pool = get_pool(conn_params, self.settings_dict.get('POOL'))
+        connection = pool.get()
+        connection.pool = pool
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        if not connection.reused:
+            psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                if self.in_atomic_block:
+                    # Django keeps referring to a connection closed inside an
+                    # atomic block, so it must not be handed out again.
+                    return self.connection.pool.discard(self.connection)
+                return self.connection.pool.put(self.connection)
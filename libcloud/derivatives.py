@@ -0,0 +1,144 @@
+import io
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it items keep the generic icon.
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'derivatives'
+
+# Bounding box of each derivative: small ones for the listings, a larger
+# first-page/first-frame rendition for the content page.
+DEFAULT_SIZES = {'thumbnail': (256, 256), 'preview': (1024, 1024)}
+
+JPEG_QUALITY = 80
+
+
+class NotRenderable(Exception):
+    """The file cannot be turned into an image; retrying will not help."""
+
+
+def get_sizes():
+    return getattr(settings, 'LIBCLOUD_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+
+def get_derivative_path(content, key, kind):
+    """
+    ``user_<username>/derivatives/<stem>.<key>.<kind>.jpg``, next to the file.
+
+    ``key`` is derived from the file's contents, so a changed file gets new
+    URLs and the old ones can be cached forever.
+    """
+    folder, filename = os.path.split(content.file.name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(folder, DERIVATIVES_DIR, "%s.%s.%s.jpg" % (stem, key[:12], kind))
+
+
+def local_path(file):
+    """A filesystem path of ``file`` for external tools, copied to a temporary file if needed."""
+    try:
+        return file.path, False
+    except NotImplementedError:
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.name)[1])
+        with os.fdopen(fd, 'wb') as f, file.open('rb'):
+            for chunk in file.chunks():
+                f.write(chunk)
+        return path, True
+
+
+def run_renderer(file, command):
+    """Run ``command`` (formatted with the input path) and open the image it writes to stdout."""
+    path, temporary = local_path(file)
+    try:
+        result = subprocess.run([part.format(path=path) for part in command], capture_output=True, timeout=60)
+    except subprocess.TimeoutExpired:
+        raise NotRenderable("%s timed out" % command[0])
+    finally:
+        if temporary:
+            os.remove(path)
+    if result.returncode != 0 or not result.stdout:
+        raise NotRenderable(result.stderr.decode(errors='replace').strip() or "%s failed" % command[0])
+    return Image.open(io.BytesIO(result.stdout))
+
+
+def render_image(file):
+    with file.open('rb'):
+        image = Image.open(file)
+        # Let JPEG decode at a reduced scale instead of at full resolution.
+        image.draft('RGB', max(get_sizes().values()))
+        image.load()
+    return ImageOps.exif_transpose(image)
+
+
+def render_pdf(file):
+    return run_renderer(file, ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-png',
+                               '-scale-to', str(max(max(get_sizes().values()))), '{path}'])
+
+
+def render_video(file):
+    return run_renderer(file, ['ffmpeg', '-loglevel', 'error', '-ss', '1', '-i', '{path}',
+                               '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-'])
+
+
+def get_renderer(filename):
+    """The function turning ``filename`` into an image, or None when it has no derivatives."""
+    if Image is None:
+        return None
+    mime_type, _ = mimetypes.guess_type(filename)
+    if mime_type is None:
+        return None
+    if mime_type.startswith('image/'):
+        return render_image
+    if mime_type == 'application/pdf' and shutil.which('pdftoppm'):
+        return render_pdf
+    if mime_type.startswith('video/') and shutil.which('ffmpeg'):
+        return render_video
+    return None
+
+
+def encode(image, size):
+    image = image.copy()
+    image.thumbnail(size)
+    if image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        image = image.convert('RGBA')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def generate(content, key):
+    """
+    Render the derivatives of ``content`` and save them; returns a dict of
+    derivative field names to the saved names, or None when the file has none.
+    """
+    renderer = get_renderer(content.file.name)
+    if renderer is None:
+        return None
+    try:
+        image = renderer(content.file)
+    except (NotRenderable, OSError, Image.DecompressionBombError) as e:
+        # OSError covers files Pillow cannot identify or decode.
+        logger.info("no derivatives for %s: %s", content.file.name, e)
+        return None
+    storage = content.file.storage
+    names = {}
+    for kind, size in get_sizes().items():
+        name = get_derivative_path(content, key, kind)
+        if storage.exists(name):
+            storage.delete(name)
+        names[kind] = storage.save(name, ContentFile(encode(image, size)))
+    return names
@@ -0,0 +1,398 @@
+import hashlib
+import json
+import logging
+import struct
+import tarfile
+import zipfile
+import zlib
+from calendar import timegm
+from time import gmtime
+
+from django.db.models import Prefetch
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, quote_etag
+
+from libcloud.models import Attachment, ContentFeature
+from libcloud.streaming import RangeNotSatisfiable, get_chunk_size, not_modified, parse_range, range_applies
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+# Same limit as zipfile: beyond it sizes and offsets go into zip64 extra fields.
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+
+FORMATS = {
+    'zip': ('application/zip', '.zip'),
+    'tar': ('application/x-tar', '.tar'),
+}
+
+
+class Member:
+    """A file of the archive: a stored file (by path or storage name) or bytes."""
+
+    def __init__(self, name, size, mtime, path=None, storage=None, storage_name=None, data=None):
+        self.name = name
+        self.size = size
+        self.mtime = int(mtime)
+        self.path = path
+        self.storage = storage
+        self.storage_name = storage_name
+        self.data = data
+        self._crc = None
+
+    @classmethod
+    def from_field(cls, name, field, mtime):
+        storage = field.storage
+        try:
+            path = storage.path(field.name)
+        except NotImplementedError:
+            path = None
+        return cls(name, storage.size(field.name), mtime, path=path, storage=storage, storage_name=field.name)
+
+    def open(self):
+        if self.path is not None:
+            return open(self.path, 'rb')
+        return self.storage.open(self.storage_name, 'rb')
+
+    def chunks(self, offset=0):
+        """The member's bytes from ``offset`` on, in download sized blocks."""
+        if self.data is not None:
+            yield self.data[offset:]
+            return
+        remaining = self.size - offset
+        with self.open() as f:
+            f.seek(offset)
+            while remaining > 0:
+                chunk = f.read(min(get_chunk_size(), remaining))
+                if not chunk:
+                    raise IOError("%s is shorter than when the export started" % self.name)
+                remaining -= len(chunk)
+                yield chunk
+
+    @property
+    def crc(self):
+        if self._crc is None:
+            crc = 0
+            for chunk in self.chunks():
+                crc = zlib.crc32(chunk, crc)
+            self._crc = crc
+        return self._crc
+
+    def date_time(self):
+        return dos_date_time(self.mtime)
+
+
+def dos_date_time(timestamp):
+    year, month, day, hour, minute, second = gmtime(timestamp)[:6]
+    if year < 1980:
+        return 1980, 1, 1, 0, 0, 0
+    return year, month, day, hour, minute, second
+
+
+class Bytes:
+    def __init__(self, data):
+        self.data = data
+        self.length = len(data)
+
+    def read(self, offset):
+        yield self.data[offset:]
+
+
+class Later:
+    """Bytes of a known length that can only be built once CRCs are known."""
+
+    def __init__(self, length, build):
+        self.length = length
+        self.build = build
+
+    def read(self, offset):
+        data = self.build()
+        assert len(data) == self.length
+        yield data[offset:]
+
+
+class MemberData:
+    def __init__(self, member):
+        self.member = member
+        self.length = member.size
+
+    def read(self, offset):
+        if offset or self.member._crc is not None:
+            yield from self.member.chunks(offset)
+            return
+        # Read from the start: compute the CRC on the way instead of later.
+        crc = 0
+        for chunk in self.member.chunks():
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        self.member._crc = crc
+
+
+class SizedArchive:
+    """
+    An archive whose every byte is known in advance up to the CRCs, laid out
+    as segments of known length. Any byte range of it can be produced
+    without producing what comes before, which makes downloads resumable.
+    """
+    segments = ()
+
+    @property
+    def size(self):
+        return sum(segment.length for segment in self.segments)
+
+    def stream(self, start=0, end=None):
+        """Yield the bytes ``start`` to ``end`` (inclusive) of the archive."""
+        end = self.size - 1 if end is None else end
+        position = 0
+        for segment in self.segments:
+            if position > end:
+                break
+            if position + segment.length > start and segment.length:
+                skip = max(start - position, 0)
+                wanted = min(end + 1 - position, segment.length) - skip
+                chunks = segment.read(skip)
+                try:
+                    for chunk in chunks:
+                        chunk = chunk[:wanted]
+                        wanted -= len(chunk)
+                        yield chunk
+                        if wanted <= 0:
+                            break
+                finally:
+                    chunks.close()
+            position += segment.length
+
+
+class StoredZip(SizedArchive):
+    """
+    Uncompressed zip with data descriptors, so the CRC of a member may follow
+    its data. UTF-8 names; zip64 fields where sizes or offsets need them.
+    """
+
+    def __init__(self, members):
+        self.members = members
+        self.segments = []
+        entries = []
+        offset = 0
+        for member in members:
+            name = member.name.encode('utf-8')
+            zip64 = member.size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+            entries.append((member, name, zip64, offset))
+            for segment in (Bytes(self.local_header(member, name, zip64)), MemberData(member),
+                            Later(24 if zip64 else 16, self.descriptor_builder(member, zip64))):
+                self.segments.append(segment)
+                offset += segment.length
+        central_size = sum(46 + len(name) + (28 if zip64 else 0) for _, name, zip64, _ in entries)
+        self.segments.append(Later(central_size, lambda: b''.join(
+            self.central_header(member, name, zip64, member_offset)
+            for member, name, zip64, member_offset in entries)))
+        self.segments.append(Bytes(self.end_records(len(entries), central_size, offset)))
+
+    @staticmethod
+    def dos_fields(member):
+        year, month, day, hour, minute, second = member.date_time()
+        return hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day
+
+    def local_header(self, member, name, zip64):
+        time, date = self.dos_fields(member)
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else b''
+        size = 0xFFFFFFFF if zip64 else 0
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x0808, zipfile.ZIP_STORED,
+                           time, date, 0, size, size, len(name), len(extra)) + name + extra
+
+    @staticmethod
+    def descriptor_builder(member, zip64):
+        if zip64:
+            return lambda: struct.pack('<IIQQ', 0x08074b50, member.crc, member.size, member.size)
+        return lambda: struct.pack('<IIII', 0x08074b50, member.crc, member.size, member.size)
+
+    def central_header(self, member, name, zip64, offset):
+        time, date = self.dos_fields(member)
+        if zip64:
+            extra = struct.pack('<HHQQQ', 1, 24, member.size, member.size, offset)
+            size = offset = 0xFFFFFFFF
+        else:
+            extra, size = b'', member.size
+        version = 45 if zip64 else 20
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 3 << 8 | version, version, 0x0808,
+                           zipfile.ZIP_STORED, time, date, member.crc, size, size, len(name), len(extra), 0, 0, 0,
+                           0o100644 << 16, offset) + name + extra
+
+    @staticmethod
+    def end_records(count, central_size, central_offset):
+        records = b''
+        if count >= 0xFFFF or central_size >= ZIP64_LIMIT or central_offset >= ZIP64_LIMIT:
+            end_offset = central_offset + central_size
+            records = struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 3 << 8 | 45, 45, 0, 0, count, count,
+                                  central_size, central_offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, end_offset, 1)
+        return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                     min(central_size, 0xFFFFFFFF), min(central_offset, 0xFFFFFFFF), 0)
+
+
+class Tar(SizedArchive):
+    """Uncompressed POSIX tar; PAX headers carry names that do not fit ustar."""
+
+    def __init__(self, members):
+        self.members = members
+        self.segments = []
+        for member in members:
+            info = tarfile.TarInfo(member.name)
+            info.size = member.size
+            info.mtime = member.mtime
+            info.mode = 0o644
+            self.segments.append(Bytes(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')))
+            self.segments.append(MemberData(member))
+            padding = -member.size % tarfile.BLOCKSIZE
+            if padding:
+                self.segments.append(Bytes(tarfile.NUL * padding))
+        self.segments.append(Bytes(tarfile.NUL * tarfile.BLOCKSIZE * 2))
+
+
+class DeflatedZip:
+    """A compressed zip; its size is unknown until it was written, so it cannot be resumed."""
+    size = None
+
+    def __init__(self, members):
+        self.members = members
+
+    def stream(self, start=0, end=None):
+        sink = Sink()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for member in self.members:
+                info = zipfile.ZipInfo(member.name, member.date_time())
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o100644 << 16
+                with archive.open(info, 'w', force_zip64=member.size >= ZIP64_LIMIT) as destination:
+                    for chunk in member.chunks():
+                        destination.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+        yield sink.drain()
+
+
+class Sink:
+    """Unseekable file zipfile writes into; the written bytes are taken out with drain()."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def manifest_row(content, path, attachment_paths):
+    return {
+        'file': path,
+        'content_type': content.type.name,
+        'library': content.library.name if content.library else None,
+        'features': {feature.feature_type.name: feature.value for feature in content.contentfeature_set.all()
+                     if feature.feature_type is not None},
+        'attachments': [{'type': attachment.type.name, 'file': attachment_paths[attachment.pk]}
+                        for attachment in content.attachment_set.all() if attachment.pk in attachment_paths],
+    }
+
+
+def collect_members(contents):
+    """
+    The members of an archive of ``contents``: ``<id>/<filename>`` for each
+    content, ``<id>/attachments/<filename>`` for its attachments and a
+    manifest.jsonl in the format ``import_contents`` reads, so an export can
+    be imported again. Files missing from storage are left out.
+    """
+    contents = contents.select_related('type', 'library').prefetch_related(
+        Prefetch('contentfeature_set', queryset=ContentFeature.objects.select_related('feature_type')),
+        Prefetch('attachment_set', queryset=Attachment.objects.select_related('type'))).order_by('pk')
+    members, rows = [], []
+    for content in contents:
+        try:
+            path = "%d/%s" % (content.pk, content.filename())
+            files = [Member.from_field(path, content.file, timegm(content.updated_at.utctimetuple()))]
+        except OSError:
+            logger.warning("export: %s is missing from storage", content.file.name)
+            continue
+        attachment_paths = {}
+        for attachment in content.attachment_set.all():
+            attachment_path = "%d/attachments/%s" % (content.pk, attachment.filename())
+            try:
+                files.append(Member.from_field(attachment_path, attachment.file,
+                                               timegm(attachment.updated_at.utctimetuple())))
+            except OSError:
+                logger.warning("export: %s is missing from storage", attachment.file.name)
+                continue
+            attachment_paths[attachment.pk] = attachment_path
+        members.extend(files)
+        rows.append(manifest_row(content, path, attachment_paths))
+    manifest = ''.join(json.dumps(row, sort_keys=True) + '\n' for row in rows).encode('utf-8')
+    mtime = max((member.mtime for member in members), default=0)
+    return [Member(MANIFEST_NAME, len(manifest), mtime, data=manifest)] + members
+
+
+def build_archive(members, format='zip', compress=False):
+    if format == 'tar':
+        return Tar(members)
+    return DeflatedZip(members) if compress else StoredZip(members)
+
+
+def archive_etag(members, format, compress):
+    digest = hashlib.sha1(repr((format, compress)).encode())
+    for member in members:
+        digest.update(repr((member.name, member.size, member.mtime, member.storage_name)).encode())
+    digest.update(members[0].data)
+    return quote_etag(digest.hexdigest())
+
+
+def serve_archive(request, contents, filename, format='zip', compress=False):
+    """
+    Stream an archive of ``contents``, built block by block while it is sent.
+
+    Stored zip and tar archives have a known size and identical bytes on every
+    request while the contents stay the same, so they answer Range/If-Range
+    requests (resumed downloads) and conditional requests.
+    """
+    content_type, extension = FORMATS[format]
+    members = collect_members(contents)
+    archive = build_archive(members, format, compress)
+    etag = archive_etag(members, format, compress)
+    last_modified = max(member.mtime for member in members)
+
+    if archive.size is not None and not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    elif archive.size is None:
+        response = StreamingHttpResponse(archive.stream(), content_type=content_type)
+    else:
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and request.method == 'GET' and range_applies(request, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, archive.size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % archive.size
+                return response
+        if byte_range is None:
+            response = StreamingHttpResponse(archive.stream(), content_type=content_type)
+            response['Content-Length'] = archive.size
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(archive.stream(start, end), content_type=content_type, status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, archive.size)
+        response['Accept-Ranges'] = 'bytes'
+
+    if response.status_code != 304:
+        response['Content-Disposition'] = 'attachment; filename="%s%s"' % (filename, extension)
+    if archive.size is not None:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+    return response
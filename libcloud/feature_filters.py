@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import QueryDict
+
+from libcloud.models import ContentFeature, ContentTypeFeature, typed_feature_value
+
+# Query parameters that belong to the listing itself rather than to a feature.
+RESERVED_PARAMETERS = {'page', 'cursor', 'q', 'page_size'}
+
+COLUMNS = {
+    ContentTypeFeature.FeatureType.Number: 'number_value',
+    ContentTypeFeature.FeatureType.String: 'value',
+    ContentTypeFeature.FeatureType.Boolean: 'boolean_value',
+}
+
+OPERATORS = {
+    ContentTypeFeature.FeatureType.Number: {'exact', 'gt', 'gte', 'lt', 'lte'},
+    ContentTypeFeature.FeatureType.String: {'exact', 'iexact', 'contains', 'icontains', 'startswith'},
+    ContentTypeFeature.FeatureType.Boolean: {'exact'},
+}
+ALL_OPERATORS = set().union(*OPERATORS.values())
+
+
+def parse_key(key):
+    name, _, operator = key.rpartition('__')
+    if name and operator in ALL_OPERATORS:
+        return name, operator
+    return key, 'exact'
+
+
+def feature_condition(feature_types, operator, value):
+    """
+    Q over ContentFeature matching ``value`` for any of ``feature_types``.
+
+    Each feature type is compared on its typed column, so the lookup is served
+    by the (feature_type, <column>) index of that type.
+    """
+    by_type = defaultdict(list)
+    for feature_type in feature_types:
+        by_type[feature_type.type].append(feature_type.pk)
+    condition = Q()
+    for type, ids in by_type.items():
+        if operator not in OPERATORS[type]:
+            raise ValidationError("%s can not be used with %s features"
+                                  % (operator, ContentTypeFeature.FeatureType(type).label.lower()))
+        typed = typed_feature_value(type, value)
+        condition |= Q(feature_type__in=ids, **{'%s__%s' % (COLUMNS[type], operator): typed})
+    return condition
+
+
+def filter_by_features(queryset, params, feature_types):
+    """
+    Restrict a Content queryset with feature predicates taken from ``params``.
+
+    ``params`` is a QueryDict such as ``pages__gte=100&author=Knuth``: keys are
+    feature names with an optional lookup suffix, matched against the given
+    ContentTypeFeature rows. Every predicate becomes an indexed semi-join on
+    ContentFeature; repeated keys must all hold.
+    """
+    predicates = [(key, values) for key, values in params.lists() if key not in RESERVED_PARAMETERS]
+    if predicates:
+        feature_types = list(feature_types)
+    for key, values in predicates:
+        name, operator = parse_key(key)
+        matching = [feature_type for feature_type in feature_types if feature_type.name == name]
+        if not matching:
+            raise ValidationError("unknown feature %s" % name)
+        for value in values:
+            condition = feature_condition(matching, operator, value)
+            queryset = queryset.filter(pk__in=ContentFeature.objects.filter(condition).values('content_id'))
+    return queryset
+
+
+def feature_parameters(params):
+    """The feature filters of ``params`` in a canonical order, the listing's own parameters left out."""
+    filters = QueryDict(mutable=True)
+    for key, values in sorted(params.lists()):
+        if key not in RESERVED_PARAMETERS:
+            filters.setlist(key, sorted(values))
+    return filters
@@ -10,6 +10,7 @@ from django.forms import ModelForm, Form, formset_factory, inlineformset_factory
 
 from libcloud.models import ContentType, ContentTypeFeature, AttachmentType, Content, ContentFeature, Library, \
     Attachment
+from libcloud.quota import check_quota
 
 
 class NewUserForm(UserCreationForm):
@@ -111,6 +112,13 @@ class ContentForm(ModelForm):
             self.fields['library'].queryset = Library.objects.filter(user=self.user)
         self.fields['library'].label_from_instance = lambda obj: "%s" % obj.name
 
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if file and not getattr(file, '_committed', False):
+            # Uploads without a Content-Length got past StorageQuotaMiddleware.
+            check_quota(self.user, file.size)
+        return file
+
     def save(self, commit=True):
         content = super().save(commit=False)
         content.creator = self.user
@@ -187,6 +195,13 @@ class AttachmentForm(ModelForm):
         self.fields["file"].widget.attrs['required'] = 'required'
 
 
+class ImportForm(Form):
+    archive = forms.FileField(label=_('Zip or tar archive'))
+    manifest = forms.FileField(label=_('Manifest (CSV or JSONL)'), required=False,
+                               help_text=_('Leave empty if the archive contains manifest.csv or manifest.jsonl.'))
+    strict = forms.BooleanField(label=_('Import nothing if a row is invalid'), required=False)
+
+
 ContentTypeFeatureFormset = modelformset_factory(ContentTypeFeature, form=ContentTypeFeatureForm, extra=1,
                                                  absolute_max=20, max_num=20)
 
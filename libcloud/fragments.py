@@ -0,0 +1,56 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(model, pk):
+    return 'libcloud:version:%s:%s' % (model._meta.model_name, pk)
+
+
+def new_stamp():
+    return uuid.uuid4().hex[:12]
+
+
+def get_version(*instances):
+    """
+    The combined version stamp of ``instances``, used to key the cached
+    template fragments that show them. A stamp that is missing (never set or
+    evicted) is created, which only costs one re-render.
+    """
+    keys = [version_key(type(instance), instance.pk) for instance in instances]
+    stamps = cache.get_many(keys)
+    missing = [key for key in keys if key not in stamps]
+    for key in missing:
+        cache.add(key, new_stamp(), None)
+    if missing:
+        stamps.update(cache.get_many(missing))
+    return '.'.join(stamps.get(key, '') for key in keys)
+
+
+def bump_versions(model, pks):
+    """Give the ``model`` rows ``pks`` new stamps, orphaning their cached fragments."""
+    # After the commit only: a request reading the old rows in the meantime
+    # must not cache them under the new stamp.
+    keys = {version_key(model, pk) for pk in pks if pk is not None}
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: new_stamp() for key in keys}, None))
+
+
+def fragment_context(request, *instances):
+    """
+    The version of ``instances`` plus the modification times conditional_page()
+    read for the page. Those come from the database, so what another process
+    changed (the job worker rendering a thumbnail) shows even when its version
+    bumps went to a cache this process does not see.
+    """
+    version = get_version(*instances)
+    timestamps = getattr(request, 'page_timestamps', None)
+    if timestamps is not None:
+        version += '.' + hashlib.sha1(repr([str(timestamp) for timestamp in timestamps]).encode()).hexdigest()[:12]
+    return {
+        'fragment_version': version,
+        'fragment_timeout': getattr(settings, 'LIBCLOUD_FRAGMENT_CACHE_TIMEOUT', 3600),
+    }
@@ -0,0 +1,193 @@
+import logging
+import os
+import time
+import uuid
+from collections import namedtuple
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+
+from libcloud.models import Attachment, Content, StoredBlob, UploadSession
+from libcloud.storage import DeduplicatingStorage
+from libcloud.uploads import session_expiry_cutoff, staging_dir
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE_DIR = '.quarantine'
+
+# The columns naming files in storage, by model.
+FILE_FIELDS = [(Content, ('file', 'thumbnail', 'preview')), (Attachment, ('file',))]
+
+# A file found on disk that may be garbage. ``key`` is what ties it to a row:
+# its storage name, the id of its upload session or the digest of its blob;
+# None for temporary files, which nothing refers to.
+Candidate = namedtuple('Candidate', 'kind key path size')
+
+
+def referenced_names():
+    """The set of storage names that rows refer to."""
+    names = set()
+    for model, fields in FILE_FIELDS:
+        for row in model.objects.values_list(*fields).iterator(chunk_size=5000):
+            names.update(row)
+    names.discard('')
+    return names
+
+
+def referenced_in(names):
+    """Those of ``names`` that rows refer to now."""
+    names = list(names)
+    found = set()
+    if not names:
+        return found
+    for model, fields in FILE_FIELDS:
+        condition = reduce(or_, (Q(**{'%s__in' % field: names}) for field in fields))
+        for row in model.objects.filter(condition).values_list(*fields):
+            found.update(row)
+    return found
+
+
+def open_sessions(ids):
+    sessions = UploadSession.objects.filter(pk__in=list(ids), updated_at__gte=session_expiry_cutoff())
+    return {str(pk) for pk in sessions.values_list('pk', flat=True)}
+
+
+def stored_blobs(digests):
+    return set(StoredBlob.objects.filter(digest__in=list(digests)).values_list('digest', flat=True))
+
+
+def walk(path):
+    """Regular files below ``path`` as (path, stat) pairs, one directory at a time; symlinks are not followed."""
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            yield entry.path, entry.stat(follow_symlinks=False)
+
+
+class GarbageCollector:
+    """
+    Find files in storage that no row refers to and delete them, or move them
+    to ``<MEDIA_ROOT>/.quarantine/<time>/`` with ``quarantine``. There are
+    three kinds:
+
+    - files under the ``user_<name>/`` directories (uploads and their
+      derivatives) that no Content or Attachment names, checked against a set
+      of all referenced names built once;
+    - staged chunked uploads whose session is gone or was abandoned (idle for
+      LIBCLOUD_UPLOAD_SESSION_EXPIRY; those sessions are deleted first), and
+      form uploads left behind in the staging directory;
+    - deduplicated blobs without a StoredBlob row, and unreferenced ones.
+
+    Files younger than ``grace`` seconds are never touched: an upload writes
+    its file before the row that names it is committed. Every batch is also
+    checked against the database again right before it is removed.
+    """
+    checkers = {'file': referenced_in, 'session': open_sessions, 'blob': stored_blobs}
+
+    def __init__(self, storage=None, grace=None, quarantine=False, dry_run=False, batch_size=1000, callback=None):
+        self.storage = storage or default_storage
+        self.grace = getattr(settings, 'LIBCLOUD_GC_GRACE_PERIOD', 24 * 60 * 60) if grace is None else grace
+        self.quarantine = quarantine
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.callback = callback
+        self.quarantine_root = os.path.join(self.storage.location, QUARANTINE_DIR, time.strftime('%Y%m%d-%H%M%S'))
+        self.files = self.bytes = self.sessions = 0
+
+    def candidates(self, cutoff):
+        referenced = referenced_names()
+        location = self.storage.location
+        for entry in sorted(os.listdir(location)) if os.path.isdir(location) else []:
+            if not entry.startswith('user_'):
+                continue
+            for path, stat in walk(os.path.join(location, entry)):
+                name = os.path.relpath(path, location).replace(os.sep, '/')
+                if stat.st_mtime < cutoff and name not in referenced:
+                    yield Candidate('file', name, path, stat.st_size)
+
+        for path, stat in walk(staging_dir()):
+            if stat.st_mtime >= cutoff:
+                continue
+            stem, extension = os.path.splitext(os.path.basename(path))
+            if extension == '.part' and is_uuid(stem):
+                yield Candidate('session', stem, path, stat.st_size)
+            else:
+                yield Candidate('temp', None, path, stat.st_size)
+
+        if isinstance(self.storage, DeduplicatingStorage):
+            for path, stat in walk(self.storage.blob_root):
+                if stat.st_mtime >= cutoff:
+                    continue
+                digest = os.path.basename(path)
+                if os.path.dirname(path) == os.path.join(self.storage.blob_root, 'tmp') or len(digest) != 64:
+                    yield Candidate('temp', None, path, stat.st_size)
+                else:
+                    yield Candidate('blob', digest, path, stat.st_size)
+
+    def sweep(self, batch):
+        still_used = {}
+        for kind, checker in self.checkers.items():
+            still_used[kind] = checker({candidate.key for candidate in batch if candidate.kind == kind})
+        for candidate in batch:
+            if candidate.key is not None and candidate.key in still_used[candidate.kind]:
+                continue
+            if not self.dry_run:
+                try:
+                    self.remove(candidate.path)
+                except FileNotFoundError:
+                    continue
+            self.files += 1
+            self.bytes += candidate.size
+            if self.callback is not None:
+                self.callback(candidate)
+
+    def remove(self, path):
+        if not self.quarantine:
+            os.remove(path)
+            logger.info("deleted orphaned file %s", path)
+            return
+        location = os.path.abspath(self.storage.location)
+        relative = os.path.relpath(path, location)
+        if relative.startswith(os.pardir):
+            # Blobs may live outside MEDIA_ROOT (LIBCLOUD_BLOB_ROOT).
+            relative = os.path.join('.blobs', os.path.relpath(path, self.storage.blob_root))
+        target = os.path.join(self.quarantine_root, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        logger.info("quarantined orphaned file %s", path)
+
+    def run(self):
+        """Collect the garbage and return the number of files and bytes reclaimed."""
+        expired = UploadSession.objects.filter(updated_at__lt=session_expiry_cutoff())
+        if self.dry_run:
+            self.sessions = expired.count()
+        else:
+            # Their staged files are then found like those of any other missing session.
+            self.sessions = expired.delete()[1].get(UploadSession._meta.label, 0)
+        batch = []
+        for candidate in self.candidates(time.time() - self.grace):
+            batch.append(candidate)
+            if len(batch) == self.batch_size:
+                self.sweep(batch)
+                batch = []
+        self.sweep(batch)
+        if isinstance(self.storage, DeduplicatingStorage) and not self.dry_run and not self.quarantine:
+            # Blobs whose last reference was deleted (normally swept right away).
+            self.bytes += self.storage.collect_garbage()
+        return self.files, self.bytes
+
+
+def is_uuid(value):
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
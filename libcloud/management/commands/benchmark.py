@@ -0,0 +1,102 @@
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from libcloud.benchmarks import suite
+from libcloud.benchmarks.load import PROFILES
+from libcloud.benchmarks.seed import describe_database
+
+
+class Command(BaseCommand):
+    help = ("Seed users, libraries, contents, features and attachments at the given scale and time the main "
+            "pages, content creation and file uploads and downloads through the test client and/or a real "
+            "server. Results can be saved as JSON and checked against thresholds or an earlier run. The rows "
+            "are seeded into the configured database, so it only runs against a scratch database, confirmed "
+            "with --yes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1)
+        parser.add_argument('--libraries', type=int, default=10, help="Libraries per user.")
+        parser.add_argument('--contents', type=int, default=1000, help="Contents per user.")
+        parser.add_argument('--features', type=int, default=3, help="Features per content.")
+        parser.add_argument('--attachments', type=int, default=1, help="Attachments per content.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--target', action='append', choices=('client', 'server'),
+                            help="Where to send the requests; repeat for both. Defaults to the test client.")
+        parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                            help="Serving profile of the server target; repeat for several. Defaults to dev.")
+        parser.add_argument('--workers', type=int, help="Worker processes of the gunicorn profiles.")
+        parser.add_argument('--scenario', action='append', choices=suite.SCENARIOS,
+                            help="Scenario to run; repeat for several. Defaults to all of them.")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests per page scenario.")
+        parser.add_argument('--file-repeat', type=int, default=1, help="Timed uploads and downloads per size.")
+        parser.add_argument('--size', action='append', type=suite.parse_size,
+                            help="File size to upload and download, like 10M or 1G; repeat for several. "
+                                 "Defaults to 10M, 100M and 1G.")
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+        parser.add_argument('--thresholds', help="JSON file of limits per scenario; exceeding one fails the run.")
+        parser.add_argument('--baseline',
+                            help="Results of an earlier run; regressions beyond --tolerance fail the run.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="How much slower than the baseline timings may be, as a fraction.")
+        parser.add_argument('--yes', action='store_true',
+                            help="Confirm that the configured database is a scratch database.")
+
+    def handle(self, *args, **options):
+        if not options['yes']:
+            raise CommandError("this seeds users and contents into the %s; point the settings at a scratch "
+                               "database and pass --yes" % describe_database())
+        thresholds = self.load_json(options['thresholds'])
+        baseline = self.load_json(options['baseline'])
+        scale = {key: options[key] for key in ('users', 'libraries', 'contents', 'features', 'attachments')}
+        user = suite.seed(batch_size=options['batch_size'], **scale)
+        data = suite.Data(user)
+        sizes = options['size'] or [suite.parse_size(size) for size in ('10M', '100M', '1G')]
+
+        results = []
+        try:
+            with tempfile.TemporaryDirectory() as static_root:
+                for target in self.targets(options, user, static_root):
+                    try:
+                        results += suite.run_scenarios(target, data, options['scenario'] or suite.SCENARIOS,
+                                                       options['repeat'], options['file_repeat'], sizes)
+                    finally:
+                        target.close()
+        finally:
+            data.discard_created()
+
+        for result in results:
+            line = "%(target)-22s %(scenario)-16s p50 %(p50_ms)8s ms  p95 %(p95_ms)8s ms  queries %(queries)4s" % result
+            if 'megabytes_per_second' in result:
+                line += "  %s MiB/s" % result['megabytes_per_second']
+            if result['errors']:
+                line += "  errors %d" % result['errors']
+            self.stdout.write(line)
+
+        report = suite.report(scale, results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        failures = suite.check(report, thresholds, baseline, options['tolerance'])
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError("%d benchmark checks failed" % len(failures))
+
+    def targets(self, options, user, static_root):
+        for name in options['target'] or ['client']:
+            if name == 'client':
+                yield suite.ClientTarget(user)
+                continue
+            for profile in options['profile'] or ['dev']:
+                yield suite.ServerTarget(profile, user.username, static_root, options['workers'])
+
+    def load_json(self, path):
+        if not path:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError("cannot read %s: %s" % (path, e))
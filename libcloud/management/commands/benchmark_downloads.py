@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from libcloud.benchmarks.downloads import compare
+
+
+class Command(BaseCommand):
+    help = ("Compare how many concurrent slow downloads one process holds through the async ASGI path and "
+            "through a pool of sync WSGI workers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help="Concurrent downloads.")
+        parser.add_argument('--size', type=int, default=1024, help="File size in KiB.")
+        parser.add_argument('--delay', type=float, default=0.05, help="Seconds a client takes per 64 KiB block.")
+        parser.add_argument('--workers', type=int, default=4, help="Sync workers of the WSGI run.")
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        results = compare(clients=options['clients'], size=options['size'] * 1024, delay=options['delay'],
+                          workers=options['workers'])
+        for result in results:
+            self.stdout.write("%(mode)s: %(completed)d/%(clients)d downloads in %(seconds).2fs, "
+                              "peak %(peak_concurrent_downloads)d concurrent, %(peak_threads)d threads" % result)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
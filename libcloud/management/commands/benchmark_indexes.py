@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from libcloud.benchmarks.indexes import compare, set_indexes
+from libcloud.benchmarks.seed import Seeder, describe_database
+
+
+class Command(BaseCommand):
+    help = ("Seed a large data set and compare plans and latency of the hot queries without and with the "
+            "composite indexes. It drops indexes of the configured database, so it only runs against a "
+            "scratch database, confirmed with --yes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contents', type=int, default=100000, help="Contents of the benchmark user.")
+        parser.add_argument('--libraries', type=int, default=50)
+        parser.add_argument('--features', type=int, default=3, help="Features per content.")
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20, help="Executions per query and index set.")
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+        parser.add_argument('--yes', action='store_true',
+                            help="Confirm that the configured database is a scratch database.")
+        parser.add_argument('--restore-indexes', action='store_true',
+                            help="Only recreate indexes a killed run left dropped.")
+
+    def handle(self, *args, **options):
+        if options['restore_indexes']:
+            set_indexes(True)
+            return
+        if not options['yes']:
+            raise CommandError("this seeds %d contents into the %s and drops its indexes while it runs; point "
+                               "the settings at a scratch database and pass --yes" % (options['contents'],
+                                                                                      describe_database()))
+        seeder = Seeder(users=1, libraries=options['libraries'], contents=options['contents'],
+                        features=options['features'], batch_size=options['batch_size'])
+        if not seeder.is_seeded():
+            self.stdout.write("seeding %d contents..." % options['contents'])
+        user = seeder.run()[0]
+
+        results = compare(user, repeat=options['repeat'])
+        for result in results:
+            self.stdout.write(self.style.MIGRATE_HEADING(result['query']))
+            self.stdout.write("  before: %8.3f ms  %s" % (result['before_ms'], result['plan_before'].replace('\n', ' | ')))
+            self.stdout.write("  after:  %8.3f ms  %s" % (result['after_ms'], result['plan_after'].replace('\n', ' | ')))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
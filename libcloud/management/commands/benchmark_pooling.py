@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from libcloud.benchmarks.pooling import compare
+
+
+class Command(BaseCommand):
+    help = ("Compare per-request latency with a new database connection per request, persistent connections "
+            "and the connection pool. Needs a PostgreSQL database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Simulated requests per thread and mode.")
+        parser.add_argument('--threads', type=int, default=4, help="Concurrent request threads.")
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            results = compare(requests=options['requests'], threads=options['threads'])
+        except ValueError as e:
+            raise CommandError(e)
+        for result in results:
+            self.stdout.write("%(mode)-28s median %(median_ms)8.3f ms  p95 %(p95_ms)8.3f ms" % result)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
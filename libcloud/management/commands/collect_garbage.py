@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from libcloud.garbage import GarbageCollector
+
+
+class Command(BaseCommand):
+    help = ("Delete files under MEDIA_ROOT that no content or attachment refers to: left over by deleted rows, "
+            "failed uploads and abandoned upload sessions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list what would be removed.")
+        parser.add_argument('--quarantine', action='store_true',
+                            help="Move orphaned files to MEDIA_ROOT/.quarantine/<time>/ instead of deleting them.")
+        parser.add_argument('--grace', type=int,
+                            help="Leave files younger than this many seconds alone; defaults to "
+                                 "LIBCLOUD_GC_GRACE_PERIOD.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        def report(candidate):
+            if options['verbosity'] > 1 or options['dry_run']:
+                self.stdout.write("%s (%d bytes)" % (candidate.path, candidate.size))
+
+        collector = GarbageCollector(grace=options['grace'], quarantine=options['quarantine'],
+                                     dry_run=options['dry_run'], batch_size=options['batch_size'], callback=report)
+        files, reclaimed = collector.run()
+        if options['dry_run']:
+            action = 'would be removed'
+        elif options['quarantine']:
+            action = 'quarantined in %s' % collector.quarantine_root
+        else:
+            action = 'deleted'
+        self.stdout.write(self.style.SUCCESS("%d orphaned files %s, %s reclaimed, %d abandoned upload sessions" % (
+            files, action, filesizeformat(reclaimed), collector.sessions)))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from libcloud.models import Content, Library
+
+
+class Command(BaseCommand):
+    help = "Verify or rebuild the denormalized Library.content_count counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report libraries whose counter is wrong; exit with an error if any is.")
+
+    def handle(self, *args, **options):
+        counts = Content.objects.filter(library=OuterRef('pk')).values('library').annotate(n=Count('pk')).values('n')
+        actual = Coalesce(Subquery(counts), 0)
+        with transaction.atomic():
+            wrong = Library.objects.annotate(actual=actual).exclude(content_count=F('actual'))
+            for library in wrong.values('pk', 'name', 'content_count', 'actual').iterator():
+                self.stdout.write("library %(pk)s (%(name)s): stored %(content_count)s, actual %(actual)s" % library)
+            mismatches = wrong.count()
+            if options['check']:
+                if mismatches:
+                    raise CommandError("%d library counters are out of date" % mismatches)
+            elif mismatches:
+                Library.objects.update(content_count=actual)
+        self.stdout.write(self.style.SUCCESS(
+            "%d library counters %s" % (mismatches, 'out of date' if options['check'] else 'rebuilt')))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from libcloud import derivatives
+from libcloud.models import Content
+from libcloud.processing import generate_derivatives
+
+
+class Command(BaseCommand):
+    help = "Queue thumbnail and preview rendering for contents that have none yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Render again even where derivatives exist.")
+
+    def handle(self, *args, **options):
+        if derivatives.Image is None:
+            raise CommandError("Pillow is not installed")
+        contents = Content.objects.all() if options['all'] else Content.objects.filter(thumbnail='')
+        payloads = [{'pk': pk} for pk, name in contents.values_list('pk', 'file').iterator()
+                    if derivatives.get_renderer(name)]
+        with transaction.atomic():
+            generate_derivatives.enqueue_many(payloads)
+        self.stdout.write(self.style.SUCCESS("%d contents queued" % len(payloads)))
@@ -0,0 +1,39 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from libcloud.bulk_import import import_contents
+
+
+class Command(BaseCommand):
+    help = ("Bulk import contents with their features and attachments from a directory, zip or tar archive "
+            "described by a CSV or JSONL manifest.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="Owner of the imported contents.")
+        parser.add_argument('source', help="Directory, zip or tar archive holding the files.")
+        parser.add_argument('--manifest', help="Manifest file; defaults to manifest.jsonl or manifest.csv in the source.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows written per transaction.")
+        parser.add_argument('--strict', action='store_true',
+                            help="Import nothing if any row is invalid instead of skipping invalid rows.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError("user %s does not exist" % options['username'])
+        started = time.monotonic()
+        try:
+            manifest = open(options['manifest'], 'rb') if options['manifest'] else None
+            report = import_contents(user, options['source'], manifest=manifest, manifest_name=options['manifest'],
+                                     batch_size=options['batch_size'], strict=options['strict'])
+        except (OSError, ValidationError) as e:
+            raise CommandError(e)
+        for line, message in report.errors:
+            self.stderr.write("line %s: %s" % (line, message))
+        self.stdout.write(self.style.SUCCESS("%d contents imported in %.1fs, %d rows rejected"
+                                             % (report.created, time.monotonic() - started, len(report.errors))))
+        if options['strict'] and report.errors:
+            raise CommandError("nothing was imported")
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from libcloud.benchmarks.load import PROFILES, run
+
+
+class Command(BaseCommand):
+    help = ("Start the app under each serving profile and measure requests per second of the home page and a "
+            "content page with logged-in clients. Run it against a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                            help="Profile to measure; repeat for several. Defaults to all of them.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Concurrent keep-alive clients.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds per page and profile.")
+        parser.add_argument('--workers', type=int, help="Worker processes of the gunicorn profiles.")
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        profiles = options['profile'] or sorted(PROFILES)
+        results = run(profiles, concurrency=options['concurrency'], duration=options['duration'],
+                      workers=options['workers'])
+        for result in results:
+            self.stdout.write("%(profile)-16s %(path)-20s %(requests_per_second)8.1f req/s  p50 %(p50_ms)s ms  "
+                              "p95 %(p95_ms)s ms  errors %(errors)d" % result)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,39 @@
+import multiprocessing
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from libcloud import tasks
+
+
+def work(options):
+    tasks.work(burst=options['burst'], idle_sleep=options['sleep'])
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (checksums and other post-upload processing)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes to fork.")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due instead of waiting.")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], LocMemCache):
+            # Jobs invalidate cache entries (the sidebar) that the web processes serve.
+            self.stderr.write("Warning: the cache is local to this process, so the web processes will not see what "
+                              "jobs invalidate. Run the worker with the settings of the web processes and a shared "
+                              "cache (REDIS_URL).")
+        if options['processes'] <= 1:
+            done = tasks.work(burst=options['burst'], idle_sleep=options['sleep'])
+            self.stdout.write("%d jobs run" % done)
+            return
+        # Children must open their own database connections.
+        connections.close_all()
+        workers = [multiprocessing.Process(target=work, args=(options,)) for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,75 @@
+import os
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import BigIntegerField, F, OuterRef, Subquery, Value
+
+from libcloud.models import Attachment, Content, StorageUsage, StoredFile
+from libcloud.storage import DeduplicatingStorage
+
+
+def file_size(storage, name, blob_size):
+    if blob_size is not None:
+        return blob_size
+    try:
+        # Not a deduplicated file (or no such storage): it sits at its plain path.
+        return os.stat(FileSystemStorage.path(storage, name)).st_size
+    except (OSError, ValueError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Verify or rebuild the stored sizes of contents and attachments and the StorageUsage ledger against "
+            "the files on disk, in one pass over the rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report wrong sizes and usage; exit with an error if there is any.")
+
+    def rows(self, model, owner):
+        storage = model._meta.get_field('file').storage
+        if isinstance(storage, DeduplicatingStorage):
+            blob_size = Subquery(StoredFile.objects.filter(name=OuterRef('file')).values('blob__size')[:1])
+        else:
+            blob_size = Value(None, output_field=BigIntegerField())
+        rows = model.objects.annotate(owner=F(owner), blob_size=blob_size) \
+            .values_list('pk', 'owner', 'file', 'size', 'blob_size').order_by()
+        for pk, owner, name, size, blob_size in rows.iterator(chunk_size=2000):
+            yield pk, owner, name, size, file_size(storage, name, blob_size)
+
+    def handle(self, *args, **options):
+        usage = Counter()
+        wrong_sizes = {Content: [], Attachment: []}
+        missing = 0
+        for model, owner in ((Content, 'creator_id'), (Attachment, 'content__creator_id')):
+            label = model._meta.model_name
+            for pk, owner_id, name, size, actual in self.rows(model, owner):
+                if actual is None:
+                    self.stdout.write("%s %s: %s is missing" % (label, pk, name))
+                    missing += 1
+                    actual = 0
+                usage[owner_id] += actual
+                if actual != size:
+                    self.stdout.write("%s %s: stored size %s, actual %s" % (label, pk, size, actual))
+                    wrong_sizes[model].append(model(pk=pk, size=actual))
+
+        ledger = dict(StorageUsage.objects.values_list('user_id', 'used'))
+        wrong_usage = {user_id: usage[user_id] for user_id in set(ledger) | set(usage)
+                       if ledger.get(user_id, 0) != usage[user_id]}
+        for user_id, used in sorted(wrong_usage.items()):
+            self.stdout.write("user %s: stored usage %s, actual %s" % (user_id, ledger.get(user_id, 0), used))
+
+        mismatches = sum(map(len, wrong_sizes.values())) + len(wrong_usage)
+        if options['check']:
+            if mismatches:
+                raise CommandError("%d sizes and usage totals are out of date" % mismatches)
+        else:
+            with transaction.atomic():
+                for model, instances in wrong_sizes.items():
+                    model.objects.bulk_update(instances, ['size'], batch_size=1000)
+                for user_id, used in wrong_usage.items():
+                    StorageUsage.objects.update_or_create(user_id=user_id, defaults={'used': used})
+        self.stdout.write(self.style.SUCCESS("%d sizes and usage totals %s, %d files missing" % (
+            mismatches, 'out of date' if options['check'] else 'rebuilt', missing)))
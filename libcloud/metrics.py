@@ -0,0 +1,283 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+
+# Upper bounds of the histogram buckets; the last one is +Inf.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, float('inf'))
+
+METRICS = {
+    'libcloud_requests_total': ('counter', "Requests by route, method and status."),
+    'libcloud_request_duration_seconds': ('histogram', "Time until the response was ready, by route."),
+    'libcloud_db_queries': ('histogram', "SQL queries per request, by route."),
+    'libcloud_db_seconds_total': ('counter', "Time spent in SQL queries, by route."),
+    'libcloud_template_seconds_total': ('counter', "Time spent rendering templates, by route."),
+    'libcloud_response_bytes_total': ('counter', "Response body bytes sent, streamed ones included, by route."),
+}
+
+# The RequestStats of the request being handled, also seen by the threads
+# sync_to_async runs its sync parts in.
+current = ContextVar('libcloud_request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'template_time', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+
+
+class Registry:
+    """
+    The metrics of this process. With LIBCLOUD_METRICS_DIR set, every process
+    writes its numbers there now and then and the metrics endpoint adds up
+    all files, so one scrape covers every worker.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.written = 0.0
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        histogram = self.values.get(key)
+        if histogram is None:
+            histogram = self.values[key] = [0] * len(buckets) + [0.0]
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def record(self, route, method, status, duration, stats, size):
+        with self.lock:
+            self.inc('libcloud_requests_total', (route, method, str(status)))
+            self.observe('libcloud_request_duration_seconds', (route, method), duration, DURATION_BUCKETS)
+            self.observe('libcloud_db_queries', (route,), stats.queries, QUERY_BUCKETS)
+            self.inc('libcloud_db_seconds_total', (route,), stats.db_time)
+            self.inc('libcloud_template_seconds_total', (route,), stats.template_time)
+            if size:
+                self.inc('libcloud_response_bytes_total', (route,), size)
+        self.maybe_write()
+
+    def add_bytes(self, route, size):
+        with self.lock:
+            self.inc('libcloud_response_bytes_total', (route,), size)
+        self.maybe_write()
+
+    def snapshot(self):
+        with self.lock:
+            return [[name, list(labels), value] for (name, labels), value in self.values.items()]
+
+    def maybe_write(self, force=False):
+        directory = getattr(settings, 'LIBCLOUD_METRICS_DIR', None)
+        if not directory or (not force and time.monotonic() - self.written < 1):
+            return
+        self.written = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path, os.path.join(directory, 'metrics-%d.json' % os.getpid()))
+
+    def collect(self):
+        """This process' metrics, added to those the other processes wrote."""
+        directory = getattr(settings, 'LIBCLOUD_METRICS_DIR', None)
+        if not directory:
+            return self.snapshot()
+        self.maybe_write(force=True)
+        total = {}
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in entries:
+                key = (name, tuple(labels))
+                if isinstance(value, list):
+                    merged = total.setdefault(key, [0] * len(value))
+                    total[key] = [a + b for a, b in zip(merged, value)]
+                else:
+                    total[key] = total.get(key, 0) + value
+        return [[name, list(labels), value] for (name, labels), value in total.items()]
+
+
+registry = Registry()
+
+LABEL_NAMES = {
+    'libcloud_requests_total': ('route', 'method', 'status'),
+    'libcloud_request_duration_seconds': ('route', 'method'),
+}
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{%s}' % ','.join('%s="%s"' % (name, value) for (name, _), value in zip(pairs, escaped))
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(entries):
+    """``entries`` in the Prometheus text exposition format."""
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        names = LABEL_NAMES.get(name, ('route',))
+        buckets = QUERY_BUCKETS if name == 'libcloud_db_queries' else DURATION_BUCKETS
+        for entry_name, labels, value in sorted(entries):
+            if entry_name != name:
+                continue
+            if kind == 'counter':
+                lines.append('%s%s %s' % (name, format_labels(names, labels), format_number(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_number(bound)
+                lines.append('%s_bucket%s %d' % (name, format_labels(names, labels, [('le', le)]), cumulative))
+            lines.append('%s_sum%s %s' % (name, format_labels(names, labels), format_number(value[-1])))
+            lines.append('%s_count%s %d' % (name, format_labels(names, labels), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    # Connections are per thread and live longer than a request, so the
+    # wrapper stays installed and finds the request through ``current``.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.origin = template.origin
+
+    def render(self, context=None, request=None):
+        stats = current.get()
+        if stats is None or stats.rendering:
+            # Templates rendered from within a template (form helpers) count once.
+            return self.template.render(context, request)
+        stats.rendering = True
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+            stats.rendering = False
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """The Django template backend, timing renders for the request metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL queries and time, template time and body bytes per
+    route into ``registry``; with LIBCLOUD_SERVER_TIMING also report them to
+    the browser in a Server-Timing header. Works for sync and async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'LIBCLOUD_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function (Django 4.0 idiom).
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, duration):
+        match = request.resolver_match
+        # Unmatched URLs share one label so that scanners can't blow up the series count.
+        route = match.view_name if match else '<unmatched>'
+        if getattr(response, 'file_to_stream', None) is not None:
+            # Replacing the content would drop file_to_stream, and with it the
+            # server's wsgi.file_wrapper (sendfile); the length is known anyway.
+            size = 0 if request.method == 'HEAD' else int(response.get('Content-Length') or 0)
+        elif response.streaming:
+            response.streaming_content = count_bytes(response.streaming_content, route)
+            size = 0
+        else:
+            size = len(response.content)
+        registry.record(route, request.method, response.status_code, duration, stats, size)
+        if getattr(settings, 'LIBCLOUD_SERVER_TIMING', False):
+            response['Server-Timing'] = 'app;dur=%.1f, db;dur=%.1f;desc="%d queries", tpl;dur=%.1f' % (
+                duration * 1000, stats.db_time * 1000, stats.queries, stats.template_time * 1000)
+        return response
+
+
+def count_bytes(content, route):
+    sent = 0
+    try:
+        for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        registry.add_bytes(route, sent)
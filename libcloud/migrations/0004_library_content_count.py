@@ -0,0 +1,32 @@
+# Generated by Django 4.0.2 on 2026-10-18 02:50
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_contents(apps, schema_editor):
+    Library = apps.get_model('libcloud', 'Library')
+    Content = apps.get_model('libcloud', 'Content')
+    counts = Content.objects.filter(library=OuterRef('pk')).values('library').annotate(n=Count('pk')).values('n')
+    Library.objects.update(content_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libcloud', '0003_stored_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='library',
+            name='content_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='library',
+            index=models.Index(fields=['user', '-content_count'], name='library_user_count_idx'),
+        ),
+        migrations.RunPython(count_contents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.2 on 2026-10-18 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libcloud', '0004_library_content_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='content',
+            index=models.Index(fields=['creator', '-id'], name='content_creator_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contentfeature',
+            index=models.Index(fields=['content', 'feature_type'], name='feature_content_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='library',
+            index=models.Index(fields=['user', 'content_type'], name='library_user_type_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.0.2 on 2026-10-18 02:52
+
+from django.db import migrations, models
+
+NUMBER, BOOLEAN = 1, 3
+BOOLEAN_VALUES = {"1": True, "true": True, "2": False, "false": False}
+
+
+def fill_typed_values(apps, schema_editor):
+    ContentFeature = apps.get_model('libcloud', 'ContentFeature')
+    batch = []
+    for feature in ContentFeature.objects.filter(feature_type__type__in=[NUMBER, BOOLEAN]) \
+            .select_related('feature_type').iterator(chunk_size=2000):
+        if feature.feature_type.type == NUMBER:
+            try:
+                feature.number_value = float(feature.value)
+            except ValueError:
+                continue
+        else:
+            feature.boolean_value = BOOLEAN_VALUES.get(feature.value.strip().lower())
+        batch.append(feature)
+        if len(batch) == 2000:
+            ContentFeature.objects.bulk_update(batch, ['number_value', 'boolean_value'])
+            batch = []
+    ContentFeature.objects.bulk_update(batch, ['number_value', 'boolean_value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libcloud', '0005_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentfeature',
+            name='boolean_value',
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='contentfeature',
+            name='number_value',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='contentfeature',
+            index=models.Index(fields=['feature_type', 'number_value'], name='feature_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contentfeature',
+            index=models.Index(fields=['feature_type', 'value'], name='feature_string_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contentfeature',
+            index=models.Index(fields=['feature_type', 'boolean_value'], name='feature_boolean_idx'),
+        ),
+        migrations.RunPython(fill_typed_values, migrations.RunPython.noop),
+    ]
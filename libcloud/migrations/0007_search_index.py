@@ -0,0 +1,50 @@
+import os
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("CREATE VIRTUAL TABLE libcloud_search USING fts5(body, user_id UNINDEXED)")
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE libcloud_search ("
+            "content_id bigint PRIMARY KEY, user_id integer NOT NULL, body text NOT NULL, "
+            "document tsvector GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED)")
+        schema_editor.execute("CREATE INDEX libcloud_search_document_idx ON libcloud_search USING gin (document)")
+        schema_editor.execute("CREATE INDEX libcloud_search_user_idx ON libcloud_search (user_id)")
+    else:
+        schema_editor.execute(
+            "CREATE TABLE libcloud_search (content_id bigint PRIMARY KEY, user_id integer NOT NULL, body text NOT NULL)")
+        schema_editor.execute("CREATE INDEX libcloud_search_user_idx ON libcloud_search (user_id)")
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute("DROP TABLE libcloud_search")
+
+
+def fill_search_index(apps, schema_editor):
+    Content = apps.get_model('libcloud', 'Content')
+    ContentFeature = apps.get_model('libcloud', 'ContentFeature')
+    rowid = 'rowid' if schema_editor.connection.vendor == 'sqlite' else 'content_id'
+    with schema_editor.connection.cursor() as cursor:
+        for content in Content.objects.select_related('type', 'library').iterator(chunk_size=2000):
+            parts = [os.path.basename(content.file.name), content.type.name]
+            if content.library is not None:
+                parts.append(content.library.name)
+            parts.extend(ContentFeature.objects.filter(content=content).values_list('value', flat=True))
+            cursor.execute("INSERT INTO libcloud_search (%s, user_id, body) VALUES (%%s, %%s, %%s)" % rowid,
+                           [content.pk, content.creator_id, ' '.join(parts)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libcloud', '0006_typed_feature_values'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
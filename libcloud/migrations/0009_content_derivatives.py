@@ -0,0 +1,23 @@
+# Generated by Django 4.0.2 on 2026-10-18 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libcloud', '0008_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='content',
+            name='preview',
+            field=models.FileField(blank=True, editable=False, max_length=255, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='content',
+            name='thumbnail',
+            field=models.FileField(blank=True, editable=False, max_length=255, upload_to=''),
+        ),
+    ]
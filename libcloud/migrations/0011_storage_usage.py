@@ -0,0 +1,34 @@
+# Generated by Django 4.0.2 on 2026-10-18 04:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('libcloud', '0010_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('used', models.BigIntegerField(default=0)),
+                ('quota', models.BigIntegerField(blank=True, help_text='Bytes; empty for the default quota.', null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='content',
+            name='size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
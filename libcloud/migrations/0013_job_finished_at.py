@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libcloud', '0012_uploadsession_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def split_search_words(apps, schema_editor):
+    # Rows indexed before words were split on punctuation in the body; FTS5 and
+    # the LIKE fallback match them anyway, PostgreSQL's tsvector does not.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("UPDATE libcloud_search SET body = trim(regexp_replace(body, '[\\W_]+', ' ', 'g'))")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libcloud', '0013_job_finished_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_search_words, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,12 @@
 import os
+import uuid
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Model
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Model
 from django.urls import reverse
+from django.utils import timezone
 
 
 def get_sentinel_user():
@@ -32,6 +34,8 @@ class ContentType(Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(blank=False, max_length=40)
     attachment_types = models.ManyToManyField(AttachmentType, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         self.full_clean()
@@ -62,20 +66,105 @@ class Library(Model):
     user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
     content_type = models.ForeignKey(to=ContentType, on_delete=models.CASCADE)
+    content_count = models.IntegerField(default=0, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-content_count'], name='library_user_count_idx'),
+            models.Index(fields=['user', 'content_type'], name='library_user_type_idx'),
+        ]
 
     def get_absolute_url(self):
         return reverse('libcloud:each_library', kwargs={'pk': self.pk})
 
 
+def touch(model, pks):
+    """Mark the ``model`` rows ``pks`` as modified now, e.g. when a row shown with them changed."""
+    pks = [pk for pk in pks if pk is not None]
+    if pks:
+        model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+def fill_file_details(instance):
+    """Fill in the size of a new row's file and the SHA-256 the upload handler computed."""
+    if not instance.file:
+        return
+    if not instance.size:
+        instance.size = instance.file.size
+    if not instance.checksum and not instance.file._committed:
+        instance.checksum = getattr(instance.file.file, 'sha256', '')
+
+
+def adjust_content_count(library_id, delta):
+    if library_id is not None:
+        Library.objects.filter(pk=library_id).update(content_count=F('content_count') + delta)
+
+
+class StorageUsage(Model):
+    """
+    Bytes of uploaded files (contents and their attachments) per user, kept
+    up to date as rows come and go; ``quota`` overrides LIBCLOUD_STORAGE_QUOTA.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    used = models.BigIntegerField(default=0)
+    quota = models.BigIntegerField(null=True, blank=True, help_text="Bytes; empty for the default quota.")
+
+
+def adjust_storage_usage(user_id, delta):
+    if user_id is None or not delta:
+        return
+    if StorageUsage.objects.filter(user_id=user_id).update(used=F('used') + delta):
+        return
+    try:
+        with transaction.atomic():
+            StorageUsage.objects.create(user_id=user_id, used=delta)
+    except IntegrityError:
+        StorageUsage.objects.filter(user_id=user_id).update(used=F('used') + delta)
+
+
 class Content(Model):
     creator = models.ForeignKey(User, on_delete=models.SET(get_sentinel_user))
     type = models.ForeignKey(to=ContentType, on_delete=models.CASCADE)
     file = models.FileField(upload_to=get_content_upload_path)
     library = models.ForeignKey(to=Library, on_delete=models.SET_NULL, null=True, blank=True)
+    # Bytes of the file, filled in when the row is created.
+    size = models.BigIntegerField(default=0, editable=False)
+    # SHA-256 of the file, filled in by the post-upload job.
+    checksum = models.CharField(max_length=64, blank=True, editable=False)
+    # Rendered images of the file (libcloud/derivatives.py), empty until the
+    # post-upload job made them or when the file has none.
+    thumbnail = models.FileField(max_length=255, blank=True, editable=False)
+    preview = models.FileField(max_length=255, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['creator', '-id'], name='content_creator_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_library_id = instance.__dict__.get('library_id')
+        return instance
 
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs)
+        saved_library_id = None if self._state.adding else getattr(self, '_saved_library_id', None)
+        adding = self._state.adding
+        if adding:
+            fill_file_details(self)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if saved_library_id != self.library_id:
+                adjust_content_count(saved_library_id, -1)
+                adjust_content_count(self.library_id, 1)
+            if adding:
+                adjust_storage_usage(self.creator_id, self.size)
+        self._saved_library_id = self.library_id
 
     def filename(self):
         return os.path.basename(self.file.name)
@@ -86,19 +175,64 @@ class Content(Model):
     def clean(self):
         super().clean()
         if self.library is not None:
-            if self.library.content_type != self.type:
+            if self.library.content_type_id != self.type_id:
                 raise ValidationError("chosen library has a different content type")
 
 
+BOOLEAN_VALUES = {"1": True, "true": True, "2": False, "false": False}
+
+
+def typed_feature_value(feature_type, value):
+    """Convert the stored string ``value`` of a feature of ``feature_type`` to its Python type."""
+    if feature_type == ContentTypeFeature.FeatureType.Number:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValidationError("%s is not a number" % value)
+    if feature_type == ContentTypeFeature.FeatureType.Boolean:
+        try:
+            return BOOLEAN_VALUES[str(value).strip().lower()]
+        except KeyError:
+            raise ValidationError("%s is not a boolean" % value)
+    return value
+
+
 class ContentFeature(Model):
     content = models.ForeignKey(Content, on_delete=models.CASCADE)
     feature_type = models.ForeignKey(ContentTypeFeature, on_delete=models.CASCADE, null=True)
     value = models.CharField(max_length=100)
+    number_value = models.FloatField(null=True, blank=True, editable=False)
+    boolean_value = models.BooleanField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content', 'feature_type'], name='feature_content_type_idx'),
+            models.Index(fields=['feature_type', 'number_value'], name='feature_number_idx'),
+            models.Index(fields=['feature_type', 'value'], name='feature_string_idx'),
+            models.Index(fields=['feature_type', 'boolean_value'], name='feature_boolean_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         self.full_clean()
         super().save(*args, **kwargs)
 
+    def fill_typed_value(self):
+        self.number_value = self.boolean_value = None
+        if self.feature_type is None:
+            return
+        typed = typed_feature_value(self.feature_type.type, self.value)
+        if self.feature_type.type == ContentTypeFeature.FeatureType.Number:
+            self.number_value = typed
+        elif self.feature_type.type == ContentTypeFeature.FeatureType.Boolean:
+            self.boolean_value = typed
+
+    def clean(self):
+        super().clean()
+        try:
+            self.fill_typed_value()
+        except ValidationError as e:
+            raise ValidationError({'value': e.messages})
+
 
 def get_attachment_upload_path(instance, filename):
     return "_".join(["%s" % os.path.splitext(instance.content.file.name)[0], filename])
@@ -108,13 +242,92 @@ class Attachment(Model):
     content = models.ForeignKey(Content, on_delete=models.CASCADE)
     type = models.ForeignKey(AttachmentType, on_delete=models.CASCADE)
     file = models.FileField(upload_to=get_attachment_upload_path)
+    size = models.BigIntegerField(default=0, editable=False)
+    checksum = models.CharField(max_length=64, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        if adding:
+            fill_file_details(self)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                # Attachments are stored in the directory of the content's creator.
+                adjust_storage_usage(self.content.creator_id, self.size)
 
     def get_absolute_url(self):
         return reverse('libcloud:content', kwargs={'pk': self.content.pk})
 
     def filename(self):
         return os.path.basename(self.file.name)
+
+
+class UploadSession(Model):
+    class Kind(models.IntegerChoices):
+        Content = 1
+        Attachment = 2
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.IntegerField(choices=Kind.choices)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    checksum = models.CharField(max_length=64, blank=True)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
+    library = models.ForeignKey(Library, on_delete=models.SET_NULL, null=True, blank=True)
+    content = models.ForeignKey(Content, on_delete=models.CASCADE, null=True, blank=True)
+    attachment_type = models.ForeignKey(AttachmentType, on_delete=models.CASCADE, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    # Last activity; sessions idle for LIBCLOUD_UPLOAD_SESSION_EXPIRY are abandoned.
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class UploadChunk(Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE)
+    offset = models.BigIntegerField()
+    size = models.BigIntegerField()
+
+
+class StoredBlob(Model):
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+
+
+class StoredFile(Model):
+    name = models.CharField(max_length=255, unique=True)
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT)
+
+
+class Job(Model):
+    class Status(models.IntegerChoices):
+        Pending = 1
+        Running = 2
+        Done = 3
+        Failed = 4
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    status = models.SmallIntegerField(choices=Status.choices, default=Status.Pending)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the most urgent due job: WHERE status = pending AND run_at <= now
+            # ORDER BY priority DESC, run_at.
+            models.Index(fields=['status', '-priority', 'run_at'], name='job_ready_idx'),
+        ]
+
+    def __str__(self):
+        return "%s %s" % (self.name, self.payload)
@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.core import signing
+from django.utils.functional import cached_property
+
+CURSOR_SALT = 'libcloud.pagination'
+
+
+def default_page_size():
+    return getattr(settings, 'LIBCLOUD_PAGE_SIZE', 50)
+
+
+def page_size(request):
+    default = default_page_size()
+    try:
+        size = int(request.GET.get('page_size', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, getattr(settings, 'LIBCLOUD_MAX_PAGE_SIZE', 200)))
+
+
+def make_cursor(direction, pk):
+    return signing.dumps([direction, pk], salt=CURSOR_SALT)
+
+
+def read_cursor(token):
+    try:
+        direction, pk = signing.loads(token, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None, None
+    if direction not in ('after', 'before') or not isinstance(pk, int):
+        return None, None
+    return direction, pk
+
+
+class KeysetPage:
+    """
+    One page of a queryset ordered by ``id`` (or ``-id``), addressed by a cursor.
+
+    The page is fetched with ``WHERE id > last_seen ORDER BY id LIMIT n``
+    instead of an OFFSET, so page 1000 costs the same as page one.
+    ``object_list`` stays a QuerySet; the neighbours are probed with EXISTS
+    queries only when a template asks for them.
+    """
+
+    def __init__(self, request, queryset, descending=False, params=None):
+        self.request = request
+        self.queryset = queryset
+        self.descending = descending
+        self.size = page_size(request)
+        self.direction, self.cursor = read_cursor(request.GET.get('cursor', ''))
+        # The query parameters the links keep besides cursor and page size,
+        # all of the request's unless only some of them shape the listing.
+        self.params = request.GET.copy() if params is None else params.copy()
+        for key in ('cursor', 'page_size'):
+            self.params.pop(key, None)
+        if self.size != default_page_size():
+            self.params['page_size'] = self.size
+
+    @property
+    def cache_key(self):
+        """What selects the rows of this page, for the key of a cached rendering."""
+        return '%s:%s:%d:%s' % (self.direction, self.cursor, self.size, self.params.urlencode())
+
+    def newer(self, pk):
+        # Rows that come after ``pk`` in the listing order.
+        return self.queryset.filter(**{'pk__lt' if self.descending else 'pk__gt': pk})
+
+    def older(self, pk):
+        return self.queryset.filter(**{'pk__gt' if self.descending else 'pk__lt': pk})
+
+    @property
+    def ordering(self):
+        return '-pk' if self.descending else 'pk'
+
+    @cached_property
+    def object_list(self):
+        if self.direction == 'before':
+            reverse = '-pk' if self.ordering == 'pk' else 'pk'
+            pks = list(self.older(self.cursor).order_by(reverse).values_list('pk', flat=True)[:self.size])
+            if pks:
+                return self.queryset.filter(pk__gte=min(pks), pk__lte=max(pks)).order_by(self.ordering)
+            self.direction = None
+        if self.direction == 'after':
+            return self.newer(self.cursor).order_by(self.ordering)[:self.size]
+        return self.queryset.order_by(self.ordering)[:self.size]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @cached_property
+    def first_pk(self):
+        return self.object_list[0].pk if len(self.object_list) else None
+
+    @cached_property
+    def last_pk(self):
+        return self.object_list[len(self.object_list) - 1].pk if len(self.object_list) else None
+
+    @cached_property
+    def has_next(self):
+        return self.last_pk is not None and self.newer(self.last_pk).exists()
+
+    @cached_property
+    def has_previous(self):
+        return self.first_pk is not None and self.direction is not None and self.older(self.first_pk).exists()
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def url(self, direction, pk):
+        params = self.params.copy()
+        params['cursor'] = make_cursor(direction, pk)
+        return '?' + params.urlencode()
+
+    @property
+    def next_url(self):
+        return self.url('after', self.last_pk) if self.has_next else None
+
+    @property
+    def previous_url(self):
+        return self.url('before', self.first_pk) if self.has_previous else None
+
+
+class KeysetPaginationMixin:
+    """ListView mixin replacing Django's OFFSET pagination with KeysetPage."""
+    descending = False
+
+    def get_paginate_by(self, queryset):
+        return page_size(self.request)
+
+    def paginate_queryset(self, queryset, page_size):
+        page = KeysetPage(self.request, queryset, descending=self.descending)
+        return None, page, page.object_list, None
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.utils import timezone
+
+from libcloud import derivatives
+from libcloud.fragments import bump_versions
+from libcloud.models import Attachment, Content, Library
+from libcloud.tasks import task
+
+MODELS = {'content': Content, 'attachment': Attachment}
+
+
+def file_digest(file):
+    digest = hashlib.sha256()
+    with file.open('rb') as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@task(name='libcloud.checksum')
+def compute_checksum(model, pk):
+    """Store the SHA-256 of an uploaded Content or Attachment file."""
+    model = MODELS[model]
+    instance = model.objects.filter(pk=pk).only('file').first()
+    if instance is None:
+        # Deleted before the job ran.
+        return
+    model.objects.filter(pk=pk).update(checksum=file_digest(instance.file))
+
+
+@task(name='libcloud.derivatives', priority=-1)
+def generate_derivatives(pk):
+    """Render the thumbnail and preview of a Content, replacing earlier ones."""
+    content = Content.objects.filter(pk=pk).only('file', 'library', 'checksum', 'thumbnail', 'preview').first()
+    if content is None:
+        return
+    names = derivatives.generate(content, content.checksum or file_digest(content.file))
+    if names is None:
+        return
+    old = {content.thumbnail.name, content.preview.name} - set(names.values()) - {''}
+    if Content.objects.filter(pk=pk, file=content.file.name).update(updated_at=timezone.now(), **names):
+        for name in old:
+            content.file.storage.delete(name)
+        bump_versions(Content, [pk])
+        bump_versions(Library, [content.library_id])
+    else:
+        # Deleted, or given another file, while rendering.
+        for name in names.values():
+            content.file.storage.delete(name)
+
+
+def schedule_processing(instances):
+    """Queue the post-upload jobs of new Content and Attachment rows."""
+    compute_checksum.enqueue_many([{'model': instance._meta.model_name, 'pk': instance.pk}
+                                   for instance in instances if not instance.checksum])
+    generate_derivatives.enqueue_many([{'pk': instance.pk} for instance in instances
+                                       if isinstance(instance, Content) and derivatives.get_renderer(instance.file.name)])
@@ -0,0 +1,77 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template.defaultfilters import filesizeformat
+
+from libcloud.models import StorageUsage, UploadSession
+from libcloud.uploads import session_expiry_cutoff
+
+
+class QuotaExceeded(ValidationError):
+    pass
+
+
+def get_usage(user):
+    """``(used, quota)`` in bytes for ``user``; quota is None when unlimited."""
+    used, quota = StorageUsage.objects.filter(user=user).values_list('used', 'quota').first() or (0, None)
+    if quota is None:
+        quota = getattr(settings, 'LIBCLOUD_STORAGE_QUOTA', None)
+    return used, quota
+
+
+def check_quota(user, size, session=None):
+    """
+    Raise QuotaExceeded unless ``size`` more bytes fit in the quota of
+    ``user``. Open upload sessions other than ``session`` have their space
+    reserved already, unless they were abandoned.
+    """
+    used, quota = get_usage(user)
+    if quota is None:
+        return
+    sessions = UploadSession.objects.filter(user=user, updated_at__gte=session_expiry_cutoff())
+    if session is not None:
+        sessions = sessions.exclude(pk=session.pk)
+    available = quota - used - (sessions.aggregate(reserved=Sum('size'))['reserved'] or 0)
+    if size > available:
+        raise QuotaExceeded("storage quota exceeded: %s do not fit in the %s left of %s" % (
+            filesizeformat(size), filesizeformat(max(available, 0)), filesizeformat(quota)))
+
+
+class StorageQuotaMiddleware:
+    """
+    Answer multipart uploads that cannot fit in the uploader's quota with a
+    413 before their body is read; Content-Length tells their size up front.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function (Django 4.0 idiom).
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        response = self.check(request)
+        return self.get_response(request) if response is None else response
+
+    async def __acall__(self, request):
+        response = await sync_to_async(self.check)(request)
+        return await self.get_response(request) if response is None else response
+
+    def check(self, request):
+        if request.method == 'POST' and request.content_type == 'multipart/form-data' \
+                and request.user.is_authenticated:
+            try:
+                check_quota(request.user, int(request.META.get('CONTENT_LENGTH') or 0))
+            except QuotaExceeded as e:
+                return HttpResponse("; ".join(e.messages), status=413, content_type='text/plain')
+            except ValueError:
+                pass
+        return None
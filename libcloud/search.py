@@ -0,0 +1,149 @@
+import re
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from libcloud.models import Content, ContentFeature
+
+TABLE = 'libcloud_search'
+TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+SEPARATOR_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def tokens(query):
+    return TOKEN_RE.findall(query or '')[:20]
+
+
+def document(content, values):
+    parts = [content.filename(), content.type.name]
+    if content.library is not None:
+        parts.append(content.library.name)
+    parts.extend(values)
+    # Split words on punctuation here: PostgreSQL's parser would otherwise keep
+    # "art_of_programming.pdf" as one file name token, matched by neither word.
+    return SEPARATOR_RE.sub(' ', ' '.join(parts)).strip()
+
+
+def rowid_column():
+    # The FTS5 table keys its rows by the content id through the rowid.
+    return 'rowid' if connection.vendor == 'sqlite' else 'content_id'
+
+
+def remove_contents(content_ids):
+    content_ids = list(content_ids)
+    if content_ids:
+        placeholders = ', '.join(['%s'] * len(content_ids))
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (TABLE, rowid_column(), placeholders), content_ids)
+
+
+def index_contents(content_ids):
+    """(Re)build the search rows of the given contents; ids of deleted contents are dropped."""
+    content_ids = list(content_ids)
+    if not content_ids:
+        return
+    values = defaultdict(list)
+    for content_id, value in ContentFeature.objects.filter(content_id__in=content_ids) \
+            .values_list('content_id', 'value'):
+        values[content_id].append(value)
+    contents = Content.objects.filter(pk__in=content_ids).select_related('type', 'library')
+    rows = [(content.pk, content.creator_id, document(content, values[content.pk])) for content in contents]
+    remove_contents(content_ids)
+    with connection.cursor() as cursor:
+        cursor.executemany("INSERT INTO %s (%s, user_id, body) VALUES (%%s, %%s, %%s)" % (TABLE, rowid_column()),
+                           rows)
+
+
+class PendingIndex:
+    """The contents a transaction asked to reindex, rebuilt by one on_commit callback."""
+
+    def __init__(self):
+        self.content_ids = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        index_contents(self.content_ids)
+
+
+def index_on_commit(content_ids):
+    """
+    Reindex ``content_ids`` once the current transaction commits. A content
+    saved with its features asks once per row; the requests of a transaction
+    share a single callback, so each search row is rebuilt once.
+    """
+    pending = next((func for sids, func in connection.run_on_commit
+                    if isinstance(func, PendingIndex) and not func.done), None)
+    if pending is not None:
+        pending.content_ids.update(content_ids)
+        return
+    pending = PendingIndex()
+    pending.content_ids.update(content_ids)
+    transaction.on_commit(pending)
+
+
+def rebuild_index(batch_size=2000):
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s" % TABLE)
+    batch = []
+    for pk in Content.objects.values_list('pk', flat=True).iterator(chunk_size=batch_size):
+        batch.append(pk)
+        if len(batch) == batch_size:
+            index_contents(batch)
+            batch = []
+    index_contents(batch)
+
+
+class SearchResults:
+    """
+    Lazily evaluated, ranked search hits of one user.
+
+    Behaves like a sequence of Content objects (``count()`` and slicing), so it
+    can be handed to django.core.paginator.Paginator: every page is one ranked
+    LIMIT/OFFSET query against the full-text index plus one query for the rows.
+    """
+
+    def __init__(self, user, query):
+        self.user = user
+        self.tokens = tokens(query)
+
+    def sql(self, select, order=False):
+        vendor = connection.vendor
+        if vendor == 'sqlite':
+            match = ' '.join('"%s"*' % token.replace('"', '""') for token in self.tokens)
+            return ("SELECT %s FROM %s WHERE %s MATCH %%s AND user_id = %%s %s"
+                    % (select, TABLE, TABLE, 'ORDER BY rank' if order else ''), [match, self.user.pk])
+        if vendor == 'postgresql':
+            tsquery = ' & '.join('%s:*' % token for token in self.tokens)
+            return ("SELECT %s FROM %s WHERE user_id = %%s AND document @@ to_tsquery('simple', %%s) %s"
+                    % (select, TABLE, "ORDER BY ts_rank(document, to_tsquery('simple', %s)) DESC" if order else ''),
+                    [self.user.pk, tsquery] + ([tsquery] if order else []))
+        likes = ' AND '.join(['body LIKE %s'] * len(self.tokens))
+        return ("SELECT %s FROM %s WHERE user_id = %%s AND %s %s"
+                % (select, TABLE, likes, 'ORDER BY content_id DESC' if order else ''),
+                [self.user.pk] + ['%%%s%%' % token for token in self.tokens])
+
+    def count(self):
+        if not self.tokens:
+            return 0
+        sql, params = self.sql('count(*)')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        if not self.tokens:
+            return []
+        start = item.start or 0
+        sql, params = self.sql(rowid_column(), order=True)
+        sql += " LIMIT %s OFFSET %s"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [item.stop - start, start])
+            ids = [row[0] for row in cursor.fetchall()]
+        contents = Content.objects.select_related('type').in_bulk(ids)
+        return [contents[pk] for pk in ids if pk in contents]
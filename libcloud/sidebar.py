@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from libcloud.models import Library
+
+
+def sidebar_cache_key(user_id):
+    return 'libcloud:sidebar:%s' % user_id
+
+
+def get_library_summary(user):
+    """The user's libraries, most populated first, as shown in the navigation bar and on the home page."""
+    key = sidebar_cache_key(user.pk)
+    libraries = cache.get(key)
+    if libraries is None:
+        libraries = list(Library.objects.filter(user=user).select_related('content_type')
+                         .order_by('-content_count'))
+        cache.set(key, libraries, getattr(settings, 'LIBCLOUD_SIDEBAR_CACHE_TIMEOUT', 300))
+    return libraries
+
+
+def invalidate_library_summary(user_id):
+    cache.delete(sidebar_cache_key(user_id))
@@ -0,0 +1,175 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from libcloud import processing, search
+from libcloud.fragments import bump_versions
+from libcloud.models import Attachment, AttachmentType, Content, ContentFeature, ContentType, ContentTypeFeature, \
+    Library, StorageUsage, adjust_content_count, touch
+from libcloud.sidebar import invalidate_library_summary
+from libcloud.storage import DeduplicatingStorage
+
+
+@receiver(post_delete, sender=Content)
+@receiver(post_delete, sender=Attachment)
+def release_stored_file(sender, instance, **kwargs):
+    # Deduplicated blobs are reference counted, so a deleted row has to give
+    # its reference back; plain files are left for the administrator.
+    if instance.file and isinstance(instance.file.storage, DeduplicatingStorage):
+        name, storage = instance.file.name, instance.file.storage
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(post_delete, sender=Content)
+def delete_derivatives(sender, instance, **kwargs):
+    # Unlike the uploads themselves, rendered derivatives are ours to remove.
+    names = [field.name for field in (instance.thumbnail, instance.preview) if field]
+    storage = instance.file.storage
+    transaction.on_commit(lambda: [storage.delete(name) for name in names])
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_save, sender=Attachment)
+def process_upload(sender, instance, created, **kwargs):
+    if created:
+        processing.schedule_processing([instance])
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+@receiver(post_save, sender=ContentType)
+def invalidate_owner_sidebar(sender, instance, **kwargs):
+    # After the commit: a request rebuilding the summary before it would
+    # otherwise cache the old rows until the entry expires.
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_library_summary(user_id))
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+def invalidate_creator_sidebar(sender, instance, **kwargs):
+    creator_id = instance.creator_id
+    transaction.on_commit(lambda: invalidate_library_summary(creator_id))
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+def bump_content_versions(sender, instance, **kwargs):
+    bump_versions(Content, [instance.pk])
+    # Both the library it left and the one it joined list it.
+    bump_versions(Library, {instance.library_id, getattr(instance, '_saved_library_id', None)})
+
+
+@receiver(post_save, sender=ContentFeature)
+@receiver(post_delete, sender=ContentFeature)
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def bump_owner_content_versions(sender, instance, **kwargs):
+    bump_versions(Content, [instance.content_id])
+    if sender is ContentFeature:
+        # Library pages filter their contents by feature values.
+        if ContentFeature.content.is_cached(instance):
+            library_ids = [instance.content.library_id]
+        else:
+            library_ids = Content.objects.filter(pk=instance.content_id).values_list('library_id', flat=True)
+        bump_versions(Library, library_ids)
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+def bump_library_version(sender, instance, **kwargs):
+    bump_versions(Library, [instance.pk])
+
+
+@receiver(post_save, sender=ContentType)
+@receiver(post_save, sender=ContentTypeFeature)
+@receiver(post_delete, sender=ContentTypeFeature)
+def bump_content_type_version(sender, instance, **kwargs):
+    bump_versions(ContentType, [instance.pk if sender is ContentType else instance.content_type_id])
+
+
+@receiver(post_save, sender=AttachmentType)
+def bump_attachment_type_contents(sender, instance, created, **kwargs):
+    if not created:
+        bump_versions(Content, Attachment.objects.filter(type=instance).values_list('content_id', flat=True))
+
+
+@receiver(post_save, sender=ContentFeature)
+@receiver(post_delete, sender=ContentFeature)
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def touch_owner_content(sender, instance, **kwargs):
+    touch(Content, [instance.content_id])
+
+
+@receiver(post_save, sender=ContentTypeFeature)
+@receiver(post_delete, sender=ContentTypeFeature)
+def touch_feature_content_type(sender, instance, **kwargs):
+    touch(ContentType, [instance.content_type_id])
+
+
+@receiver(m2m_changed, sender=ContentType.attachment_types.through)
+def touch_attachment_type_content_types(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        touch(ContentType, [instance.pk])
+    else:
+        # Cleared from the AttachmentType side: its content types are still linked before the clear.
+        touch(ContentType, pk_set if pk_set is not None else instance.contenttype_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=AttachmentType)
+def touch_attachment_type_users(sender, instance, created, **kwargs):
+    if not created:
+        touch(ContentType, instance.contenttype_set.values_list('pk', flat=True))
+        touch(Content, Attachment.objects.filter(type=instance).values_list('content_id', flat=True))
+
+
+@receiver(post_delete, sender=Content)
+def decrement_content_count(sender, instance, **kwargs):
+    adjust_content_count(instance.library_id, -1)
+
+
+@receiver(post_delete, sender=Content)
+def release_content_storage(sender, instance, **kwargs):
+    if instance.size:
+        StorageUsage.objects.filter(user=instance.creator_id).update(used=F('used') - instance.size)
+
+
+@receiver(post_delete, sender=Attachment)
+def release_attachment_storage(sender, instance, **kwargs):
+    # Deleted with their content, attachments go first, so the join still finds the creator.
+    if instance.size:
+        StorageUsage.objects.filter(user__content=instance.content_id).update(used=F('used') - instance.size)
+
+
+@receiver(post_save, sender=Content)
+def index_content(sender, instance, **kwargs):
+    search.index_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=Content)
+def unindex_content(sender, instance, **kwargs):
+    search.remove_contents([instance.pk])
+
+
+@receiver(post_save, sender=ContentFeature)
+@receiver(post_delete, sender=ContentFeature)
+def reindex_feature_content(sender, instance, **kwargs):
+    search.index_on_commit([instance.content_id])
+
+
+@receiver(post_save, sender=Library)
+def reindex_library_contents(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: search.index_contents(
+            Content.objects.filter(library=instance).values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=ContentType)
+def reindex_content_type_contents(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: search.index_contents(
+            Content.objects.filter(type=instance).values_list('pk', flat=True)))
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+
+from libcloud.models import StoredBlob, StoredFile
+
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+class DeduplicatingStorage(FileSystemStorage):
+    """
+    Content-addressed FileSystemStorage.
+
+    Every file is hashed with SHA-256 while it is written and kept once under
+    ``<blob root>/<d[0:2]>/<d[2:4]>/<digest>``. The names handed out by the
+    ``upload_to`` functions (``user_<username>/<filename>``) stay the public
+    names: a StoredFile row maps each of them to its StoredBlob, which counts
+    its references. Files saved before this storage was enabled have no
+    mapping row and are still read from their plain location.
+    """
+
+    @cached_property
+    def blob_root(self):
+        return getattr(settings, 'LIBCLOUD_BLOB_ROOT', None) or os.path.join(self.location, '.blobs')
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting in ('MEDIA_ROOT', 'LIBCLOUD_BLOB_ROOT'):
+            self.__dict__.pop('blob_root', None)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_root, digest[:2], digest[2:4], digest)
+
+    def path(self, name):
+        stored = StoredFile.objects.filter(name=name).values_list('blob_id', flat=True).first()
+        if stored is None:
+            return super().path(name)
+        return self.blob_path(stored)
+
+    def exists(self, name):
+        return StoredFile.objects.filter(name=name).exists() or super().exists(name)
+
+    def size(self, name):
+        size = StoredBlob.objects.filter(storedfile__name=name).values_list('size', flat=True).first()
+        return super().size(name) if size is None else size
+
+    def _spool(self, content):
+        """Write ``content`` to a temporary file next to the blobs, return its path and digest."""
+        os.makedirs(os.path.join(self.blob_root, 'tmp'), exist_ok=True)
+        digest = hashlib.sha256()
+        if hasattr(content, 'temporary_file_path'):
+            fd, path = tempfile.mkstemp(dir=os.path.join(self.blob_root, 'tmp'))
+            os.close(fd)
+            file_move_safe(content.temporary_file_path(), path, allow_overwrite=True)
+            if getattr(content, 'sha256', None):
+                # Hashed by StreamingUploadHandler while it was received.
+                return path, content.sha256
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+            return path, digest.hexdigest()
+        fd, path = tempfile.mkstemp(dir=os.path.join(self.blob_root, 'tmp'))
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                digest.update(chunk)
+                f.write(chunk)
+        return path, digest.hexdigest()
+
+    def _save(self, name, content):
+        temp_path, digest = self._spool(content)
+        try:
+            with transaction.atomic():
+                blob, created = StoredBlob.objects.select_for_update().get_or_create(
+                    digest=digest, defaults={'size': os.path.getsize(temp_path)})
+                blob_path = self.blob_path(digest)
+                if not os.path.exists(blob_path):
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(temp_path, blob_path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(blob_path, self.file_permissions_mode)
+                StoredBlob.objects.filter(pk=digest).update(references=F('references') + 1)
+                while True:
+                    try:
+                        with transaction.atomic():
+                            StoredFile.objects.create(name=name, blob=blob)
+                    except IntegrityError:
+                        name = self.get_available_name(name)
+                    else:
+                        break
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name
+
+    def delete(self, name):
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=name).first()
+            if stored is None:
+                return super().delete(name)
+            stored.delete()
+            StoredBlob.objects.filter(pk=stored.blob_id).update(references=F('references') - 1)
+            transaction.on_commit(lambda: self.collect_blob(stored.blob_id))
+
+    def collect_blob(self, digest):
+        """Remove the blob ``digest`` if nothing references it any more."""
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(pk=digest, references=0).first()
+            if blob is None:
+                return 0
+            blob.delete()
+            path = self.blob_path(digest)
+            if os.path.exists(path):
+                os.remove(path)
+        return blob.size
+
+    def collect_garbage(self):
+        """Sweep every unreferenced blob, returning the number of bytes freed."""
+        return sum(self.collect_blob(digest) for digest in
+                   StoredBlob.objects.filter(references=0).values_list('digest', flat=True).iterator())
@@ -0,0 +1,155 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class RangeReader:
+    """File-like view over ``length`` bytes of ``file`` starting at ``start``."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_chunk_size():
+    return getattr(settings, 'LIBCLOUD_DOWNLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def file_etag(stat):
+    return quote_etag("%x-%x" % (stat.st_mtime_ns, stat.st_size))
+
+
+def parse_range(header, size):
+    """
+    Parse a ``Range`` header into an inclusive ``(start, end)`` pair.
+
+    Returns None when the header should be ignored (malformed, another unit or
+    several ranges, which we answer with the whole file) and raises
+    RangeNotSatisfiable when no byte of the file is selected.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    match = RANGE_RE.match(ranges)
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = int(last) if last != '' else size - 1
+    if end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, min(end, size - 1)
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in [e[2:] if e.startswith('W/') else e for e in etags]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def range_applies(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def offload_response(path, content_type):
+    mode = getattr(settings, 'LIBCLOUD_DOWNLOAD_OFFLOAD', None)
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-sendfile':
+        response['X-Sendfile'] = path
+    elif mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'LIBCLOUD_DOWNLOAD_OFFLOAD_PREFIX', '/protected-media/')
+        relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+    else:
+        return None
+    return response
+
+
+def serve_file(request, path, filename, as_attachment=True):
+    """
+    Stream the file at ``path`` honouring Range/If-Range and conditional headers.
+
+    The file is never read into memory as a whole: bodies are sent with a
+    FileResponse in ``LIBCLOUD_DOWNLOAD_CHUNK_SIZE`` blocks, or handed over to
+    the front-end server when ``LIBCLOUD_DOWNLOAD_OFFLOAD`` is set.
+    """
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    last_modified = stat.st_mtime
+    mime_type, _ = mimetypes.guess_type(filename)
+    mime_type = mime_type or 'application/octet-stream'
+
+    if not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = offload_response(path, mime_type)
+    if response is None:
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and request.method == 'GET' and range_applies(request, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, stat.st_size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % stat.st_size
+                return response
+
+        f = open(path, 'rb')
+        if byte_range is None:
+            response = FileResponse(f, content_type=mime_type)
+        else:
+            start, end = byte_range
+            response = FileResponse(RangeReader(f, start, end - start + 1), content_type=mime_type, status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+        response.block_size = get_chunk_size()
+        response['Accept-Ranges'] = 'bytes'
+
+    if as_attachment and response.status_code != 304:
+        response['Content-Disposition'] = "attachment; filename=%s" % filename
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,218 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from libcloud.models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+# Idle workers requeue stale jobs and prune old ones at most this often (seconds).
+MAINTENANCE_INTERVAL = 60
+
+
+class Task:
+    def __init__(self, function, name, priority, max_attempts, retry_delay):
+        self.function = function
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def __call__(self, **payload):
+        return self.function(**payload)
+
+    def job(self, payload, priority=None):
+        return Job(name=self.name, payload=payload, max_attempts=self.max_attempts,
+                   priority=self.priority if priority is None else priority)
+
+    def enqueue(self, priority=None, **payload):
+        """Queue a run with ``payload`` once the current transaction commits."""
+        enqueue_jobs([self.job(payload, priority)])
+
+    def enqueue_many(self, payloads, priority=None):
+        enqueue_jobs([self.job(payload, priority) for payload in payloads])
+
+
+def task(name=None, priority=0, max_attempts=3, retry_delay=30):
+    """
+    Register a function as a background task.
+
+    The function is called with the keyword arguments given to ``enqueue``,
+    which must be JSON serializable. A failed run is retried after
+    ``retry_delay`` seconds, doubling each time, up to ``max_attempts`` runs.
+    Higher ``priority`` jobs are picked first.
+    """
+    def register(function):
+        registered = Task(function, name or "%s.%s" % (function.__module__, function.__name__),
+                          priority, max_attempts, retry_delay)
+        TASKS[registered.name] = registered
+        return registered
+    return register
+
+
+def enqueue_jobs(jobs):
+    # Jobs become visible only together with the rows they refer to; nothing
+    # is queued for a rolled back transaction. With LIBCLOUD_TASKS_EAGER the
+    # jobs run in-process right after the commit instead (development, tests).
+    if not jobs:
+        return
+    if getattr(settings, 'LIBCLOUD_TASKS_EAGER', False):
+        transaction.on_commit(lambda: [run_eagerly(job) for job in jobs])
+    else:
+        transaction.on_commit(partial(Job.objects.bulk_create, jobs))
+
+
+def run_eagerly(job):
+    job.attempts = 1
+    job.save()
+    run(job)
+
+
+def claim(worker):
+    """Lock the most urgent due job for ``worker`` and return it, or None."""
+    with transaction.atomic():
+        candidates = Job.objects.select_for_update(skip_locked=True) \
+            .filter(status=Job.Status.Pending, run_at__lte=timezone.now()) \
+            .order_by('-priority', 'run_at', 'id').values_list('pk', flat=True)[:5]
+        for pk in candidates:
+            # The conditional update also keeps two workers apart on databases
+            # without SELECT ... FOR UPDATE (SQLite). The attempt is counted
+            # here, so that a job killing its worker still uses attempts up.
+            if Job.objects.filter(pk=pk, status=Job.Status.Pending).update(
+                    status=Job.Status.Running, locked_by=worker, locked_at=timezone.now(),
+                    attempts=F('attempts') + 1):
+                return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job):
+    """Run a claimed job and record the outcome, unless another worker took the job over meanwhile."""
+    registered = TASKS.get(job.name)
+    try:
+        if registered is None:
+            raise LookupError("unknown task %s" % job.name)
+        registered(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if registered is not None and job.attempts < job.max_attempts:
+            job.status = Job.Status.Pending
+            job.run_at = timezone.now() + timedelta(seconds=registered.retry_delay * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.Status.Failed
+        logger.warning("job %s (%s) failed, attempt %d of %d", job.pk, job.name, job.attempts, job.max_attempts,
+                       exc_info=True)
+    else:
+        job.status = Job.Status.Done
+        job.last_error = ''
+    job.finished_at = timezone.now() if job.status != Job.Status.Pending else None
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status=job.status, run_at=job.run_at, last_error=job.last_error, finished_at=job.finished_at,
+        locked_by='', locked_at=None)
+    job.locked_by = ''
+    job.locked_at = None
+    return job
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refresh the lock of a running job every ``interval`` seconds, so that a
+    job running longer than LIBCLOUD_TASK_TIMEOUT is not taken for the job of
+    a dead worker and run a second time.
+    """
+
+    def __init__(self, job, interval):
+        super().__init__(daemon=True)
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                Job.objects.filter(pk=self.job.pk, locked_by=self.job.locked_by).update(locked_at=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def requeue_stale(timeout):
+    """
+    Give jobs of workers that died while running them back to the queue, or
+    fail them once they used up their attempts: a job that keeps killing its
+    worker (out of memory, a crashing converter) must not do so forever.
+    """
+    stale = Job.objects.filter(status=Job.Status.Running, locked_at__lt=timezone.now() - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.Failed, locked_by='', locked_at=None, finished_at=timezone.now(),
+        last_error="the worker died while running the job")
+    if failed:
+        logger.warning("%d jobs failed, their workers died on the last attempt", failed)
+    return stale.update(status=Job.Status.Pending, locked_by='', locked_at=None)
+
+
+def prune(retention=None, failed_retention=None):
+    """Delete finished jobs older than LIBCLOUD_TASK_RETENTION; failed ones are kept longer, for inspection."""
+    retention = retention or getattr(settings, 'LIBCLOUD_TASK_RETENTION', 7 * 24 * 60 * 60)
+    failed_retention = failed_retention or getattr(settings, 'LIBCLOUD_TASK_FAILED_RETENTION', 30 * 24 * 60 * 60)
+    now = timezone.now()
+    done = Job.objects.filter(status=Job.Status.Done, finished_at__lt=now - timedelta(seconds=retention)).delete()
+    failed = Job.objects.filter(status=Job.Status.Failed,
+                                finished_at__lt=now - timedelta(seconds=failed_retention)).delete()
+    return done[0] + failed[0]
+
+
+def maintain(stale_timeout):
+    requeue_stale(stale_timeout)
+    prune()
+
+
+def worker_name():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def work(burst=False, idle_sleep=1.0, max_jobs=None, stale_timeout=None):
+    """
+    Run jobs until stopped; with ``burst`` until no job is due any more.
+    Returns the number of jobs run.
+    """
+    stale_timeout = stale_timeout or getattr(settings, 'LIBCLOUD_TASK_TIMEOUT', 600)
+    worker = worker_name()
+    done = 0
+    maintain(stale_timeout)
+    maintained = time.monotonic()
+    while max_jobs is None or done < max_jobs:
+        if not connection.in_atomic_block:
+            # Inside a transaction (a test case) this would close its connection.
+            close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            if time.monotonic() - maintained > MAINTENANCE_INTERVAL:
+                maintain(stale_timeout)
+                maintained = time.monotonic()
+            time.sleep(idle_sleep)
+            continue
+        heartbeat = Heartbeat(job, stale_timeout / 3)
+        heartbeat.start()
+        try:
+            run(job)
+        finally:
+            heartbeat.stop()
+        done += 1
+    return done
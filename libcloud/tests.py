@@ -1,13 +1,53 @@
+import asyncio
+import hashlib
+import importlib
+import json
 import os
 import shutil
+import subprocess
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from io import BytesIO, StringIO
+from datetime import timedelta
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
 from django.contrib.auth.models import User
 from django.contrib.messages import get_messages
+from django.core.cache import cache, caches
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.files.base import ContentFile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.db import OperationalError, connection, transaction
+from django.db.utils import load_backend
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
 from libcloud.models import Content, ContentFeature, Attachment, ContentType, AttachmentType, ContentTypeFeature, \
-    Library
+    Job, Library, StorageUsage, StoredBlob, StoredFile, UploadSession
+from libcloud import bulk_import, derivatives, export, metrics, search, tasks, uploads
+from libcloud.asgi import ASGIHandler
+from libcloud.benchmarks import suite
+from libcloud.benchmarks.downloads import compare as compare_downloads
+from libcloud.benchmarks.indexes import set_indexes
+from libcloud.forms import ContentForm
+from libcloud.quota import StorageQuotaMiddleware
+from libcloud.garbage import GarbageCollector
+from libcloud.uploads import StreamingUploadHandler, UploadLimitMiddleware, UploadTooLarge
+from libcloud.sidebar import get_library_summary, sidebar_cache_key
+from libcloud.streaming import serve_file
+from libcloud.validation import BatchValidator
 
 test_media_root = os.path.join(settings.BASE_DIR, 'test_media/')
 
@@ -237,7 +277,42 @@ class DownloadFileTest(TestCase):
         self.assertEquals(
             response.get('Content-Disposition'),
             "attachment; filename=temp.txt")
-        self.assertEquals(response.content, b"Test File")
+        self.assertEquals(b"".join(response.streaming_content), b"Test File")
+        self.assertEqual(response.get('Accept-Ranges'), 'bytes')
+        self.assertEqual(response.get('Content-Length'), '9')
+
+    def test_download_file_range(self):
+        response = self.client.get(f"{self.content.file.url}", HTTP_RANGE='bytes=5-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.get('Content-Range'), 'bytes 5-8/9')
+        self.assertEqual(b"".join(response.streaming_content), b"File")
+
+        response = self.client.get(f"{self.content.file.url}", HTTP_RANGE='bytes=-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"File")
+
+    def test_download_file_range_not_satisfiable(self):
+        response = self.client.get(f"{self.content.file.url}", HTTP_RANGE='bytes=100-200')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.get('Content-Range'), 'bytes */9')
+
+    def test_download_file_if_range_mismatch_sends_whole_file(self):
+        response = self.client.get(f"{self.content.file.url}", HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"Test File")
+
+    def test_download_file_not_modified(self):
+        etag = self.client.get(f"{self.content.file.url}").get('ETag')
+        response = self.client.get(f"{self.content.file.url}", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get('ETag'), etag)
+
+    @override_settings(LIBCLOUD_DOWNLOAD_OFFLOAD='x-accel-redirect')
+    def test_download_file_offload(self):
+        response = self.client.get(f"{self.content.file.url}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('X-Accel-Redirect'), f"/protected-media/{self.content.file.name}")
+        self.assertEqual(response.content, b"")
 
     def test_download_file_doesnt_exists(self):
         username = 'user_a'
@@ -329,3 +404,1912 @@ class CreateContentTest(TestCase):
 
         self.assertEqual(response.context['form'].fields['library'].queryset.all().count(), 2)
         self.assertEqual(response.context['form'].fields['library'].queryset[0].name, self.library1.name)
+
+
+@override_settings(MEDIA_ROOT=test_media_root)
+class ChunkedUploadTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.feature_type = ContentTypeFeature.objects.create(content_type=self.content_type, name='pages',
+                                                              type=ContentTypeFeature.FeatureType.Number)
+        self.library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        self.data = b"Hello chunked world"
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def init(self, **kwargs):
+        body = {'filename': 'big.txt', 'size': len(self.data), 'content_type': self.content_type.id,
+                'library': self.library.id, 'sha256': hashlib.sha256(self.data).hexdigest()}
+        body.update(kwargs)
+        return self.client.post('/uploads/', json.dumps(body), content_type='application/json')
+
+    def put_chunk(self, url, start, end):
+        return self.client.put(url, self.data[start:end], content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.data)}")
+
+    def test_chunked_upload(self):
+        response = self.init()
+        self.assertEqual(response.status_code, 201)
+        session = response.json()
+        self.assertEqual(self.put_chunk(session['chunk_url'], 10, len(self.data)).status_code, 200)
+        self.assertEqual(self.put_chunk(session['chunk_url'], 0, 10).status_code, 200)
+        self.assertEqual(self.client.get(session['chunk_url']).json()['received'], [[0, len(self.data)]])
+
+        response = self.client.post(session['finalize_url'], json.dumps({'features': {'pages': '120'}}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        content = Content.objects.get()
+        self.assertEqual(content.file.name, 'user_username/big.txt')
+        self.assertEqual(content.library, self.library)
+        self.assertEqual(content.contentfeature_set.get().value, '120.0')
+        with content.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_finalize_incomplete_upload(self):
+        session = self.init().json()
+        self.put_chunk(session['chunk_url'], 0, 10)
+        response = self.client.post(session['finalize_url'], json.dumps({'features': {'pages': '1'}}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'upload is incomplete')
+        self.assertFalse(Content.objects.exists())
+
+    def test_finalize_checksum_mismatch(self):
+        session = self.init(sha256='0' * 64).json()
+        self.put_chunk(session['chunk_url'], 0, len(self.data))
+        response = self.client.post(session['finalize_url'], json.dumps({'features': {'pages': '1'}}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'checksum mismatch')
+
+    def test_missing_required_feature(self):
+        session = self.init().json()
+        self.put_chunk(session['chunk_url'], 0, len(self.data))
+        response = self.client.post(session['finalize_url'], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(UploadSession.objects.exists())
+
+    def test_attachment_upload(self):
+        attachment_type = AttachmentType.objects.create(user=self.user, name='a_type1')
+        self.content_type.attachment_types.add(attachment_type)
+        content = Content.objects.create(creator=self.user, type=self.content_type,
+                                         file=SimpleUploadedFile('temp.txt', b"Test File"))
+        session = self.init(kind='attachment', content=content.id, attachment_type=attachment_type.id).json()
+        self.put_chunk(session['chunk_url'], 0, len(self.data))
+        response = self.client.post(session['finalize_url'], content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(content.attachment_set.get().file.name, 'user_username/temp_big.txt')
+
+    async def test_chunks_are_copied_in_parallel(self):
+        session = await sync_to_async(lambda: self.init().json())()
+        await sync_to_async(self.async_client.force_login)(self.user)
+        # Each copy waits for the other: run one after the other, they would time out.
+        both = threading.Barrier(2, timeout=5)
+        copy_chunk = uploads.copy_chunk
+
+        def copy_with_the_other(*args):
+            both.wait()
+            return copy_chunk(*args)
+
+        with mock.patch('libcloud.uploads.copy_chunk', copy_with_the_other):
+            responses = await asyncio.gather(*[
+                self.async_client.put(session['chunk_url'], self.data[start:end],
+                                      **{'content-range': f"bytes {start}-{end - 1}/{len(self.data)}"})
+                for start, end in [(0, 10), (10, len(self.data))]])
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        received = await sync_to_async(lambda: self.client.get(session['chunk_url']).json()['received'])()
+        self.assertEqual(received, [[0, len(self.data)]])
+
+    def test_other_users_session_is_hidden(self):
+        session = self.init().json()
+        User.objects.create_user(username='username2', password='123')
+        self.client.login(username='username2', password='123')
+        self.assertEqual(self.client.get(session['chunk_url']).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=test_media_root, DEFAULT_FILE_STORAGE='libcloud.storage.DeduplicatingStorage')
+class DeduplicatingStorageTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def create_content(self, name='temp.txt', data=b"Test File"):
+        return Content.objects.create(creator=self.user, type=self.content_type,
+                                      file=SimpleUploadedFile(name, data))
+
+    def test_identical_files_are_stored_once(self):
+        content1 = self.create_content()
+        content2 = self.create_content()
+        self.assertNotEqual(content1.file.name, content2.file.name)
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.digest, hashlib.sha256(b"Test File").hexdigest())
+        self.assertEqual(blob.references, 2)
+        self.assertEqual(content1.file.path, content2.file.path)
+        with content2.file.open('rb') as f:
+            self.assertEqual(f.read(), b"Test File")
+        self.assertFalse(os.path.exists(os.path.join(test_media_root, content1.file.name)))
+
+    def test_download_deduplicated_file(self):
+        content = self.create_content()
+        response = self.client.get(content.file.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('Content-Type'), 'text/plain')
+        self.assertEqual(b"".join(response.streaming_content), b"Test File")
+
+    def test_blob_is_collected_with_last_reference(self):
+        content1 = self.create_content()
+        content2 = self.create_content(name='other.txt')
+        path = content1.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            content1.delete()
+        self.assertEqual(StoredBlob.objects.get().references, 1)
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            content2.delete()
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+@override_settings(MEDIA_ROOT=test_media_root,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class QueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.attachment_type = AttachmentType.objects.create(user=self.user, name='a_type1')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.content_type.attachment_types.add(self.attachment_type)
+        self.library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def add_contents(self, count):
+        contents = []
+        for i in range(count):
+            content = Content.objects.create(creator=self.user, type=self.content_type, library=self.library,
+                                             file=SimpleUploadedFile('temp.txt', b"Test File"))
+            self.add_details(content, 1)
+            contents.append(content)
+        return contents
+
+    def add_details(self, content, count):
+        for i in range(count):
+            feature_type = ContentTypeFeature.objects.create(content_type=self.content_type, name=f'f{i}',
+                                                             type=ContentTypeFeature.FeatureType.String)
+            ContentFeature.objects.create(content=content, feature_type=feature_type, value='value')
+            Attachment.objects.create(content=content, type=self.attachment_type,
+                                      file=SimpleUploadedFile('attachment.txt', b"Attachment"))
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assertConstantQueries(self, url):
+        self.add_contents(1)
+        small = self.count_queries(url)
+        self.add_contents(10)
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_home_page(self):
+        self.assertConstantQueries('/')
+
+    def test_my_content(self):
+        self.assertConstantQueries('/my_content/')
+
+    def test_library_detail(self):
+        self.assertConstantQueries(self.library.get_absolute_url())
+
+    def test_all_libraries(self):
+        self.assertConstantQueries('/libraries/')
+
+    def test_content_detail(self):
+        content = self.add_contents(1)[0]
+        small = self.count_queries(content.get_absolute_url())
+        self.add_details(content, 10)
+        self.assertEqual(self.count_queries(content.get_absolute_url()), small)
+
+    def test_content_type_detail(self):
+        url = self.content_type.get_absolute_url()
+        small = self.count_queries(url)
+        self.add_contents(10)
+        self.assertEqual(self.count_queries(url), small)
+
+
+@override_settings(MEDIA_ROOT=test_media_root)
+class SidebarCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def test_anonymous_pages_do_not_query(self):
+        with self.assertNumQueries(0):
+            self.client.get('/login/')
+
+    def test_summary_is_cached(self):
+        self.assertEqual([lib.content_count for lib in get_library_summary(self.user)], [0])
+        with self.assertNumQueries(0):
+            get_library_summary(self.user)
+
+    def test_summary_is_invalidated(self):
+        get_library_summary(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Content.objects.create(creator=self.user, type=self.content_type, library=self.library,
+                                   file=SimpleUploadedFile('temp.txt', b"Test File"))
+            # Not before the commit, or the old rows could be cached again.
+            self.assertIsNotNone(cache.get(sidebar_cache_key(self.user.id)))
+        self.assertIsNone(cache.get(sidebar_cache_key(self.user.id)))
+        self.assertEqual([lib.content_count for lib in get_library_summary(self.user)], [1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Library.objects.create(user=self.user, name='lib2', content_type=self.content_type)
+        self.assertEqual([lib.name for lib in get_library_summary(self.user)], ['lib1', 'lib2'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.library.delete()
+        self.assertEqual([lib.name for lib in get_library_summary(self.user)], ['lib2'])
+
+
+@override_settings(MEDIA_ROOT=test_media_root)
+class LibraryContentCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.library1 = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        self.library2 = Library.objects.create(user=self.user, name='lib2', content_type=self.content_type)
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def counts(self):
+        return list(Library.objects.order_by('id').values_list('content_count', flat=True))
+
+    def test_counter_follows_contents(self):
+        content = Content.objects.create(creator=self.user, type=self.content_type, library=self.library1,
+                                         file=SimpleUploadedFile('temp.txt', b"Test File"))
+        Content.objects.create(creator=self.user, type=self.content_type,
+                               file=SimpleUploadedFile('temp.txt', b"Test File"))
+        self.assertEqual(self.counts(), [1, 0])
+
+        response = self.client.post(f'/content/change_library/{content.id}', {'library': self.library2.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), [0, 1])
+
+        content = Content.objects.get(pk=content.pk)
+        content.library = None
+        content.save()
+        self.assertEqual(self.counts(), [0, 0])
+
+        content.library = self.library1
+        content.save()
+        Content.objects.get(pk=content.pk).delete()
+        self.assertEqual(self.counts(), [0, 0])
+
+    def test_rebuild_command(self):
+        Content.objects.create(creator=self.user, type=self.content_type, library=self.library1,
+                               file=SimpleUploadedFile('temp.txt', b"Test File"))
+        Library.objects.update(content_count=5)
+        with self.assertRaises(CommandError):
+            call_command('content_counts', '--check', stdout=StringIO())
+        call_command('content_counts', stdout=StringIO())
+        self.assertEqual(self.counts(), [1, 0])
+        call_command('content_counts', '--check', stdout=StringIO())
+
+
+class IndexBenchmarkTest(TransactionTestCase):
+    def test_benchmark_indexes(self):
+        out = StringIO()
+        call_command('benchmark_indexes', '--contents', '50', '--libraries', '3', '--repeat', '1', '--yes',
+                     stdout=out)
+        self.assertIn('recent contents (home page)', out.getvalue())
+        self.assertEqual(Content.objects.count(), 50)
+        self.assertEqual(ContentFeature.objects.count(), 150)
+        self.assertEqual(sum(Library.objects.values_list('content_count', flat=True)), 50)
+        indexes = connection.introspection.get_constraints(connection.cursor(), Content._meta.db_table)
+        self.assertIn('content_creator_id_idx', indexes)
+
+    def test_requires_confirmation(self):
+        with self.assertRaisesMessage(CommandError, "pass --yes"):
+            call_command('benchmark_indexes', stdout=StringIO())
+        self.assertFalse(Content.objects.exists())
+
+    def test_restore_indexes(self):
+        # As left by a run killed while measuring without the indexes.
+        set_indexes(False)
+        call_command('benchmark_indexes', '--restore-indexes', stdout=StringIO())
+        indexes = connection.introspection.get_constraints(connection.cursor(), Content._meta.db_table)
+        self.assertIn('content_creator_id_idx', indexes)
+
+
+@override_settings(MEDIA_ROOT=test_media_root, LIBCLOUD_SERVER_TIMING=True,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BenchmarkSuiteTest(TestCase):
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def benchmark(self, *args):
+        out = StringIO()
+        call_command('benchmark', '--contents', '20', '--libraries', '2', '--attachments', '1', '--repeat', '2',
+                     '--size', '64K', '--yes', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_benchmark(self):
+        output = os.path.join(test_media_root, 'results.json')
+        os.makedirs(test_media_root)
+        self.benchmark('--output', output)
+        with open(output) as f:
+            report = json.load(f)
+        results = {result['scenario']: result for result in report['results']}
+        self.assertEqual(list(results), ['home_page', 'library_detail', 'content_detail', 'create_content',
+                                         'upload_64K', 'download_64K'])
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+            self.assertIsNotNone(result['queries'])
+        self.assertEqual(results['download_64K']['bytes'], 64 * 1024)
+        self.assertEqual(report['scale']['contents'], 20)
+        # The seeded rows stay for the next run, what the scenarios created does not.
+        self.assertEqual(Content.objects.count(), 20)
+        self.assertEqual(Attachment.objects.count(), 20)
+        self.assertEqual(ContentFeature.objects.count(), 60)
+
+    def test_thresholds_fail_the_run(self):
+        thresholds = os.path.join(test_media_root, 'thresholds.json')
+        os.makedirs(test_media_root)
+        with open(thresholds, 'w') as f:
+            json.dump({'content_detail': {'queries': 0}}, f)
+        with self.assertRaisesMessage(CommandError, "1 benchmark checks failed"):
+            self.benchmark('--thresholds', thresholds, '--scenario', 'content_detail')
+
+    def test_requires_confirmation(self):
+        with self.assertRaisesMessage(CommandError, "pass --yes"):
+            call_command('benchmark', stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+    def test_check_against_baseline(self):
+        def report(p95_ms, queries, speed):
+            return {'results': [
+                {'target': 'client', 'scenario': 'content_detail', 'iterations': 20, 'errors': 0,
+                 'p50_ms': 5, 'p95_ms': p95_ms, 'queries': queries},
+                {'target': 'client', 'scenario': 'download_1G', 'iterations': 1, 'errors': 0,
+                 'p50_ms': 1000, 'p95_ms': 1000, 'queries': 0, 'megabytes_per_second': speed},
+            ]}
+
+        baseline = report(10, 4, 1000)
+        self.assertEqual(suite.check(report(12, 4, 800), baseline=baseline), [])
+        self.assertEqual(suite.check(report(14, 5, 700), baseline=baseline), [
+            "client/content_detail: p95_ms 14 > 12.5 (baseline 10)",
+            "client/content_detail: queries 5 > 4 (baseline 4)",
+            "client/download_1G: megabytes_per_second 700 < 750.0 (baseline 1000)",
+        ])
+        thresholds = {'client/download_1G': {'megabytes_per_second': 900}}
+        self.assertEqual(suite.check(report(12, 4, 800), thresholds=thresholds),
+                         ["client/download_1G: megabytes_per_second 800 < 900"])
+
+
+@override_settings(MEDIA_ROOT=test_media_root,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class FeatureFilterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='book')
+        self.pages = ContentTypeFeature.objects.create(content_type=self.content_type, name='pages',
+                                                       type=ContentTypeFeature.FeatureType.Number)
+        self.author = ContentTypeFeature.objects.create(content_type=self.content_type, name='author',
+                                                        type=ContentTypeFeature.FeatureType.String)
+        self.read = ContentTypeFeature.objects.create(content_type=self.content_type, name='read',
+                                                      type=ContentTypeFeature.FeatureType.Boolean)
+        self.library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        self.books = [self.create_book(*values) for values in
+                      [(50, 'Knuth', '1'), (120, 'Knuth', '2'), (700, 'Knuth', '1'), (300, 'Wirth', '1')]]
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def create_book(self, pages, author, read):
+        content = Content.objects.create(creator=self.user, type=self.content_type, library=self.library,
+                                         file=SimpleUploadedFile('book.txt', b"Test File"))
+        for feature_type, value in [(self.pages, pages), (self.author, author), (self.read, read)]:
+            ContentFeature.objects.create(content=content, feature_type=feature_type, value=value)
+        return content
+
+    def test_typed_values_are_stored(self):
+        features = self.books[0].contentfeature_set
+        self.assertEqual(features.get(feature_type=self.pages).number_value, 50.0)
+        self.assertIs(features.get(feature_type=self.read).boolean_value, True)
+        self.assertIsNone(features.get(feature_type=self.author).number_value)
+
+    def test_invalid_number_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            ContentFeature.objects.create(content=self.books[0], feature_type=self.pages, value='many')
+
+    def test_library_filter(self):
+        response = self.client.get(self.library.get_absolute_url(), {'pages__gte': '100', 'author': 'Knuth'})
+        self.assertEqual(list(response.context['contents']), self.books[1:3])
+
+    def test_my_content_filter(self):
+        response = self.client.get('/my_content/', {'pages__lt': '500', 'read': 'true'})
+        self.assertEqual(list(response.context['object_list']), [self.books[3], self.books[0]])
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.library.get_absolute_url(), {'author__gte': 'K'})
+        self.assertEqual(len(response.context['contents']), 4)
+        messages = [m.message for m in get_messages(response.wsgi_request)]
+        self.assertIn("gte can not be used with string features", messages)
+
+
+@override_settings(MEDIA_ROOT=test_media_root,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class SearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='book')
+        self.author = ContentTypeFeature.objects.create(content_type=self.content_type, name='author',
+                                                        type=ContentTypeFeature.FeatureType.String)
+        self.library = Library.objects.create(user=self.user, name='classics', content_type=self.content_type)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.art = self.create_content('art_of_programming.pdf', 'Donald Knuth')
+            self.pascal = self.create_content('pascal_manual.pdf', 'Niklaus Wirth')
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def create_content(self, filename, author):
+        content = Content.objects.create(creator=self.user, type=self.content_type,
+                                         file=SimpleUploadedFile(filename, b"Test File"))
+        ContentFeature.objects.create(content=content, feature_type=self.author, value=author)
+        return content
+
+    def search(self, query):
+        response = self.client.get('/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['page_obj'])
+
+    def test_search_filename_and_features(self):
+        self.assertEqual(self.search('programming'), [self.art])
+        self.assertEqual(self.search('knu'), [self.art])
+        self.assertCountEqual(self.search('pdf'), [self.art, self.pascal])
+        self.assertEqual(self.search('knuth pascal'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_index_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pascal.library = self.library
+            self.pascal.save()
+        self.assertEqual(self.search('classics'), [self.pascal])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.library.name = 'modern'
+            self.library.save()
+        self.assertEqual(self.search('classics'), [])
+        self.assertEqual(self.search('modern'), [self.pascal])
+
+        self.pascal.delete()
+        self.assertEqual(self.search('pdf'), [self.art])
+
+    def test_content_saved_with_features_is_indexed_once(self):
+        year = ContentTypeFeature.objects.create(content_type=self.content_type, name='year',
+                                                 type=ContentTypeFeature.FeatureType.Number)
+        with mock.patch('libcloud.search.index_contents', wraps=search.index_contents) as index_contents, \
+                self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            sicp = self.create_content('sicp.pdf', 'Harold Abelson')
+            ContentFeature.objects.create(content=sicp, feature_type=year, value='1985')
+        index_contents.assert_called_once_with({sicp.pk})
+        self.assertEqual(self.search('abelson'), [sicp])
+
+    def test_search_is_per_user(self):
+        User.objects.create_user(username='username2', password='123')
+        self.client.login(username='username2', password='123')
+        self.assertEqual(self.search('knuth'), [])
+
+
+@override_settings(MEDIA_ROOT=test_media_root, LIBCLOUD_PAGE_SIZE=2,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        self.contents = [Content.objects.create(creator=self.user, type=self.content_type, library=self.library,
+                                                file=SimpleUploadedFile('temp.txt', b"Test File"))
+                         for i in range(5)]
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def walk(self, url):
+        pages = []
+        response = self.client.get(url)
+        while True:
+            page = response.context['page_obj']
+            pages.append([content.id for content in page])
+            if not page.next_url:
+                return pages, page
+            response = self.client.get(url + page.next_url)
+
+    def test_my_content_pages_newest_first(self):
+        ids = [content.id for content in reversed(self.contents)]
+        pages, last = self.walk('/my_content/')
+        self.assertEqual(pages, [ids[0:2], ids[2:4], ids[4:]])
+        response = self.client.get('/my_content/' + last.previous_url)
+        self.assertEqual([content.id for content in response.context['page_obj']], ids[2:4])
+
+    def test_library_pages(self):
+        ids = [content.id for content in self.contents]
+        pages, last = self.walk(self.library.get_absolute_url())
+        self.assertEqual(pages, [ids[0:2], ids[2:4], ids[4:]])
+
+        response = self.client.get(self.library.get_absolute_url() + last.previous_url)
+        page = response.context['page_obj']
+        self.assertEqual([content.id for content in page], ids[2:4])
+        response = self.client.get(self.library.get_absolute_url() + page.previous_url)
+        self.assertEqual([content.id for content in response.context['page_obj']], ids[0:2])
+        self.assertIsNone(response.context['page_obj'].previous_url)
+
+    def test_cursor_is_stable_and_checked(self):
+        first = self.client.get('/my_content/').context['page_obj'].next_url
+        self.assertEqual(self.client.get('/my_content/').context['page_obj'].next_url, first)
+        response = self.client.get('/my_content/', {'cursor': 'forged'})
+        self.assertEqual(len(response.context['page_obj']), 2)
+
+    def test_page_size_parameter(self):
+        response = self.client.get('/my_content/', {'page_size': '4'})
+        self.assertEqual(len(response.context['page_obj']), 4)
+
+
+@override_settings(MEDIA_ROOT=test_media_root,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BulkImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.attachment_type = AttachmentType.objects.create(user=self.user, name='cover')
+        self.content_type = ContentType.objects.create(user=self.user, name='book')
+        self.content_type.attachment_types.add(self.attachment_type)
+        self.pages = ContentTypeFeature.objects.create(content_type=self.content_type, name='pages',
+                                                       type=ContentTypeFeature.FeatureType.Number)
+        self.author = ContentTypeFeature.objects.create(content_type=self.content_type, name='author',
+                                                        type=ContentTypeFeature.FeatureType.String, required=False)
+        self.library = Library.objects.create(user=self.user, name='classics', content_type=self.content_type)
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def archive(self, rows, files):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('manifest.jsonl', "\n".join(json.dumps(row) for row in rows))
+            for name, data in files.items():
+                archive.writestr(name, data)
+        return SimpleUploadedFile('import.zip', buffer.getvalue())
+
+    def test_import_archive(self):
+        rows = [
+            {'file': 'books/knuth.pdf', 'content_type': 'book', 'library': 'classics',
+             'features': {'pages': '672', 'author': 'Knuth'},
+             'attachments': [{'type': 'cover', 'file': 'covers/knuth.png'}]},
+            {'file': 'books/wirth.pdf', 'content_type': 'book', 'features': {'pages': '200'}},
+            {'file': 'books/missing.pdf', 'content_type': 'book', 'features': {'pages': '1'}},
+            {'file': 'books/knuth.pdf', 'content_type': 'book', 'features': {'pages': 'many'}},
+        ]
+        files = {'books/knuth.pdf': b"TAOCP", 'books/wirth.pdf': b"Pascal", 'covers/knuth.png': b"PNG"}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/content/import/', {'archive': self.archive(rows, files)}, follow=True)
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertIn("2 contents have been imported, 2 rows were rejected.", messages)
+        self.assertIn("line 3: file books/missing.pdf not found in the source", messages)
+
+        knuth = Content.objects.get(library=self.library)
+        self.assertEqual(knuth.file.read(), b"TAOCP")
+        self.assertEqual(knuth.contentfeature_set.get(feature_type=self.pages).number_value, 672)
+        self.assertEqual(knuth.attachment_set.get().file.read(), b"PNG")
+        self.assertEqual(Library.objects.get(pk=self.library.pk).content_count, 1)
+        self.assertEqual(Content.objects.filter(library=None).count(), 1)
+        self.assertEqual(list(self.client.get('/search/', {'q': 'knuth'}).context['page_obj']), [knuth])
+
+    def test_command_with_csv_manifest(self):
+        source = os.path.join(test_media_root, 'source')
+        os.makedirs(source)
+        with open(os.path.join(source, 'a.pdf'), 'wb') as f:
+            f.write(b"A")
+        with open(os.path.join(source, 'manifest.csv'), 'w') as f:
+            f.write("file,content_type,library,feature:pages,feature:author,attachments\n"
+                    "a.pdf,book,classics,12,Someone,cover=a.pdf\n")
+        call_command('import_contents', 'username', source, stdout=StringIO())
+        content = Content.objects.get()
+        self.assertEqual(content.library, self.library)
+        self.assertEqual(content.contentfeature_set.count(), 2)
+        self.assertEqual(content.attachment_set.get().type, self.attachment_type)
+
+    def test_malformed_jsonl_lines_are_reported(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('manifest.jsonl',
+                             b'{"file": "a.pdf", "content_type": "book", "features": {"pages": "1"}}\n'
+                             b'{"file": "a.pdf", "content_type"\n'
+                             # Latin-1, not UTF-8.
+                             b'{"file": "a.pdf", "content_type": "book", "features": {"author": "G\xf6del"}}\n')
+            archive.writestr('a.pdf', b"A")
+        archive = SimpleUploadedFile('import.zip', buffer.getvalue())
+        response = self.client.post('/content/import/', {'archive': archive}, follow=True)
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertIn("1 contents have been imported, 2 rows were rejected.", messages)
+        self.assertTrue(any(message.startswith("line 2: invalid JSON") for message in messages))
+        self.assertIn("line 3: the line is not UTF-8 encoded", messages)
+
+    def test_latin1_csv_manifest(self):
+        source = os.path.join(test_media_root, 'source')
+        os.makedirs(source)
+        with open(os.path.join(source, 'a.pdf'), 'wb') as f:
+            f.write(b"A")
+        with open(os.path.join(source, 'manifest.csv'), 'w', encoding='latin-1') as f:
+            f.write("file,content_type,feature:pages,feature:author\na.pdf,book,12,G\xf6del\n")
+        with self.assertRaisesMessage(CommandError, "the manifest is not UTF-8 encoded"):
+            call_command('import_contents', 'username', source, stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(Content.objects.exists())
+
+    def test_strict_import_writes_nothing(self):
+        rows = [{'file': 'a.pdf', 'content_type': 'book', 'features': {'pages': '1'}},
+                {'file': 'a.pdf', 'content_type': 'book', 'features': {}}]
+        response = self.client.post('/content/import/', {'archive': self.archive(rows, {'a.pdf': b"A"}),
+                                                          'strict': 'on'}, follow=True)
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertIn("line 2: feature pages is required", messages)
+        self.assertFalse(Content.objects.exists())
+
+    def test_batches_use_constant_queries(self):
+        rows = [{'file': 'a.pdf', 'content_type': 'book', 'library': 'classics', 'features': {'pages': str(i)}}
+                for i in range(30)]
+        source = BytesIO(self.archive(rows, {'a.pdf': b"A"}).read())
+        with CaptureQueriesContext(connection) as queries:
+            report = bulk_import.import_contents(self.user, source, batch_size=10)
+        self.assertEqual(report.created, 30)
+        self.assertLess(len(queries), 60)
+        self.assertEqual(Library.objects.get(pk=self.library.pk).content_count, 30)
+
+
+@override_settings(MEDIA_ROOT=test_media_root)
+class BatchValidatorTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.cover = AttachmentType.objects.create(user=self.user, name='cover')
+        self.index = AttachmentType.objects.create(user=self.user, name='index')
+        self.book = ContentType.objects.create(user=self.user, name='book')
+        self.book.attachment_types.add(self.cover)
+        self.movie = ContentType.objects.create(user=self.user, name='movie')
+        self.pages = ContentTypeFeature.objects.create(content_type=self.book, name='pages',
+                                                       type=ContentTypeFeature.FeatureType.Number)
+        self.length = ContentTypeFeature.objects.create(content_type=self.movie, name='length',
+                                                        type=ContentTypeFeature.FeatureType.Number)
+        self.books = Library.objects.create(user=self.user, name='books', content_type=self.book)
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def content(self, type, library=None):
+        return Content(creator=self.user, type=type, library=library, file='user_username/file.pdf')
+
+    def test_batch_errors(self):
+        valid = self.content(self.book, self.books)
+        wrong_library = self.content(self.movie, self.books)
+        missing_feature = self.content(self.book)
+        features = [
+            ContentFeature(content=valid, feature_type=self.pages, value='100'),
+            ContentFeature(content=wrong_library, feature_type=self.length, value='90'),
+            ContentFeature(content=missing_feature, feature_type=self.length, value='90'),
+        ]
+        not_a_number = ContentFeature(content=valid, feature_type=self.pages, value='many')
+        attachments = [Attachment(content=valid, type=self.cover, file='a.png'),
+                       Attachment(content=valid, type=self.index, file='b.png')]
+        validator = BatchValidator([valid, wrong_library, missing_feature], features + [not_a_number], attachments)
+        with self.assertNumQueries(6):
+            self.assertFalse(validator.is_valid())
+        self.assertEqual(validator.messages(valid), [])
+        self.assertEqual(validator.messages(wrong_library), ["chosen library has a different content type"])
+        self.assertEqual(validator.messages(missing_feature), ["feature pages is required"])
+        self.assertEqual(validator.messages(features[2]), ["feature length belongs to another content type"])
+        self.assertEqual(validator.messages(not_a_number), ["feature pages: many is not a number"])
+        self.assertEqual(validator.messages(attachments[0]), [])
+        self.assertEqual(validator.messages(attachments[1]),
+                         ["attachment type is not allowed for this content type"])
+        self.assertEqual(features[0].number_value, 100)
+
+    def test_saved_contents(self):
+        content = Content.objects.create(creator=self.user, type=self.movie,
+                                         file=SimpleUploadedFile('temp.txt', b"Test File"))
+        validator = BatchValidator(features=[ContentFeature(content=content, feature_type=self.length, value='1')],
+                                   attachments=[Attachment(content=content, type=self.cover, file='a.png')])
+        self.assertFalse(validator.is_valid())
+        self.assertEqual(len(validator.errors), 1)
+
+
+@override_settings(MEDIA_ROOT=test_media_root)
+class AsgiDownloadTest(SimpleTestCase):
+    def setUp(self):
+        os.makedirs(os.path.join(test_media_root, 'user_username'))
+        self.data = os.urandom(200 * 1024)
+        with open(os.path.join(test_media_root, 'user_username', 'big.bin'), 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    async def get(self, path, headers=()):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                 'headers': [(b'host', b'localhost')] + list(headers), 'client': ('127.0.0.1', 0),
+                 'server': ('localhost', 80)}
+        await ASGIHandler()(scope, receive, send)
+        return messages[0], b"".join(message.get('body', b'') for message in messages[1:])
+
+    async def test_streams_file(self):
+        start, body = await self.get('/media/user_username/big.bin')
+        self.assertEqual(start['status'], 200)
+        self.assertEqual(body, self.data)
+
+        start, body = await self.get('/media/user_username/big.bin', [(b'range', b'bytes=100-199')])
+        self.assertEqual(start['status'], 206)
+        self.assertEqual(body, self.data[100:200])
+
+    def test_middleware_chain_is_not_adapted(self):
+        # One sync-only middleware makes Django run everything below it, views
+        # included, through sync_to_async on a single thread.
+        with override_settings(DEBUG=True), mock.patch('django.core.handlers.base.logger') as logger:
+            ASGIHandler().load_middleware(is_async=True)
+        adapted = [call.args[1] for call in logger.debug.call_args_list if call.args[0].endswith(' adapted.')]
+        self.assertEqual(adapted, [])
+
+    def test_production_middleware_is_async_capable(self):
+        with mock.patch.dict(os.environ, {'SECRET_KEY': 'test'}):
+            production = importlib.import_module('ASD.settings_production')
+        self.assertNotIn('whitenoise.middleware.WhiteNoiseMiddleware', production.MIDDLEWARE)
+        self.assertEqual([path for path in production.MIDDLEWARE
+                          if not getattr(import_string(path), 'async_capable', False)], [])
+
+    def test_production_cache_is_shared_through_redis(self):
+        with mock.patch.dict(os.environ, {'SECRET_KEY': 'test', 'REDIS_URL': 'redis://cache:6379/0'}):
+            production = importlib.reload(importlib.import_module('ASD.settings_production'))
+        self.assertEqual(production.CACHES['default'], {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                                        'LOCATION': 'redis://cache:6379/0'})
+
+    @override_settings(WHITENOISE_AUTOREFRESH=True, WHITENOISE_USE_FINDERS=True)
+    async def test_static_files(self):
+        start, body = await self.get('/static/images/file.png')
+        self.assertEqual(start['status'], 200)
+        with open(os.path.join(settings.BASE_DIR, 'libcloud', 'static', 'images', 'file.png'), 'rb') as f:
+            self.assertEqual(body, f.read())
+
+    def test_benchmark_holds_more_slow_clients(self):
+        asgi, wsgi = compare_downloads(clients=4, size=128 * 1024, delay=0.001, workers=1)
+        self.assertEqual(asgi['completed'], 4)
+        self.assertEqual(wsgi['completed'], 4)
+        self.assertEqual(wsgi['peak_concurrent_downloads'], 1)
+        self.assertGreater(asgi['peak_concurrent_downloads'], 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', "connection pooling is PostgreSQL only")
+class ConnectionPoolTest(TransactionTestCase):
+    def tearDown(self):
+        # Idle pooled sessions would keep the test database from being dropped.
+        load_backend('libcloud.db.postgresql_pool').close_idle_connections()
+        super().tearDown()
+
+    def wrapper(self, **pool):
+        settings_dict = dict(connection.settings_dict, ENGINE='libcloud.db.postgresql_pool', POOL=pool)
+        return load_backend('libcloud.db.postgresql_pool').DatabaseWrapper(settings_dict, 'pool_test')
+
+    def backend_pid(self, db):
+        with db.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_connection_is_reused(self):
+        db = self.wrapper(MAX_SIZE=1)
+        first = self.backend_pid(db)
+        db.close()
+        self.assertEqual(self.backend_pid(db), first)
+        db.close()
+
+    def test_broken_connection_is_replaced(self):
+        db = self.wrapper(MAX_SIZE=1)
+        first = self.backend_pid(db)
+        db.close()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [first])
+        self.assertNotEqual(self.backend_pid(db), first)
+        db.close()
+
+    def test_transaction_state_is_reset(self):
+        db = self.wrapper(MAX_SIZE=1)
+        first = self.backend_pid(db)
+        db.set_autocommit(False)
+        with db.cursor() as cursor:
+            cursor.execute('CREATE TABLE pool_test (id integer)')
+        # Returned in the middle of a transaction, as after a request that failed.
+        db.close()
+        self.assertEqual(self.backend_pid(db), first)
+        self.assertTrue(db.get_autocommit())
+        with db.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('pool_test')")
+            self.assertIsNone(cursor.fetchone()[0])
+        db.close()
+
+    def test_connection_closed_in_atomic_block_is_discarded(self):
+        db = self.wrapper(MAX_SIZE=1)
+        first = self.backend_pid(db)
+        closed = db.connection
+        db.set_autocommit(False)
+        db.in_atomic_block = True
+        db.close()
+        self.assertTrue(closed.closed)
+        # What leaving the atomic block does once its connection was closed.
+        db.in_atomic_block = False
+        db.connection = None
+        self.assertNotEqual(self.backend_pid(db), first)
+        db.close()
+
+    def test_exhausted_pool_times_out(self):
+        db, other = self.wrapper(MAX_SIZE=1, TIMEOUT=0.1), self.wrapper(MAX_SIZE=1, TIMEOUT=0.1)
+        db.ensure_connection()
+        with self.assertRaises(OperationalError):
+            other.ensure_connection()
+        db.close()
+        other.ensure_connection()
+        other.close()
+
+
+@override_settings(MEDIA_ROOT=test_media_root)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.calls = []
+
+    def tearDown(self):
+        tasks.TASKS.pop('test.flaky', None)
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def test_upload_is_hashed_by_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            content = Content.objects.create(creator=self.user, type=self.content_type,
+                                             file=SimpleUploadedFile('temp.txt', b"Test File"))
+            self.assertFalse(Job.objects.exists())
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.payload), ('libcloud.checksum', {'model': 'content', 'pk': content.pk}))
+        self.assertEqual(Content.objects.get(pk=content.pk).checksum, '')
+
+        self.assertEqual(tasks.work(burst=True), 1)
+        self.assertEqual(Content.objects.get(pk=content.pk).checksum, hashlib.sha256(b"Test File").hexdigest())
+        self.assertEqual(Job.objects.get().status, Job.Status.Done)
+
+    def test_rolled_back_upload_queues_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    Content.objects.create(creator=self.user, type=self.content_type,
+                                           file=SimpleUploadedFile('temp.txt', b"Test File"))
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Job.objects.exists())
+
+    def test_retries_and_priorities(self):
+        @tasks.task(name='test.flaky', max_attempts=2, retry_delay=0)
+        def flaky(n):
+            self.calls.append(n)
+            raise RuntimeError("boom")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            flaky.enqueue(n=1)
+            flaky.enqueue(n=2, priority=5)
+        with self.assertLogs('libcloud.tasks', 'WARNING'):
+            self.assertEqual(tasks.work(burst=True), 4)
+        self.assertEqual(self.calls, [2, 2, 1, 1])
+        for job in Job.objects.all():
+            self.assertEqual((job.status, job.attempts), (Job.Status.Failed, 2))
+            self.assertIn("RuntimeError: boom", job.last_error)
+
+    def test_stale_jobs_are_requeued(self):
+        Job.objects.create(name='libcloud.checksum', payload={'model': 'content', 'pk': 0},
+                           status=Job.Status.Running, locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(tasks.work(burst=True, stale_timeout=60), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.Status.Done, 1))
+
+    def test_attempt_is_counted_when_claimed(self):
+        job = Job.objects.create(name='libcloud.checksum', payload={'model': 'content', 'pk': 0})
+        tasks.claim('worker')
+        self.assertEqual(Job.objects.get(pk=job.pk).attempts, 1)
+
+    def test_job_killing_its_worker_fails(self):
+        Job.objects.create(name='libcloud.checksum', payload={'model': 'content', 'pk': 0}, attempts=3,
+                           status=Job.Status.Running, locked_at=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('libcloud.tasks', 'WARNING'):
+            self.assertEqual(tasks.work(burst=True, stale_timeout=60), 0)
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.Status.Failed)
+        self.assertEqual(job.last_error, "the worker died while running the job")
+
+    def test_heartbeat_keeps_long_jobs_locked(self):
+        job = Job.objects.create(name='libcloud.checksum', status=Job.Status.Running, locked_by='worker',
+                                 locked_at=timezone.now() - timedelta(hours=1))
+        heartbeat = tasks.Heartbeat(job, 200)
+        # One beat, run in this thread (and its connection left open).
+        heartbeat.stopped.wait = mock.Mock(side_effect=[False, True])
+        with mock.patch('libcloud.tasks.connection'):
+            heartbeat.run()
+        self.assertEqual(tasks.requeue_stale(60), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.Status.Running)
+
+    def test_worker_warns_about_a_private_cache(self):
+        stderr = StringIO()
+        call_command('run_worker', '--burst', stdout=StringIO(), stderr=stderr)
+        self.assertIn("the cache is local to this process", stderr.getvalue())
+        stderr = StringIO()
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            call_command('run_worker', '--burst', stdout=StringIO(), stderr=stderr)
+        self.assertEqual(stderr.getvalue(), "")
+
+    def test_prune(self):
+        old, recent = timezone.now() - timedelta(days=8), timezone.now()
+        Job.objects.bulk_create([
+            Job(name='done', status=Job.Status.Done, finished_at=old),
+            Job(name='recent', status=Job.Status.Done, finished_at=recent),
+            Job(name='failed', status=Job.Status.Failed, finished_at=old),
+            Job(name='pending', status=Job.Status.Pending),
+        ])
+        self.assertEqual(tasks.prune(), 1)
+        self.assertEqual(sorted(Job.objects.values_list('name', flat=True)), ['failed', 'pending', 'recent'])
+
+
+@override_settings(MEDIA_ROOT=test_media_root,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class DerivativeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def create(self, name, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Content.objects.create(creator=self.user, type=self.content_type,
+                                          file=SimpleUploadedFile(name, data))
+
+    def test_derivative_path_changes_with_contents(self):
+        content = self.create('photo.jpg', b"jpeg")
+        self.assertEqual(derivatives.get_derivative_path(content, 'a' * 64, 'thumbnail'),
+                         'user_username/derivatives/photo.aaaaaaaaaaaa.thumbnail.jpg')
+        self.assertNotEqual(derivatives.get_derivative_path(content, 'b' * 64, 'thumbnail'),
+                            derivatives.get_derivative_path(content, 'a' * 64, 'thumbnail'))
+
+    def test_derivatives_are_served_with_long_cache_lifetime(self):
+        content = self.create('temp.txt', b"Test File")
+        name = default_storage.save(derivatives.get_derivative_path(content, 'a' * 64, 'thumbnail'),
+                                    ContentFile(b"thumb"))
+        Content.objects.filter(pk=content.pk).update(thumbnail=name)
+        content.refresh_from_db()
+
+        response = self.client.get(content.thumbnail.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"thumb")
+        self.assertEqual(response.get('Cache-Control'), 'public, max-age=31536000, immutable')
+        self.assertTrue(response.get('Content-Disposition').startswith('inline'))
+        self.assertEqual(self.client.get(content.thumbnail.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(content.thumbnail.url + 'x').status_code, 404)
+
+        self.assertContains(self.client.get('/my_content/'), content.thumbnail.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            content.delete()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_files_without_renderer_get_no_job(self):
+        self.create('temp.txt', b"Test File")
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['libcloud.checksum'])
+
+    @skipUnless(derivatives.Image, "Pillow is not installed")
+    def test_image_upload_gets_thumbnail_and_preview(self):
+        image = BytesIO()
+        derivatives.Image.new('RGBA', (2000, 1000), 'red').save(image, 'PNG')
+        content = self.create('photo.png', image.getvalue())
+        self.assertEqual(tasks.work(burst=True), 2)
+
+        content.refresh_from_db()
+        checksum = hashlib.sha256(image.getvalue()).hexdigest()
+        self.assertEqual(content.thumbnail.name, 'user_username/derivatives/photo.%s.thumbnail.jpg' % checksum[:12])
+        with content.thumbnail.open('rb') as f:
+            self.assertEqual(derivatives.Image.open(f).size, (256, 128))
+        with content.preview.open('rb') as f:
+            self.assertEqual(derivatives.Image.open(f).size, (1024, 512))
+
+    @skipUnless(derivatives.Image, "Pillow is not installed")
+    def test_broken_image_keeps_icon(self):
+        content = self.create('photo.png', b"not an image")
+        with self.assertLogs('libcloud.derivatives', 'INFO'):
+            tasks.work(burst=True)
+        content.refresh_from_db()
+        self.assertEqual(content.thumbnail.name, '')
+        self.assertEqual(Job.objects.filter(status=Job.Status.Done).count(), 2)
+
+    @skipUnless(derivatives.Image, "Pillow is not installed")
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'web'},
+                               'worker': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                          'LOCATION': 'worker'}})
+    def test_cached_pages_show_thumbnails_rendered_by_another_process(self):
+        library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        image = BytesIO()
+        derivatives.Image.new('RGB', (300, 200), 'red').save(image, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            content = Content.objects.create(creator=self.user, type=self.content_type, library=library,
+                                             file=SimpleUploadedFile('photo.png', image.getvalue()))
+        self.assertNotContains(self.client.get(library.get_absolute_url()), 'derivatives/')
+
+        # The worker's version bumps land in a cache the web process never reads.
+        with mock.patch('libcloud.fragments.cache', caches['worker']), \
+                mock.patch('libcloud.sidebar.cache', caches['worker']), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(tasks.work(burst=True), 2)
+        content.refresh_from_db()
+        self.assertContains(self.client.get(library.get_absolute_url()), content.thumbnail.url)
+
+    def render_with(self, files, **run):
+        """Upload ``files`` and run their jobs, with pdftoppm and ffmpeg mocked as ``run`` describes."""
+        with mock.patch('shutil.which', return_value='/usr/bin/renderer'), \
+                mock.patch('subprocess.run', **run) as run:
+            contents = [self.create(name, data) for name, data in files]
+            tasks.work(burst=True)
+        for content in contents:
+            content.refresh_from_db()
+        return contents, [call.args[0] for call in run.call_args_list]
+
+    @skipUnless(derivatives.Image, "Pillow is not installed")
+    def test_pdf_and_video_are_rendered_with_external_tools(self):
+        image = BytesIO()
+        derivatives.Image.new('RGB', (1024, 768), 'blue').save(image, 'PNG')
+        (pdf, video), commands = self.render_with([('manual.pdf', b"%PDF-1.4"), ('clip.mp4', b"video")],
+                                                  return_value=subprocess.CompletedProcess([], 0, image.getvalue()))
+        self.assertCountEqual(commands, [
+            ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-png', '-scale-to', '1024', pdf.file.path],
+            ['ffmpeg', '-loglevel', 'error', '-ss', '1', '-i', video.file.path,
+             '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-'],
+        ])
+        for content in (pdf, video):
+            with content.thumbnail.open('rb') as f:
+                self.assertEqual(derivatives.Image.open(f).size, (256, 192))
+            with content.preview.open('rb') as f:
+                self.assertEqual(derivatives.Image.open(f).size, (1024, 768))
+
+    @skipUnless(derivatives.Image, "Pillow is not installed")
+    def test_failing_renderer_keeps_icon(self):
+        for run, error in [
+            ({'return_value': subprocess.CompletedProcess([], 1, b"", b"Syntax Error: broken xref")}, "broken xref"),
+            ({'side_effect': subprocess.TimeoutExpired('pdftoppm', 60)}, "pdftoppm timed out"),
+        ]:
+            with self.assertLogs('libcloud.derivatives', 'INFO') as logs:
+                (content,), _ = self.render_with([('manual.pdf', b"not a pdf")], **run)
+            self.assertIn(error, logs.output[0])
+            self.assertEqual(content.thumbnail.name, '')
+
+    @skipUnless(derivatives.Image and shutil.which('pdftoppm'), "pdftoppm is not installed")
+    def test_pdf_first_page_is_rendered(self):
+        pdf = BytesIO()
+        derivatives.Image.new('RGB', (600, 800), 'white').save(pdf, 'PDF')
+        content = self.create('manual.pdf', pdf.getvalue())
+        self.assertEqual(tasks.work(burst=True), 2)
+        content.refresh_from_db()
+        with content.preview.open('rb') as f:
+            self.assertEqual(derivatives.Image.open(f).size, (768, 1024))
+
+    @skipUnless(derivatives.Image and shutil.which('ffmpeg'), "ffmpeg is not installed")
+    def test_video_frame_is_rendered(self):
+        os.makedirs(test_media_root, exist_ok=True)
+        path = os.path.join(test_media_root, 'clip.mpg')
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=duration=2:size=320x240:rate=25',
+                        path], check=True)
+        with open(path, 'rb') as f:
+            content = self.create('clip.mpg', f.read())
+        self.assertEqual(tasks.work(burst=True), 2)
+        content.refresh_from_db()
+        with content.thumbnail.open('rb') as f:
+            self.assertEqual(derivatives.Image.open(f).size, (256, 192))
+
+
+@override_settings(MEDIA_ROOT=test_media_root,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.attachment_type = AttachmentType.objects.create(user=self.user, name='a_type1')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.feature_type = ContentTypeFeature.objects.create(content_type=self.content_type, name='pages',
+                                                              type=ContentTypeFeature.FeatureType.Number)
+        self.library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        self.content = self.create('temp.txt')
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def create(self, name, library=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Content.objects.create(creator=self.user, type=self.content_type, library=library or self.library,
+                                          file=SimpleUploadedFile(name, b"Test File"))
+
+    def get(self, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_content_page_is_cached_until_details_change(self):
+        url = self.content.get_absolute_url()
+        _, cold = self.get(url)
+        _, warm = self.get(url)
+        self.assertLess(warm, cold)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ContentFeature.objects.create(content=self.content, feature_type=self.feature_type, value='98765')
+        response, _ = self.get(url)
+        self.assertContains(response, '98765')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Attachment.objects.create(content=self.content, type=self.attachment_type,
+                                      file=SimpleUploadedFile('attachment.txt', b"Attachment"))
+        self.assertContains(self.get(url)[0], 'attachment.txt')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feature_type.name = 'page count'
+            self.feature_type.save()
+        self.assertContains(self.get(url)[0], 'page count')
+
+    def test_library_page_is_cached_until_contents_change(self):
+        url = self.library.get_absolute_url()
+        _, cold = self.get(url)
+        _, warm = self.get(url)
+        self.assertLess(warm, cold)
+
+        self.create('second.txt')
+        self.assertContains(self.get(url)[0], 'second.txt')
+
+        other = Library.objects.create(user=self.user, name='lib2', content_type=self.content_type)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.content.library = other
+            self.content.save()
+        self.assertNotContains(self.get(url)[0], 'temp.txt')
+        self.assertContains(self.get(other.get_absolute_url())[0], 'temp.txt')
+
+    def test_query_strings_not_shaping_the_listing_share_its_cache_entry(self):
+        url = self.library.get_absolute_url()
+        for query in ('', '?x=1', '?x=2', '?page=3&q=junk', '?page_size=oops'):
+            self.get(url + query)
+        self.assertEqual(len([key for key in cache._cache if 'library_contents' in key]), 1)
+
+        self.create('second.txt')
+        response, _ = self.get(url + '?x=1&page_size=1')
+        self.assertContains(response, '?page_size=1&amp;cursor=')
+        self.assertNotContains(response, 'x=1')
+
+    def test_library_page_filters_are_cached_separately(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ContentFeature.objects.create(content=self.content, feature_type=self.feature_type, value='12')
+        url = self.library.get_absolute_url()
+        self.assertContains(self.get(url + '?pages__gte=10')[0], 'temp.txt')
+        self.assertNotContains(self.get(url + '?pages__gte=20')[0], 'temp.txt')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ContentFeature.objects.filter(content=self.content).get().delete()
+        self.assertNotContains(self.get(url + '?pages__gte=10')[0], 'temp.txt')
+
+
+@override_settings(MEDIA_ROOT=test_media_root,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.attachment_type = AttachmentType.objects.create(user=self.user, name='a_type1')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.feature_type = ContentTypeFeature.objects.create(content_type=self.content_type, name='pages',
+                                                              type=ContentTypeFeature.FeatureType.Number)
+        self.library = Library.objects.create(user=self.user, name='lib1', content_type=self.content_type)
+        self.content = Content.objects.create(creator=self.user, type=self.content_type, library=self.library,
+                                              file=SimpleUploadedFile('temp.txt', b"Test File"))
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def assertRevalidates(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def assertChanged(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_child_rows_touch_their_parent(self):
+        updated_at = self.content.updated_at
+        self.assertGreaterEqual(updated_at, self.content.created_at)
+        ContentFeature.objects.create(content=self.content, feature_type=self.feature_type, value='10')
+        self.content.refresh_from_db()
+        self.assertGreater(self.content.updated_at, updated_at)
+
+        updated_at = ContentType.objects.get(pk=self.content_type.pk).updated_at
+        self.content_type.attachment_types.add(self.attachment_type)
+        self.assertGreater(ContentType.objects.get(pk=self.content_type.pk).updated_at, updated_at)
+
+    def test_content_page(self):
+        url = self.content.get_absolute_url()
+        etag = self.assertRevalidates(url)
+        ContentFeature.objects.create(content=self.content, feature_type=self.feature_type, value='10')
+        etag = self.assertChanged(url, etag)
+        self.library.name = 'renamed'
+        self.library.save()
+        self.assertChanged(url, etag)
+
+    def test_library_page(self):
+        url = self.library.get_absolute_url()
+        etag = self.assertRevalidates(url)
+        Content.objects.create(creator=self.user, type=self.content_type, library=self.library,
+                               file=SimpleUploadedFile('second.txt', b"Test File"))
+        etag = self.assertChanged(url, etag)
+        self.content.delete()
+        etag = self.assertChanged(url, etag)
+        # Another library shows up in the navigation bar.
+        with self.captureOnCommitCallbacks(execute=True):
+            Library.objects.create(user=self.user, name='lib2', content_type=self.content_type)
+        self.assertChanged(url, etag)
+
+    def test_content_type_page(self):
+        url = self.content_type.get_absolute_url()
+        etag = self.assertRevalidates(url)
+        self.content_type.attachment_types.add(self.attachment_type)
+        etag = self.assertChanged(url, etag)
+        self.attachment_type.name = 'renamed'
+        self.attachment_type.save()
+        self.assertChanged(url, etag)
+
+    def test_pages_are_per_user(self):
+        url = self.content.get_absolute_url()
+        etag = self.assertRevalidates(url)
+        User.objects.create_user(username='other', password='123')
+        self.client.login(username='other', password='123')
+        self.assertChanged(url, etag)
+
+    def test_page_with_messages_is_not_cached(self):
+        response = self.client.get(self.library.get_absolute_url() + '?pages__gte=many')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_download_revalidates(self):
+        response = self.client.get(self.content.file.url)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        response = self.client.get(self.content.file.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(MEDIA_ROOT=test_media_root, LIBCLOUD_DOWNLOAD_CHUNK_SIZE=7)
+class ExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.attachment_type = AttachmentType.objects.create(user=self.user, name='cover')
+        self.content_type = ContentType.objects.create(user=self.user, name='book')
+        self.content_type.attachment_types.add(self.attachment_type)
+        self.pages = ContentTypeFeature.objects.create(content_type=self.content_type, name='pages',
+                                                       type=ContentTypeFeature.FeatureType.Number)
+        self.library = Library.objects.create(user=self.user, name='Classic books', content_type=self.content_type)
+        self.contents = []
+        for i, data in enumerate([b"The Art of Computer Programming", b"SICP"]):
+            content = Content.objects.create(creator=self.user, type=self.content_type, library=self.library,
+                                             file=SimpleUploadedFile('book%d.txt' % i, data))
+            ContentFeature.objects.create(content=content, feature_type=self.pages, value=str(100 + i))
+            self.contents.append(content)
+        Attachment.objects.create(content=self.contents[0], type=self.attachment_type,
+                                  file=SimpleUploadedFile('cover.txt', b"cover image"))
+        self.url = reverse('libcloud:export_library', args=[self.library.pk])
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def download(self, url, **headers):
+        response = self.client.get(url, **headers)
+        return response, b"".join(response.streaming_content)
+
+    def test_library_zip(self):
+        response, data = self.download(self.url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="classic-books.zip"')
+        self.assertEqual(int(response['Content-Length']), len(data))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        first, second = self.contents
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), [
+                'manifest.jsonl', '%d/book0.txt' % first.pk, '%d/attachments/%s' % (
+                    first.pk, first.attachment_set.get().filename()), '%d/book1.txt' % second.pk])
+            self.assertEqual(archive.read('%d/book1.txt' % second.pk), b"SICP")
+            rows = [json.loads(line) for line in archive.read('manifest.jsonl').splitlines()]
+        self.assertEqual(rows[0]['features'], {'pages': '100'})
+        self.assertEqual(rows[0]['attachments'][0]['type'], 'cover')
+        self.assertEqual(rows[1]['library'], 'Classic books')
+
+        # The archive imports back as it is.
+        report = bulk_import.import_contents(self.user, BytesIO(data))
+        self.assertEqual((report.created, report.errors), (2, []))
+
+    def test_resume_with_ranges(self):
+        response, data = self.download(self.url)
+        etag = response['ETag']
+        for start, end in [(0, 0), (10, 60), (31, len(data) - 1), (len(data) - 30, len(data) - 1)]:
+            response, part = self.download(self.url, HTTP_RANGE='bytes=%d-%d' % (start, end), HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], 'bytes %d-%d/%d' % (start, end, len(data)))
+            self.assertEqual(part, data[start:end + 1])
+
+        response, part = self.download(self.url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, part), (200, data))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=%d-%d' % (len(data), len(data) + 10))
+        self.assertEqual(response.status_code, 416)
+
+    def test_library_tar(self):
+        response, data = self.download(self.url + '?format=tar')
+        self.assertEqual(int(response['Content-Length']), len(data))
+        with tarfile.open(fileobj=BytesIO(data)) as archive:
+            self.assertEqual(archive.extractfile('%d/book0.txt' % self.contents[0].pk).read(),
+                             b"The Art of Computer Programming")
+        response, part = self.download(self.url + '?format=tar', HTTP_RANGE='bytes=700-1500')
+        self.assertEqual(part, data[700:1501])
+
+    def test_compressed_zip_is_not_resumable(self):
+        response, data = self.download(self.url + '?compress=1')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertFalse(response.has_header('Accept-Ranges'))
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.getinfo('%d/book1.txt' % self.contents[1].pk).compress_type,
+                             zipfile.ZIP_DEFLATED)
+
+    def test_zip64(self):
+        with mock.patch.object(export, 'ZIP64_LIMIT', 20):
+            _, data = self.download(self.url)
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read('%d/book0.txt' % self.contents[0].pk), b"The Art of Computer Programming")
+
+    def test_export_selection(self):
+        other = User.objects.create_user(username='other', password='123')
+        foreign = Content.objects.create(creator=other, type=ContentType.objects.create(user=other, name='t'),
+                                         file=SimpleUploadedFile('foreign.txt', b"foreign"))
+        url = reverse('libcloud:export_contents')
+        _, data = self.download('%s?content=%d&content=%d' % (url, self.contents[1].pk, foreign.pk))
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), ['manifest.jsonl', '%d/book1.txt' % self.contents[1].pk])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(self.client.get(self.url + '?format=rar').status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=test_media_root, LIBCLOUD_METRICS=True, LIBCLOUD_SERVER_TIMING=True,
+                   LIBCLOUD_METRICS_DIR=None, LIBCLOUD_METRICS_TOKEN='secret',
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class MetricsTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.content = Content.objects.create(creator=self.user, type=self.content_type,
+                                              file=SimpleUploadedFile('temp.txt', b"Test File"))
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def value(self, name, *labels):
+        return self.registry.values.get((name, labels))
+
+    def test_page_metrics(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.content.get_absolute_url())
+        self.assertRegex(response['Server-Timing'],
+                         r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="%d queries", tpl;dur=[\d.]+$' % len(queries))
+        route = 'libcloud:content'
+        self.assertEqual(self.value('libcloud_requests_total', route, 'GET', '200'), 1)
+        self.assertEqual(sum(self.value('libcloud_request_duration_seconds', route, 'GET')[:-1]), 1)
+        queries_histogram = self.value('libcloud_db_queries', route)
+        self.assertEqual(queries_histogram[-1], len(queries))
+        self.assertGreater(self.value('libcloud_template_seconds_total', route), 0)
+        self.assertEqual(self.value('libcloud_response_bytes_total', route), len(response.content))
+
+    def test_streamed_bytes_are_counted(self):
+        middleware = metrics.MetricsMiddleware(lambda request: StreamingHttpResponse([b"Test", b" File"]))
+        response = middleware(RequestFactory().get('/stream/'))
+        self.assertIsNone(self.value('libcloud_response_bytes_total', '<unmatched>'))
+        self.assertEqual(b"".join(response.streaming_content), b"Test File")
+        self.assertEqual(self.value('libcloud_response_bytes_total', '<unmatched>'), 9)
+
+    def test_file_responses_keep_file_to_stream(self):
+        # Counted from their length, so that the server can still send them with wsgi.file_wrapper.
+        middleware = metrics.MetricsMiddleware(lambda request: serve_file(request, self.content.file.path, 'temp.txt'))
+        response = middleware(RequestFactory().get('/file/'))
+        self.assertIsNotNone(response.file_to_stream)
+        self.assertEqual(self.value('libcloud_response_bytes_total', '<unmatched>'), 9)
+        # Not response.close(): its request_finished signal would close the test's database connection.
+        response.file_to_stream.close()
+        response = middleware(RequestFactory().get('/file/', HTTP_RANGE='bytes=0-3'))
+        self.assertIsNotNone(response.file_to_stream)
+        self.assertEqual(self.value('libcloud_response_bytes_total', '<unmatched>'), 13)
+        response.file_to_stream.close()
+
+    def test_unmatched_urls_share_a_label(self):
+        self.client.get('/no/such/page/')
+        self.client.get('/nor/this/one/')
+        self.assertEqual(self.value('libcloud_requests_total', '<unmatched>', 'GET', '404'), 2)
+
+    def test_metrics_endpoint(self):
+        self.client.get(self.content.get_absolute_url())
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('# TYPE libcloud_request_duration_seconds histogram', text)
+        self.assertIn('libcloud_requests_total{route="libcloud:content",method="GET",status="200"} 1\n', text)
+        self.assertIn('libcloud_request_duration_seconds_bucket{route="libcloud:content",method="GET",le="+Inf"} 1\n',
+                      text)
+        self.assertIn('libcloud_request_duration_seconds_count{route="libcloud:content",method="GET"} 1\n', text)
+
+    def test_processes_are_added_up(self):
+        directory = os.path.join(test_media_root, 'metrics')
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+            json.dump([['libcloud_requests_total', ['libcloud:content', 'GET', '200'], 4]], f)
+        with self.settings(LIBCLOUD_METRICS_DIR=directory):
+            self.client.get(self.content.get_absolute_url())
+            entries = self.registry.collect()
+        self.assertIn(['libcloud_requests_total', ['libcloud:content', 'GET', '200'], 5], entries)
+
+    async def test_async_views(self):
+        response = await self.async_client.get(self.content.file.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Server-Timing', response)
+        self.assertEqual(self.value('libcloud_requests_total', 'libcloud:download_file', 'GET', '200'), 1)
+
+
+@override_settings(MEDIA_ROOT=test_media_root, LIBCLOUD_STORAGE_QUOTA=10000,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StorageQuotaTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.attachment_type = AttachmentType.objects.create(user=self.user, name='cover')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.content_type.attachment_types.add(self.attachment_type)
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def used(self):
+        return StorageUsage.objects.get(user=self.user).used
+
+    def create_content(self, data):
+        return Content.objects.create(creator=self.user, type=self.content_type,
+                                      file=SimpleUploadedFile('temp.txt', data))
+
+    def post_content(self, data):
+        return self.client.post('/content/create/%d/' % self.content_type.pk, {
+            'content-type': self.content_type.pk, 'content-file': SimpleUploadedFile('new.txt', data),
+            'feature-TOTAL_FORMS': 0, 'feature-INITIAL_FORMS': 0,
+            'attachment-TOTAL_FORMS': 0, 'attachment-INITIAL_FORMS': 0,
+        })
+
+    def test_usage_follows_rows(self):
+        content = self.create_content(b"Test File")
+        self.assertEqual(content.size, 9)
+        attachment = Attachment.objects.create(content=content, type=self.attachment_type,
+                                               file=SimpleUploadedFile('cover.png', b"cover"))
+        self.assertEqual(attachment.size, 5)
+        self.assertEqual(self.used(), 14)
+        attachment.delete()
+        self.assertEqual(self.used(), 9)
+        Attachment.objects.create(content=content, type=self.attachment_type,
+                                  file=SimpleUploadedFile('cover.png', b"cover"))
+        content.delete()
+        self.assertEqual(self.used(), 0)
+
+    def test_multipart_upload_over_quota(self):
+        self.assertEqual(self.post_content(b"x" * 1000).status_code, 200)
+        self.assertEqual(self.used(), 1000)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_content(b"x" * 20000)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn(b"storage quota exceeded", response.content)
+        self.assertFalse(any('INSERT' in query['sql'] for query in queries))
+        self.assertEqual(Content.objects.count(), 1)
+
+        StorageUsage.objects.filter(user=self.user).update(quota=100000)
+        self.assertEqual(self.post_content(b"x" * 20000).status_code, 200)
+        self.assertEqual(self.used(), 21000)
+
+    def test_form_checks_quota_without_content_length(self):
+        self.create_content(b"x" * 9995)
+        form = ContentForm({'content-type': self.content_type.pk},
+                           {'content-file': SimpleUploadedFile('new.txt', b"x" * 10)}, user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertIn("storage quota exceeded", str(form.errors['file']))
+
+    def test_chunked_upload_reserves_quota(self):
+        def init(size):
+            return self.client.post('/uploads/', json.dumps({'filename': 'big.txt', 'size': size,
+                                                             'content_type': self.content_type.pk}),
+                                    content_type='application/json')
+
+        self.assertEqual(init(100000).status_code, 413)
+        session = init(6000).json()
+        self.assertEqual(init(6000).status_code, 413)
+        self.client.put(session['chunk_url'], b"x" * 6000, content_type='application/octet-stream',
+                        HTTP_CONTENT_RANGE='bytes 0-5999/6000')
+        response = self.client.post(session['finalize_url'], '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.used(), 6000)
+        self.assertEqual(Content.objects.get().size, 6000)
+        self.assertEqual(init(4000).status_code, 201)
+
+    def test_abandoned_session_releases_quota(self):
+        def init():
+            return self.client.post('/uploads/', json.dumps({'filename': 'big.txt', 'size': 6000,
+                                                             'content_type': self.content_type.pk}),
+                                    content_type='application/json')
+
+        abandoned = init().json()
+        self.assertEqual(init().status_code, 413)
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(init().status_code, 201)
+        # Resuming has to fit in the quota again.
+        response = self.client.put(abandoned['chunk_url'], b"x" * 10, content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE='bytes 0-9/6000')
+        self.assertEqual(response.status_code, 413)
+
+        part = os.path.join(test_media_root, '.uploads', '%s.part' % abandoned['id'])
+        os.utime(part, (time.time() - 8 * 86400, time.time() - 8 * 86400))
+        out = StringIO()
+        call_command('collect_garbage', stdout=out)
+        self.assertIn("1 orphaned files deleted, 5.9\xa0KB reclaimed, 1 abandoned upload sessions", out.getvalue())
+        self.assertFalse(os.path.exists(part))
+        self.assertEqual(UploadSession.objects.count(), 1)
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse("ok")
+
+        self.create_content(b"x" * 9000)
+        middleware = StorageQuotaMiddleware(get_response)
+        request = RequestFactory().post('/content/create/', {'file': SimpleUploadedFile('new.txt', b"x" * 2000)})
+        request.user = self.user
+        self.assertEqual(async_to_sync(middleware)(request).status_code, 413)
+
+    def test_bulk_import_over_quota(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('manifest.jsonl', "\n".join(json.dumps({'file': name, 'content_type': 'type1'})
+                                                         for name in ('a.txt', 'b.txt')))
+            archive.writestr('a.txt', b"a" * 4000)
+            archive.writestr('b.txt', b"b" * 4000)
+        report = bulk_import.import_contents(self.user, BytesIO(buffer.getvalue()))
+        self.assertEqual(report.created, 2)
+        self.assertEqual(self.used(), 8000)
+        self.assertEqual(sorted(Content.objects.values_list('size', flat=True)), [4000, 4000])
+        with self.assertRaisesMessage(ValidationError, "storage quota exceeded"):
+            bulk_import.import_contents(self.user, BytesIO(buffer.getvalue()))
+        self.assertEqual(Content.objects.count(), 2)
+
+    def test_strict_import_running_out_of_quota_keeps_nothing(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('manifest.jsonl', "\n".join(json.dumps({'file': name, 'content_type': 'type1'})
+                                                         for name in ('a.txt', 'b.txt')))
+            archive.writestr('a.txt', b"a" * 6000)
+            archive.writestr('b.txt', b"b" * 6000)
+        # The first batch fits in the quota, the second does not.
+        with self.assertRaisesMessage(ValidationError, "storage quota exceeded"):
+            bulk_import.import_contents(self.user, BytesIO(buffer.getvalue()), batch_size=1, strict=True)
+        self.assertFalse(Content.objects.exists())
+        self.assertFalse([name for _, _, names in os.walk(test_media_root) for name in names])
+
+        with self.assertRaisesMessage(ValidationError, "storage quota exceeded"):
+            bulk_import.import_contents(self.user, BytesIO(buffer.getvalue()), batch_size=1)
+        self.assertEqual(Content.objects.count(), 1)
+        self.assertEqual(self.used(), 6000)
+
+    def test_reconcile_command(self):
+        content = self.create_content(b"Test File")
+        missing = self.create_content(b"gone")
+        os.remove(missing.file.path)
+        Content.objects.filter(pk=content.pk).update(size=1)
+        StorageUsage.objects.filter(user=self.user).update(used=5)
+        with self.assertRaisesMessage(CommandError, "3 sizes and usage totals are out of date"):
+            call_command('storage_usage', '--check', stdout=StringIO())
+
+        out = StringIO()
+        call_command('storage_usage', stdout=out)
+        self.assertIn("content %d: %s is missing" % (missing.pk, missing.file.name), out.getvalue())
+        self.assertEqual(Content.objects.get(pk=content.pk).size, 9)
+        self.assertEqual(Content.objects.get(pk=missing.pk).size, 0)
+        self.assertEqual(self.used(), 9)
+        call_command('storage_usage', '--check', stdout=StringIO())
+
+
+@override_settings(MEDIA_ROOT=test_media_root, FILE_UPLOAD_MAX_MEMORY_SIZE=1000, LIBCLOUD_UPLOAD_MAX_FILE_SIZE=10000,
+                   LIBCLOUD_UPLOAD_MAX_REQUEST_SIZE=20000,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StreamingUploadHandlerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+        self.client.login(username='username', password='123')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def post_content(self, data, **files):
+        return self.client.post('/content/create/%d/' % self.content_type.pk, dict({
+            'content-type': self.content_type.pk, 'content-file': SimpleUploadedFile('new.txt', data),
+            'feature-TOTAL_FORMS': 0, 'feature-INITIAL_FORMS': 0,
+            'attachment-TOTAL_FORMS': 0, 'attachment-INITIAL_FORMS': 0,
+        }, **files))
+
+    def staged_files(self):
+        staging = os.path.join(test_media_root, '.uploads')
+        return os.listdir(staging) if os.path.exists(staging) else []
+
+    def assert_stored(self, data):
+        content = Content.objects.get()
+        self.assertEqual(content.size, len(data))
+        self.assertEqual(content.checksum, hashlib.sha256(data).hexdigest())
+        with content.file.open('rb') as f:
+            self.assertEqual(f.read(), data)
+        # Hashed on the way in, so no checksum job is needed.
+        self.assertFalse(Job.objects.filter(name='libcloud.checksum').exists())
+        self.assertEqual(self.staged_files(), [])
+
+    def test_small_file(self):
+        self.assertEqual(self.post_content(b"small").status_code, 200)
+        self.assert_stored(b"small")
+
+    def test_large_file_is_moved_into_place(self):
+        data = os.urandom(5000)
+        with mock.patch('django.core.files.storage.file_move_safe', wraps=file_move_safe) as move:
+            self.assertEqual(self.post_content(data).status_code, 200)
+        move.assert_called_once()
+        self.assert_stored(data)
+
+    @override_settings(DEFAULT_FILE_STORAGE='libcloud.storage.DeduplicatingStorage')
+    def test_deduplicating_storage_reuses_checksum(self):
+        data = os.urandom(5000)
+        # The moved file is not read again to hash it.
+        with mock.patch('libcloud.storage.open', create=True) as storage_open:
+            self.assertEqual(self.post_content(data).status_code, 200)
+        storage_open.assert_not_called()
+        self.assertEqual(StoredBlob.objects.get().digest, hashlib.sha256(data).hexdigest())
+        self.assert_stored(data)
+
+    def test_file_over_limit(self):
+        response = self.post_content(b"x" * 10001)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn(b"new.txt is larger than the 9.8\xc2\xa0KB allowed per file", response.content)
+        self.assertFalse(Content.objects.exists())
+        self.assertEqual(self.staged_files(), [])
+
+    def test_request_over_limit(self):
+        response = self.post_content(b"x" * 9000, **{'attachment-0-file': SimpleUploadedFile('a.txt', b"x" * 9000),
+                                                     'attachment-1-file': SimpleUploadedFile('b.txt', b"x" * 9000)})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Content.objects.exists())
+
+    def test_anonymous_bodies_are_left_to_the_views(self):
+        self.client.logout()
+        # Refused by login_required, not parsed for the 413.
+        self.assertEqual(self.post_content(b"x" * 10001).status_code, 302)
+        self.assertEqual(self.staged_files(), [])
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse("ok")
+
+        middleware = UploadLimitMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = RequestFactory().post('/content/create/', {'file': SimpleUploadedFile('new.txt', b"x" * 10001)})
+        request.user = self.user
+        response = async_to_sync(middleware)(request)
+        self.assertEqual(response.status_code, 413)
+        request = RequestFactory().post('/content/create/', {'file': SimpleUploadedFile('new.txt', b"x" * 5000)})
+        request.user = self.user
+        self.assertEqual(async_to_sync(middleware)(request).content, b"ok")
+        self.assertEqual(request.FILES['file'].size, 5000)
+
+    def test_request_over_limit_without_content_length(self):
+        handler = StreamingUploadHandler()
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            try:
+                handler.new_file('file', name, 'text/plain', None)
+            except StopFutureHandlers:
+                pass
+            if name == 'c.txt':
+                with self.assertRaisesMessage(UploadTooLarge, "allowed per request"):
+                    handler.receive_data_chunk(b"x" * 9000, 0)
+            else:
+                handler.receive_data_chunk(b"x" * 9000, 0)
+                handler.file_complete(9000)
+        self.assertEqual(self.staged_files(), [])
+
+
+@override_settings(MEDIA_ROOT=test_media_root, LIBCLOUD_GC_GRACE_PERIOD=3600)
+class GarbageCollectorTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='testemail@gmail.com', username='username', password='123')
+        self.content_type = ContentType.objects.create(user=self.user, name='type1')
+
+    def tearDown(self):
+        if os.path.exists(test_media_root):
+            shutil.rmtree(test_media_root)
+        super().tearDown()
+
+    def write(self, name, data=b"orphan", age=7200):
+        path = os.path.join(test_media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_garbage', *args, stdout=out)
+        return out.getvalue()
+
+    def test_orphans_are_deleted(self):
+        content = Content.objects.create(creator=self.user, type=self.content_type,
+                                         file=SimpleUploadedFile('kept.txt', b"kept"))
+        Content.objects.filter(pk=content.pk).update(thumbnail='user_username/thumbnails/kept.webp')
+        kept = self.write(content.file.name)
+        thumbnail = self.write('user_username/thumbnails/kept.webp')
+        orphan = self.write('user_username/orphan.txt', b"x" * 100)
+        young = self.write('user_username/young.txt', age=60)
+        other = self.write('site/logo.png')
+        self.assertIn("1 orphaned files deleted, 100\xa0bytes reclaimed", self.collect())
+        self.assertFalse(os.path.exists(orphan))
+        for path in (kept, thumbnail, young, other):
+            self.assertTrue(os.path.exists(path))
+
+    def test_dry_run(self):
+        orphan = self.write('user_username/orphan.txt')
+        output = self.collect('--dry-run')
+        self.assertIn(orphan, output)
+        self.assertIn("1 orphaned files would be removed", output)
+        self.assertTrue(os.path.exists(orphan))
+
+    def test_quarantine(self):
+        orphan = self.write('user_username/orphan.txt')
+        self.assertIn("1 orphaned files quarantined", self.collect('--quarantine'))
+        self.assertFalse(os.path.exists(orphan))
+        moved = [os.path.join(root, name) for root, _, names in os.walk(os.path.join(test_media_root, '.quarantine'))
+                 for name in names]
+        self.assertEqual(len(moved), 1)
+        self.assertTrue(moved[0].endswith(os.path.join('user_username', 'orphan.txt')))
+        # A second run leaves the quarantine alone.
+        self.assertIn("0 orphaned files deleted", self.collect())
+
+    def test_abandoned_uploads(self):
+        session = UploadSession.objects.create(user=self.user, kind=UploadSession.Kind.Content, filename='a.txt',
+                                               size=10)
+        active = self.write('.uploads/%s.part' % session.pk)
+        abandoned = self.write('.uploads/%s.part' % uuid.uuid4())
+        leftover = self.write('.uploads/tmpabc.upload')
+        self.assertIn("2 orphaned files deleted", self.collect())
+        self.assertTrue(os.path.exists(active))
+        self.assertFalse(os.path.exists(abandoned))
+        self.assertFalse(os.path.exists(leftover))
+
+    def test_recheck_before_removing(self):
+        self.write('user_username/late.txt')
+        collector = GarbageCollector(batch_size=10)
+        candidates = list(collector.candidates(time.time()))
+        self.assertEqual([candidate.key for candidate in candidates], ['user_username/late.txt'])
+        # Saved after the index was built.
+        Content.objects.create(creator=self.user, type=self.content_type, file='user_username/late.txt')
+        collector.sweep(candidates)
+        self.assertEqual(collector.files, 0)
+        self.assertTrue(os.path.exists(os.path.join(test_media_root, 'user_username/late.txt')))
+
+    @override_settings(DEFAULT_FILE_STORAGE='libcloud.storage.DeduplicatingStorage')
+    def test_unknown_blobs(self):
+        content = Content.objects.create(creator=self.user, type=self.content_type,
+                                         file=SimpleUploadedFile('kept.txt', b"kept"))
+        kept = content.file.path
+        os.utime(kept, (time.time() - 7200, time.time() - 7200))
+        digest = hashlib.sha256(b"lost").hexdigest()
+        lost = self.write('.blobs/%s/%s/%s' % (digest[:2], digest[2:4], digest), b"lost")
+        self.assertIn("1 orphaned files deleted, 4\xa0bytes reclaimed", self.collect())
+        self.assertTrue(os.path.exists(kept))
+        self.assertFalse(os.path.exists(lost))
@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import InMemoryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.db import transaction
+from django.http import HttpResponse
+from django.http.multipartparser import MultiPartParserError
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from libcloud.models import Attachment, Content, ContentFeature, ContentTypeFeature, UploadChunk, UploadSession, \
+    touch, typed_feature_value
+
+# Clients are told to send chunks of this size; any size is accepted.
+RECOMMENDED_CHUNK_SIZE = 8 * 1024 * 1024
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class StagedFile(UploadedFile):
+    """
+    A fully assembled upload sitting in the staging directory.
+
+    Exposing ``temporary_file_path`` lets FileSystemStorage move the file into
+    place instead of copying it.
+    """
+
+    def __init__(self, path, name, size):
+        super().__init__(open(path, 'rb'), name=name, size=size)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class StreamedUploadedFile(UploadedFile):
+    """
+    A form upload that StreamingUploadHandler wrote to the staging directory
+    as it arrived. Storages move it into place; if it was not used, closing
+    it removes it.
+    """
+
+    def __init__(self, file, path, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class UploadTooLarge(MultiPartParserError):
+    pass
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Receive the files of multipart requests in one pass: each is hashed
+    (``sha256`` of the uploaded file) and counted as it arrives. Files are
+    kept in memory while those of the request add up to no more than
+    FILE_UPLOAD_MAX_MEMORY_SIZE, and are otherwise written to the staging
+    directory under MEDIA_ROOT, from where storing them is a rename rather
+    than a second copy. A file over LIBCLOUD_UPLOAD_MAX_FILE_SIZE, or
+    files adding up to more than LIBCLOUD_UPLOAD_MAX_REQUEST_SIZE, stop the
+    upload as soon as they go over.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.received = 0
+        self.in_memory = 0
+        self.paths = []
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = BytesIO()
+        self.path = None
+        self.digest = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        size = start + len(raw_data)
+        self.received += len(raw_data)
+        max_file_size = getattr(settings, 'LIBCLOUD_UPLOAD_MAX_FILE_SIZE', None)
+        if max_file_size is not None and size > max_file_size:
+            self.discard()
+            raise UploadTooLarge("%s is larger than the %s allowed per file" % (
+                self.file_name, filesizeformat(max_file_size)))
+        max_request_size = getattr(settings, 'LIBCLOUD_UPLOAD_MAX_REQUEST_SIZE', None)
+        if max_request_size is not None and self.received > max_request_size:
+            self.discard()
+            raise UploadTooLarge("the files are larger than the %s allowed per request" % (
+                filesizeformat(max_request_size)))
+        if self.path is None and self.in_memory + size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            self.spill()
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def spill(self):
+        os.makedirs(staging_dir(), exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=staging_dir(), suffix='.upload')
+        self.paths.append(self.path)
+        buffered, self.file = self.file, os.fdopen(fd, 'w+b')
+        self.file.write(buffered.getvalue())
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        if self.path is None:
+            self.in_memory += file_size
+            uploaded = InMemoryUploadedFile(self.file, self.field_name, self.file_name, self.content_type,
+                                            file_size, self.charset, self.content_type_extra)
+        else:
+            uploaded = StreamedUploadedFile(self.file, self.path, self.file_name, self.content_type, file_size,
+                                            self.charset, self.content_type_extra)
+        uploaded.sha256 = self.digest.hexdigest()
+        return uploaded
+
+    def upload_interrupted(self):
+        # The files received before the client went away are kept.
+        self.file.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def discard(self):
+        """Remove every file this request staged so far."""
+        self.file.close()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class UploadLimitMiddleware:
+    """
+    Parse multipart bodies before the views (and CsrfViewMiddleware) do, so
+    that uploads StreamingUploadHandler refuses get a 413 rather than a 400.
+    Bodies whose Content-Length is already over LIBCLOUD_UPLOAD_MAX_REQUEST_SIZE
+    are refused unread.
+
+    Only bodies of signed in users are parsed early; anonymous ones are left
+    to the views, behind the login and CSRF checks. A cross-site request
+    riding on a user's session is still parsed before CSRF refuses it, but
+    the files it staged are removed when the request ends.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function (Django 4.0 idiom).
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not is_multipart(request):
+            return self.get_response(request)
+        response = self.check_length(request)
+        if response is None and request.user.is_authenticated:
+            response = self.parse(request)
+        return self.get_response(request) if response is None else response
+
+    async def __acall__(self, request):
+        if not is_multipart(request):
+            return await self.get_response(request)
+        response = self.check_length(request)
+        if response is None and await sync_to_async(lambda: request.user.is_authenticated)():
+            # Reading the body and writing the staged files block.
+            response = await sync_to_async(self.parse, thread_sensitive=False)(request)
+        return await self.get_response(request) if response is None else response
+
+    def check_length(self, request):
+        max_request_size = getattr(settings, 'LIBCLOUD_UPLOAD_MAX_REQUEST_SIZE', None)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if max_request_size is not None and length > max_request_size:
+            return HttpResponse("the request is larger than the %s allowed" % filesizeformat(max_request_size),
+                                status=413, content_type='text/plain')
+        return None
+
+    def parse(self, request):
+        try:
+            request.POST
+        except UploadTooLarge as e:
+            return HttpResponse(str(e), status=413, content_type='text/plain')
+        return None
+
+
+def is_multipart(request):
+    return request.method == 'POST' and request.content_type == 'multipart/form-data'
+
+
+def staging_dir():
+    return getattr(settings, 'LIBCLOUD_UPLOAD_STAGING_DIR', None) or os.path.join(settings.MEDIA_ROOT, '.uploads')
+
+
+def staging_path(session):
+    return os.path.join(staging_dir(), '%s.part' % session.pk)
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def session_expiry_cutoff():
+    """Sessions without a chunk since then are abandoned: they no longer reserve quota and are collected."""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'LIBCLOUD_UPLOAD_SESSION_EXPIRY', 7 * 24 * 60 * 60))
+
+
+def start_session(session):
+    os.makedirs(staging_dir(), exist_ok=True)
+    with open(staging_path(session), 'wb') as f:
+        f.truncate(session.size)
+
+
+def abort_session(session):
+    path = staging_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+    session.delete()
+
+
+def copy_chunk(session, offset, stream, length):
+    """
+    Copy ``length`` bytes of ``stream`` into the staged file at ``offset``.
+
+    Every chunk writes through its own file descriptor, so chunks of one
+    session can be received in parallel and in any order. Returns the number
+    of bytes actually written, which is less than ``length`` when the client
+    went away; the part that arrived is kept so the upload can be resumed.
+    Only touches the file, so it can run off the thread of the database.
+    """
+    if offset < 0 or length < 0 or offset + length > session.size:
+        raise ValidationError("chunk is outside of the file")
+    written = 0
+    with open(staging_path(session), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            data = stream.read(min(READ_BLOCK_SIZE, length - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+    return written
+
+
+def record_chunk(session, offset, written):
+    """Remember the bytes copied by copy_chunk(), which also keeps the session from expiring."""
+    if written:
+        UploadChunk.objects.create(session=session, offset=offset, size=written)
+        touch(UploadSession, [session.pk])
+
+
+def received_ranges(session):
+    """Merged, half-open ``[start, end)`` byte ranges received so far."""
+    ranges = []
+    for offset, size in session.uploadchunk_set.order_by('offset').values_list('offset', 'size'):
+        end = offset + size
+        if ranges and offset <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([offset, end])
+    return ranges
+
+
+def clean_feature_value(feature_type, value):
+    value = "" if value is None else str(value).strip()
+    if value == "":
+        if feature_type.required:
+            raise ValidationError(f"feature {feature_type.name} is required")
+        return None
+    try:
+        typed = typed_feature_value(feature_type.type, value)
+    except ValidationError:
+        raise ValidationError(f"feature {feature_type.name} must be a {feature_type.get_type_display().lower()}")
+    if feature_type.type == ContentTypeFeature.FeatureType.Number:
+        return str(typed)
+    if feature_type.type == ContentTypeFeature.FeatureType.Boolean:
+        return "1" if typed else "2"
+    return value
+
+
+def build_features(content_type, values):
+    values = {str(key): value for key, value in (values or {}).items()}
+    features = []
+    for feature_type in content_type.contenttypefeature_set.all():
+        value = clean_feature_value(feature_type, values.get(str(feature_type.pk), values.get(feature_type.name)))
+        if value is not None:
+            features.append(ContentFeature(feature_type=feature_type, value=value))
+    return features
+
+
+def finalize(session, checksum='', features=None):
+    """
+    Turn a completely received session into a Content or an Attachment.
+
+    The staged file is verified against the SHA-256 checksum given at init or
+    here, then moved into the ``get_content_upload_path`` layout.
+    """
+    if received_ranges(session) != ([[0, session.size]] if session.size else []):
+        raise ValidationError("upload is incomplete")
+    path = staging_path(session)
+    expected = (checksum or session.checksum).lower()
+    if expected and file_checksum(path) != expected:
+        raise ValidationError("checksum mismatch")
+
+    if session.kind == UploadSession.Kind.Content:
+        instance = Content(creator=session.user, type=session.content_type, library=session.library)
+        content_features = build_features(session.content_type, features)
+    else:
+        instance = Attachment(content=session.content, type=session.attachment_type)
+        content_features = []
+
+    # A verified checksum spares the post-upload job from hashing the file again.
+    instance.checksum = expected
+    instance.size = session.size
+    staged = StagedFile(path, session.filename, session.size)
+    try:
+        with transaction.atomic():
+            instance.file.save(session.filename, staged, save=False)
+            instance.save()
+            for content_feature in content_features:
+                content_feature.content = instance
+                content_feature.save()
+            session.delete()
+    except Exception:
+        if instance.file and not os.path.exists(path):
+            instance.file.delete(save=False)
+        raise
+    finally:
+        staged.close()
+    return instance
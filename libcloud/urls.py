@@ -14,10 +14,15 @@ urlpatterns = [
     path("content/<int:pk>", views.ContentView.as_view(), name="content"),
     path("content/create/", views.create_content, name="create_content"),
     path("content/create/<int:content_type_pk>/", views.create_content, name="create_content_with_pk"),
+    path("content/import/", views.import_contents, name="import_contents"),
+    path("content/export/", views.export_contents, name="export_contents"),
     path("content/change_library/<int:pk>", views.LibrarySelectView.as_view(), name="library_choice"),
     path(settings.MEDIA_URL + "<str:user_prefix>/<str:filename>", views.download_file, name="download_file"),
+    path(settings.MEDIA_URL + "<str:user_prefix>/derivatives/<str:filename>", views.download_derivative,
+         name="download_derivative"),
     path("libraries/", views.AllLibrariesView.as_view(), name="all_libraries"),
     path("libraries/<int:pk>/", views.EachLibraryView.as_view(), name="each_library"),
+    path("libraries/<int:pk>/export/", views.export_library, name="export_library"),
     path("libraries/create/", views.LibraryCreateView.as_view(), name="create_library"),
     path("my_content/", views.MyContentView.as_view(), name="my_content"),
     path("my_content_types/", views.my_content_types, name="my_content_types"),
@@ -26,5 +31,10 @@ urlpatterns = [
     path("attachment/create/<int:content_pk>/", views.AttachmentCreateView.as_view(), name="create_attachment"),
     path("content_type/create/", views.create_content_type, name="create_content_type"),
     path("content_type/<int:pk>/", views.EachContentTypeView.as_view(), name="each_content_type"),
+    path("search/", views.search_contents, name="search"),
+    path("metrics/", views.serve_metrics, name="metrics"),
+    path("uploads/", views.upload_init, name="upload_init"),
+    path("uploads/<uuid:pk>/", views.upload_chunk, name="upload_session"),
+    path("uploads/<uuid:pk>/finalize/", views.upload_finalize, name="upload_finalize"),
     # path("upload_success", views.upload_success, name="upload_success"),
 ]
@@ -0,0 +1,118 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+
+from libcloud.models import Content, ContentType, ContentTypeFeature, Library
+
+# Relations are checked with set-based queries instead of one query per field.
+FOREIGN_KEYS = ['creator', 'type', 'library', 'content', 'feature_type']
+
+
+def content_key(content):
+    return ('pk', content.pk) if content.pk is not None else ('new', id(content))
+
+
+class BatchValidator:
+    """
+    Validate many unsaved Content, ContentFeature and Attachment instances at once.
+
+    Covers what ``full_clean()`` checks row by row, with a fixed number of
+    set-based queries per batch instead of several per instance: local field
+    values, existence of the referenced rows, that a library holds the
+    content's type, that feature values fit their feature type, that every
+    required feature of a new content is present and that attachment types
+    are allowed for the content's type.
+
+    Features and attachments may point to contents of the same batch
+    (unsaved) or to saved ones.
+    """
+
+    def __init__(self, contents=(), features=(), attachments=()):
+        self.contents = list(contents)
+        self.features = list(features)
+        self.attachments = list(attachments)
+        self.errors = defaultdict(list)
+
+    def add_error(self, instance, message):
+        self.errors[id(instance)].append(message)
+
+    def messages(self, instance):
+        return self.errors.get(id(instance), [])
+
+    def is_valid(self):
+        self.errors.clear()
+        self.clean_fields()
+        self.check_contents()
+        types = self.content_types()
+        self.check_features(types)
+        self.check_attachments(types)
+        return not self.errors
+
+    def clean_fields(self):
+        for instance in self.contents + self.features + self.attachments:
+            try:
+                instance.clean_fields(exclude=FOREIGN_KEYS)
+            except ValidationError as e:
+                for field, messages in e.message_dict.items():
+                    for message in messages:
+                        self.add_error(instance, "%s: %s" % (field, message))
+
+    def check_contents(self):
+        users = set(User.objects.filter(pk__in={c.creator_id for c in self.contents}).values_list('pk', flat=True))
+        types = set(ContentType.objects.filter(pk__in={c.type_id for c in self.contents})
+                    .values_list('pk', flat=True))
+        libraries = dict(Library.objects.filter(pk__in={c.library_id for c in self.contents if c.library_id})
+                         .values_list('pk', 'content_type_id'))
+        for content in self.contents:
+            if content.creator_id not in users:
+                self.add_error(content, "creator does not exist")
+            if content.type_id not in types:
+                self.add_error(content, "content type does not exist")
+            if content.library_id is not None:
+                if content.library_id not in libraries:
+                    self.add_error(content, "library does not exist")
+                elif libraries[content.library_id] != content.type_id:
+                    self.add_error(content, "chosen library has a different content type")
+
+    def content_types(self):
+        """Map every content the features and attachments refer to onto its content type id."""
+        saved = {instance.content_id for instance in self.features + self.attachments
+                 if instance.content_id is not None}
+        types = dict(Content.objects.filter(pk__in=saved).values_list('pk', 'type_id'))
+        return lambda instance: types.get(instance.content_id) if instance.content_id else instance.content.type_id
+
+    def check_features(self, content_type_of):
+        feature_types = ContentTypeFeature.objects.in_bulk({f.feature_type_id for f in self.features})
+        present = defaultdict(set)
+        for feature in self.features:
+            feature_type = feature_types.get(feature.feature_type_id)
+            if feature_type is None:
+                self.add_error(feature, "feature type does not exist")
+                continue
+            if feature_type.content_type_id != content_type_of(feature):
+                self.add_error(feature, "feature %s belongs to another content type" % feature_type.name)
+                continue
+            feature.feature_type = feature_type
+            try:
+                feature.fill_typed_value()
+            except ValidationError as e:
+                self.add_error(feature, "feature %s: %s" % (feature_type.name, "; ".join(e.messages)))
+            key = ('pk', feature.content_id) if feature.content_id else content_key(feature.content)
+            present[key].add(feature_type.pk)
+        required = defaultdict(list)
+        for feature_type in ContentTypeFeature.objects.filter(content_type__in={c.type_id for c in self.contents},
+                                                              required=True):
+            required[feature_type.content_type_id].append(feature_type)
+        for content in self.contents:
+            for feature_type in required[content.type_id]:
+                if feature_type.pk not in present[content_key(content)]:
+                    self.add_error(content, "feature %s is required" % feature_type.name)
+
+    def check_attachments(self, content_type_of):
+        through = ContentType.attachment_types.through
+        allowed = set(through.objects.filter(attachmenttype__in={a.type_id for a in self.attachments})
+                      .values_list('contenttype_id', 'attachmenttype_id'))
+        for attachment in self.attachments:
+            if (content_type_of(attachment), attachment.type_id) not in allowed:
+                self.add_error(attachment, "attachment type is not allowed for this content type")
@@ -1,28 +1,48 @@
-import mimetypes
+import json
 import os
+import re
 
+from asgiref.sync import sync_to_async
 from crispy_forms.helper import FormHelper
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import AuthenticationForm
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError, SuspiciousFileOperation, ObjectDoesNotExist
+from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
 from django.db import transaction
-from django.db.models import Q, Count
+from django.db.models import Q
 from django import forms
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, QueryDict
+from django.shortcuts import get_object_or_404
 from django.shortcuts import render, redirect
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.utils.text import slugify
+from django.views.decorators.http import require_http_methods, require_POST
 from django.views.generic import ListView, DetailView, CreateView, UpdateView
 
 from libcloud.models import Attachment
 from libcloud.models import Content, Library, ContentType, AttachmentType
-from libcloud.models import ContentTypeFeature
+from libcloud.models import ContentTypeFeature, UploadSession
 from .forms import ContentForm, \
     ContentFeatureFormset, AttachmentFormset
 from .forms import ContentTypeFeatureFormset, ContentTypeForm, AttachmentTypeForm
-from .forms import NewUserForm
+from .conditional import conditional_page, content_timestamps, content_type_timestamps, library_timestamps
+from .feature_filters import feature_parameters, filter_by_features
+from .fragments import fragment_context
+from .forms import ImportForm, NewUserForm
+from .pagination import KeysetPage, KeysetPaginationMixin
+from .quota import QuotaExceeded, check_quota
+from .search import SearchResults
+from .sidebar import get_library_summary
+from . import bulk_import, derivatives, export, metrics, uploads
+from .streaming import serve_file
 
 
 def home_page_view(request):
@@ -31,32 +51,14 @@ def home_page_view(request):
     current_user = request.user
     if request.user.is_authenticated:
         filter_file = Q()
-        filter_lib = Q()
         filter_file |= Q(creator=current_user)
-        filter_lib |= Q(user=current_user)
-        files = Content.objects.filter(filter_file).order_by('-id')[:5]
-        libs = Library.objects.filter(filter_lib).annotate(q_count=Count('content')) \
-                                 .order_by('-q_count')
+        files = Content.objects.filter(filter_file).select_related('type').order_by('-id')[:5]
         context.update({'files': files,
-                        'libraries' : libs})
+                        'libraries' : get_library_summary(current_user)})
 
     return render(request=request, template_name='libcloud/intro.html',context = context)
 
 
-def get_lib(request):
-    context = {}
-    context.update({'1':'1',
-               '2':'2'})
-    current_user = request.user
-    if request.user.is_authenticated:
-        filter_lib = Q()
-        filter_lib |= Q(user=current_user)
-        libs = Library.objects.filter(filter_lib).annotate(q_count=Count('content')) \
-                   .order_by('-q_count')
-        context.update({'libraries': libs})
-    return context
-
-
 def register_request(request):
     if request.method == "POST":
         form = NewUserForm(request.POST)
@@ -97,26 +99,58 @@ def login_request(request):
     return render(request=request, template_name="libcloud/login.html", context={"login_form": form})
 
 
+@method_decorator(conditional_page(content_timestamps), name='dispatch')
 class ContentView(DetailView):
     model = Content
 
-
-def download_file(request, user_prefix, filename):
-    if request.method == "GET":
-        file_path = os.path.join(settings.MEDIA_ROOT, user_prefix, filename)
-        if not os.path.exists(file_path):
+    def get_queryset(self):
+        return Content.objects.select_related('type', 'library')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Lazy: only evaluated when the cached fragments have to be rendered.
+        context['features'] = self.object.contentfeature_set.select_related('feature_type')
+        context['attachments'] = self.object.attachment_set.select_related('type')
+        context.update(fragment_context(self.request, self.object, self.object.type))
+        return context
+
+
+async def download_file(request, user_prefix, filename):
+    if request.method in ("GET", "HEAD"):
+        try:
+            file_path = await sync_to_async(default_storage.path)(f"{user_prefix}/{filename}")
+        except SuspiciousFileOperation:
+            raise Http404
+        if not await sync_to_async(os.path.isfile, thread_sensitive=False)(file_path):
             messages.error(request, f"{filename} doesn't exists.")
             return redirect("/")
 
-        mime_type, _ = mimetypes.guess_type(file_path)
-        with open(file_path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type=mime_type, status=200)
-            response['Content-Disposition'] = "attachment; filename=%s" % filename
-            return response
+        response = await sync_to_async(serve_file, thread_sensitive=False)(request, file_path, filename)
+        # Cacheable, but only after a conditional request (answered with a 304
+        # while ETag and Last-Modified still match).
+        patch_cache_control(response, no_cache=True)
+        return response
     else:
         return redirect('libcloud:download_file', user_prefix, filename)
 
 
+async def download_derivative(request, user_prefix, filename):
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    try:
+        file_path = await sync_to_async(default_storage.path)(
+            f"{user_prefix}/{derivatives.DERIVATIVES_DIR}/{filename}")
+    except SuspiciousFileOperation:
+        raise Http404
+    if not await sync_to_async(os.path.isfile, thread_sensitive=False)(file_path):
+        raise Http404
+    response = await sync_to_async(serve_file, thread_sensitive=False)(request, file_path, filename,
+                                                                       as_attachment=False)
+    # Derivative names change with the file's contents, so they never go stale.
+    response['Cache-Control'] = 'public, max-age=%d, immutable' % settings.LIBCLOUD_DERIVATIVE_MAX_AGE
+    return response
+
+
 @login_required
 def create_content(request, content_type_pk=-1):
     content_type_pk = int(content_type_pk)
@@ -177,6 +211,31 @@ def create_content(request, content_type_pk=-1):
             'form': form, 'formset_features': None, 'formset_attachments': None}, status=200)
 
 
+@login_required
+def import_contents(request):
+    if request.method == "POST":
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            manifest = form.cleaned_data['manifest']
+            try:
+                report = bulk_import.import_contents(
+                    request.user, form.cleaned_data['archive'].file, manifest=manifest,
+                    manifest_name=manifest.name if manifest else None, strict=form.cleaned_data['strict'])
+            except ValidationError as e:
+                messages.error(request, "; ".join(e.messages))
+            else:
+                for line, message in report.errors[:20]:
+                    messages.error(request, f"line {line}: {message}")
+                messages.info(request, f"{report.created} contents have been imported, "
+                                       f"{len(report.errors)} rows were rejected.")
+                return redirect("libcloud:import_contents")
+        else:
+            messages.error(request, form.errors)
+    else:
+        form = ImportForm()
+    return render(request, 'libcloud/import_form.html', {'form': form})
+
+
 @login_required
 def create_content_type(request):
     if request.method == "POST":
@@ -223,14 +282,15 @@ def my_attachment_types(request):
         else:
             messages.error(request, form.errors)
     form = AttachmentTypeForm()
+    page = KeysetPage(request, AttachmentType.objects.filter(user=request.user))
     return render(request, 'libcloud/attachmenttype_list.html', {
-        'form': form, 'attachment_types': AttachmentType.objects.filter(user=request.user)}, status=200)
+        'form': form, 'attachment_types': page.object_list, 'page_obj': page}, status=200)
 
 
 def my_content_types(request):
-    print(ContentType.objects.filter(user=request.user))
+    page = KeysetPage(request, ContentType.objects.filter(user=request.user))
     return render(request, 'libcloud/contenttype_list.html', {
-        'content_types': ContentType.objects.filter(user=request.user)})
+        'content_types': page.object_list, 'page_obj': page})
 
 
 def logout_request(request):
@@ -239,18 +299,38 @@ def logout_request(request):
     return redirect("/")
 
 
-class AllLibrariesView(ListView):
+def filter_contents(request, contents, feature_types):
+    """``contents`` filtered by the features in the query string, and the parameters of the filters applied."""
+    try:
+        return filter_by_features(contents, request.GET, feature_types), feature_parameters(request.GET)
+    except ValidationError as e:
+        messages.error(request, "; ".join(e.messages))
+        return contents, QueryDict(mutable=True)
+
+
+class AllLibrariesView(KeysetPaginationMixin, ListView):
     model = Library
 
     def get_queryset(self):
         return Library.objects.filter(user=self.request.user)
 
 
+@method_decorator(conditional_page(library_timestamps), name='dispatch')
 class EachLibraryView(DetailView):
     model = Library
 
     def get_queryset(self):
-        return Library.objects.filter(user=self.request.user)
+        return Library.objects.filter(user=self.request.user).select_related('content_type')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        contents, filters = filter_contents(self.request, self.object.content_set.all(),
+                                            self.object.content_type.contenttypefeature_set.all())
+        # Links, and the cache key of the listing, keep only what changes it.
+        context['page_obj'] = KeysetPage(self.request, contents, params=filters)
+        context['contents'] = context['page_obj'].object_list
+        context.update(fragment_context(self.request, self.object, self.object.content_type))
+        return context
 
 
 class LibraryForm(forms.ModelForm):
@@ -280,21 +360,25 @@ class LibraryCreateView(CreateView):
         return kwargs
 
 
-class MyContentView(ListView):
+class MyContentView(KeysetPaginationMixin, ListView):
     model = Content
+    descending = True
 
     def get_queryset(self):
-        return Content.objects.filter(creator=self.request.user)
+        contents, _ = filter_contents(self.request,
+                                      Content.objects.filter(creator=self.request.user).select_related('type'),
+                                      ContentTypeFeature.objects.filter(content_type__user=self.request.user))
+        return contents
 
 
-class MyContentTypeView(ListView):
+class MyContentTypeView(KeysetPaginationMixin, ListView):
     model = ContentType
 
     def get_queryset(self):
         return ContentType.objects.filter(user=self.request.user)
 
 
-class MyAttachmentTypeView(ListView):
+class MyAttachmentTypeView(KeysetPaginationMixin, ListView):
     model = AttachmentType
 
     def get_queryset(self):
@@ -324,9 +408,13 @@ class ContentTypeCreateView(CreateView):
         return super(ContentTypeCreateView, self).form_valid(form)
 
 
+@method_decorator(conditional_page(content_type_timestamps), name='dispatch')
 class EachContentTypeView(DetailView):
     model = ContentType
 
+    def get_queryset(self):
+        return ContentType.objects.prefetch_related('contenttypefeature_set', 'attachment_types')
+
 
 class LibrarySelectForm(forms.ModelForm):
     class Meta:
@@ -392,5 +480,156 @@ class AttachmentCreateView(CreateView):
         if obj.type not in list(obj.content.type.attachment_types.all()):
             form.add_error('type', 'invalid attachment type')
             return super(AttachmentCreateView, self).form_invalid(form)
+        try:
+            check_quota(content.creator, obj.file.size)
+        except QuotaExceeded as e:
+            form.add_error('file', e)
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def error_json(error, status=400):
+    message = "; ".join(error.messages) if isinstance(error, ValidationError) else str(error)
+    return JsonResponse({'error': message}, status=status)
+
+
+def upload_session_json(session):
+    return {
+        'id': str(session.pk),
+        'filename': session.filename,
+        'size': session.size,
+        'received': uploads.received_ranges(session),
+        'chunk_size': uploads.RECOMMENDED_CHUNK_SIZE,
+        'chunk_url': reverse('libcloud:upload_session', kwargs={'pk': session.pk}),
+        'finalize_url': reverse('libcloud:upload_finalize', kwargs={'pk': session.pk}),
+    }
+
+
+@login_required
+@require_POST
+def upload_init(request):
+    try:
+        data = json.loads(request.body)
+        session = UploadSession(user=request.user, filename=os.path.basename(str(data['filename'])),
+                                size=int(data['size']), checksum=str(data.get('sha256', '')).lower())
+        if data.get('kind', 'content') == 'content':
+            session.kind = UploadSession.Kind.Content
+            session.content_type = ContentType.objects.get(pk=data['content_type'], user=request.user)
+            if data.get('library') is not None:
+                session.library = Library.objects.get(pk=data['library'], user=request.user,
+                                                      content_type=session.content_type)
         else:
-            return super().form_valid(form)
+            session.kind = UploadSession.Kind.Attachment
+            session.content = Content.objects.select_related('type').get(pk=data['content'], creator=request.user)
+            session.attachment_type = session.content.type.attachment_types.get(pk=data['attachment_type'])
+        if session.size < 0 or not session.filename:
+            raise ValueError("invalid file")
+        # Refused here, before any chunk is sent; the session reserves the space.
+        check_quota(request.user, session.size)
+    except QuotaExceeded as e:
+        return error_json(e, status=413)
+    except (ValueError, KeyError, TypeError, ObjectDoesNotExist) as e:
+        return error_json(e)
+    session.save()
+    uploads.start_session(session)
+    return JsonResponse(upload_session_json(session), status=201)
+
+
+async def upload_chunk(request, pk):
+    # Django's ASGIHandler has spooled the whole body into a temporary file
+    # before this runs. The copy into the staged file runs in a thread of its
+    # own, so chunks are copied in parallel instead of queueing behind each
+    # other and the sync views on the one thread-sensitive thread; only the
+    # database writes go there. login_required and require_http_methods only
+    # wrap sync views in this Django version.
+    if request.method not in ("GET", "PUT", "DELETE"):
+        return HttpResponseNotAllowed(["GET", "PUT", "DELETE"])
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    session = await sync_to_async(get_object_or_404)(UploadSession, pk=pk, user=user)
+    if request.method == "GET":
+        return JsonResponse(await sync_to_async(upload_session_json)(session))
+    if request.method == "DELETE":
+        await sync_to_async(uploads.abort_session)(session)
+        return HttpResponse(status=204)
+
+    if session.updated_at < uploads.session_expiry_cutoff():
+        # An abandoned session gave its reservation up; it has to fit again.
+        try:
+            await sync_to_async(check_quota)(user, session.size, session=session)
+        except QuotaExceeded as e:
+            return error_json(e, status=413)
+
+    content_range = CONTENT_RANGE_RE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if content_range is not None:
+            offset = int(content_range.group(1))
+            if int(content_range.group(2)) - offset + 1 != length:
+                raise ValueError("Content-Range does not match Content-Length")
+        else:
+            offset = int(request.GET['offset'])
+        written = await sync_to_async(uploads.copy_chunk, thread_sensitive=False)(session, offset, request, length)
+    except (ValueError, KeyError, ValidationError) as e:
+        return error_json(e)
+    await sync_to_async(uploads.record_chunk)(session, offset, written)
+    status = 200 if written == length else 400
+    return JsonResponse(dict(await sync_to_async(upload_session_json)(session), written=written), status=status)
+
+
+@login_required
+@require_POST
+def upload_finalize(request, pk):
+    session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+    try:
+        data = json.loads(request.body or b'{}')
+        instance = uploads.finalize(session, checksum=str(data.get('sha256', '')), features=data.get('features'))
+    except (ValueError, ValidationError) as e:
+        return error_json(e)
+    return JsonResponse({'url': instance.get_absolute_url(), 'file': instance.file.url}, status=201)
+
+
+@login_required
+def search_contents(request):
+    query = request.GET.get('q', '')
+    paginator = Paginator(SearchResults(request.user, query), 20)
+    page = paginator.get_page(request.GET.get('page'))
+    return render(request, 'libcloud/search_results.html', {'query': query, 'page_obj': page})
+
+
+def archive_response(request, contents, filename):
+    archive_format = request.GET.get('format', 'zip')
+    if archive_format not in export.FORMATS:
+        return HttpResponse("unknown archive format %s" % archive_format, status=400)
+    return export.serve_archive(request, contents, filename, archive_format, compress=request.GET.get('compress') == '1')
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def export_library(request, pk):
+    library = get_object_or_404(Library, pk=pk, user=request.user)
+    return archive_response(request, library.content_set.all(), slugify(library.name) or 'library')
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def export_contents(request):
+    ids = [int(pk) for pk in request.GET.getlist('content') if pk.isdigit()]
+    if not ids:
+        messages.error(request, "Select the contents to download.")
+        return redirect('libcloud:my_content')
+    return archive_response(request, Content.objects.filter(creator=request.user, pk__in=ids), 'contents')
+
+
+@require_http_methods(["GET"])
+def serve_metrics(request):
+    token = settings.LIBCLOUD_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or token and constant_time_compare(authorization, 'Bearer %s' % token)):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render_prometheus(metrics.registry.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')